@@ -1,19 +1,50 @@
 """
 Flask API Server for Camera Analysis with YOLOv8 People Counting
 This server exposes REST endpoints for the Lovable dashboard to consume.
+
+Run with --async to serve through gevent instead of the Werkzeug development
+server (same routes; streams and SSE clients become greenlets, not threads).
 """
 
-from flask import Flask, jsonify, request, Response
+import sys
+
+# Async mode needs gevent's monkey patching before anything imports threading/socket
+ASYNC_MODE = __name__ == '__main__' and '--async' in sys.argv
+if ASYNC_MODE:
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        print("[ERROR] --async requires gevent: pip install gevent")
+        sys.exit(1)
+
+from flask import Flask, jsonify, request, Response, g
 from flask_cors import CORS
 from datetime import datetime
 import threading
 import time
 import cv2
 import base64
+import copy
+import gzip
 import io
+import json
 import numpy as np
 from PIL import Image
 import os
+import re
+from collections import deque
+from contextlib import contextmanager
+
+import config
+from detection_buffer import DetectionBuffer
+from frame_channel import FrameChannel, JPEG_QUALITY, STREAM_TIERS
+from heatmap_engine import HeatmapArchive, HeatmapEngine, quantize
+from history_store import HistoryStore, METRICS as HISTORY_METRICS
+from latency_tracker import LatencyTracker
+from metrics import MetricsRegistry, is_valid_snapshot, render_exposition
+from state_snapshot import SnapshotWriter, read_snapshot, saved_today
+from state_store import StateStore
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -21,6 +52,11 @@ CORS(app)  # Enable CORS for all routes
 # ============================================
 # GLOBAL ANALYTICS DATA (Updated by detection algorithm)
 # ============================================
+# Initial values only: live state is held in copy-on-write snapshots. Every
+# camera has its own StateStore (counts, settings, ROI) and FrameChannel (frames,
+# streams); `state` below holds the cross-camera aggregate plus the shared
+# sections. Handlers read a snapshot once per request; helpers change it inside
+# `with ....write() as draft:` and commit a new snapshot atomically.
 
 analytics_data = {
     "total_visitors": 0,
@@ -62,7 +98,9 @@ gender_classification_data = {
     "last_update": None
 }
 
-detections = []
+# Bounded ring of recent detections; each snapshot's "detection_count" says how many
+# had been added when it was taken (queries never look past it)
+detections = DetectionBuffer(config.DETECTIONS_BUFFER_SIZE)
 heatmap_data = []
 camera_status = {
     "cameras": [],
@@ -70,9 +108,96 @@ camera_status = {
     "detection_running": False
 }
 
-# Video streaming
-current_frame = None
-frame_lock = threading.Lock()
+# Per-camera counters mirrored into the aggregate "analytics" section
+camera_analytics_data = {
+    "total_visitors": 0,
+    "male_count": 0,
+    "female_count": 0,
+    "current_occupancy": 0
+}
+
+# Analytics change feed. Every state change that alters the analytics view is
+# diffed once against the previous view; the flattened changes
+# ("person_counting.total_count": 5) are kept in a bounded log keyed by state
+# version so clients can be sent only what changed and can resume later.
+analytics_fields = {}  # flattened view as of the last logged change
+analytics_changes = deque(maxlen=config.EVENTS_CHANGE_LOG_SIZE)  # (version, changed, removed)
+analytics_log_floor = 0  # changes after this version are all still in the log
+events_cond = threading.Condition()
+
+# Served state. The snapshot version increases on every change (counts, settings,
+# detections, heatmap, camera status); GETs use it as their ETag and it is the
+# sequence number for /api/events and the ?since= deltas. Writers hold
+# events_cond, so change-feed readers see commits and log entries together.
+state = StateStore({
+    "analytics": analytics_data,
+    "person_counting": person_counting_data,
+    "gender_classification": gender_classification_data,
+    "detection_count": 0,
+    "heatmap": heatmap_data,
+    "camera_status": camera_status,
+    "cameras": {},  # camera ID -> count summary
+}, lock=events_cond)
+ANALYTICS_SECTIONS = {"analytics", "person_counting", "gender_classification", "cameras"}
+
+# Cameras. Each one has its own state store and frame channel, each with its own
+# lock, so updates and frames from different cameras never wait on each other.
+# Requests name a camera with ?camera= (or /api/cameras/<id>/...); producers that
+# send none are the "default" camera.
+DEFAULT_CAMERA = "default"
+CAMERA_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+cameras = {}  # camera ID -> {"id", "state": StateStore, "frames": FrameChannel}; replaced as a whole on add
+cameras_lock = threading.Lock()  # only taken to add a camera
+INGEST_LISTS = ("counts", "gender", "detections", "positions")  # ingest fields holding lists of objects
+
+# Aggregate view. The "analytics", "person_counting", "gender_classification" and
+# "cameras" sections of `state` are sums over all cameras, kept up to date
+# incrementally: a camera commit marks the camera dirty and folding it applies
+# only the difference between its new and its last folded contribution.
+AGGREGATE_FIELDS = {
+    "analytics": ("total_visitors", "male_count", "female_count", "current_occupancy"),
+    "person_counting": ("total_count", "current_in_roi", "entries_today", "exits_today"),
+    "gender_classification": ("male_count", "female_count", "total_count"),
+}
+# Settings shown by the aggregate person counting view (those of the default camera)
+CAMERA_SETTINGS_FIELDS = ("enabled", "sensitivity", "confidence_threshold", "roi_config", "reset_token")
+aggregate_parts = {}  # camera ID -> contribution as last folded, {(section, field[, hour]): value}
+aggregate_sums = {}  # (section, field[, hour]) -> sum over cameras
+dirty_cameras = set()  # cameras committed since they were last folded
+dirty_traces = {}  # camera ID -> latency trace of its latest ingest, waiting for the fold
+aggregate_lock = threading.Lock()  # held by the one thread folding at a time
+
+# Per-camera occupancy heatmaps built from confirmed track positions (ingest "positions")
+heatmaps = HeatmapEngine()
+# Completed hours are archived as tiles next to the count history (started in __main__)
+heatmap_archive = HeatmapArchive(heatmaps, config.HISTORY_DB_PATH)
+
+# Persistent count history (entries/exits/gender/detections/occupancy), written
+# in batches by a background thread once started in __main__
+history = HistoryStore(config.HISTORY_DB_PATH)
+
+# Prometheus metrics: the server's own, plus the latest snapshot pushed by each
+# producer (detection services) via /api/internal/metrics; both served at /metrics
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram("api_request_seconds", "Request handling time (streams: until the response starts)",
+                                    ("endpoint",))
+requests_total = metrics.counter("api_requests_total", "Requests by endpoint and status code", ("endpoint", "status"))
+frames_received_total = metrics.counter("api_frames_received_total", "Frames stored from producers", ("camera",))
+ingest_items_total = metrics.counter("api_ingest_items_total", "Ingested updates/events by kind", ("camera", "kind"))
+pushed_metrics = {}  # (source, camera) -> (received at, snapshot)
+pushed_metrics_lock = threading.Lock()
+
+# End-to-end latency: producers' frame/count traces completed with the server's own
+# stages (received, committed, pushed to /api/events, streamed); see /api/latency
+latency = LatencyTracker(histogram=metrics.histogram(
+    "trace_latency_seconds", "Latency between traced pipeline stages (see /api/latency)", ("path", "hop"),
+    buckets=config.LATENCY_BUCKETS))
+count_traces = deque(maxlen=config.LATENCY_WINDOW)  # (aggregate version, trace) of folded counts
+count_traces_lock = threading.Lock()
+
+# Serialized /api/dashboard body for one state version, shared by all readers
+dashboard_cache = {"version": None, "body": None, "gzip": None}
+dashboard_lock = threading.Lock()
 
 
 # ============================================
@@ -95,8 +220,12 @@ def root():
             "POST /api/person-counting/settings",
             "POST /api/person-counting/update",
             "POST /api/person-counting/reset",
+            "GET  /api/cameras",
+            "GET  /api/cameras/<camera_id>",
+            "GET  /api/latency",
             "GET  /api/staff/attendance",
-            "POST /api/internal/update-count"
+            "POST /api/internal/update-count",
+            "POST /api/internal/ingest"
         ],
         "frontend_url": "http://localhost:8080"
     })
@@ -109,71 +238,656 @@ def api_info():
         "message": "Datamorphosis ML API",
         "endpoints": {
             "GET /api/status": "Get camera and system status",
-            "GET /api/analytics": "Get visitor analytics + person counting",
+            "GET /metrics": "Prometheus metrics: server plus pushed per-stage producer timings",
+            "GET /api/latency": "End-to-end p50/p95/p99 latency per traced hop (camera to dashboard)",
+            "GET /api/dashboard": "Status, analytics, counting, gender, detections and heatmap in one cached response",
+            "GET /api/analytics": "Get visitor analytics + person counting (aggregated over cameras)",
+            "GET /api/events": "Push analytics changes (server-sent events, resumable)",
             "GET /api/detections": "Get recent detections",
             "GET /api/heatmap": "Get heatmap data",
+            "GET /api/history": "Historical counts by range/granularity/camera/gender (persisted rollups)",
+            "GET /api/heatmap/history": "Archived heatmap summed over a range, hours of day and weekdays",
+            "GET /api/video/viewers": "Get active video stream subscribers",
+            "GET /api/video/metadata": "Per-frame detection metadata (server-sent events)",
             "GET /api/person-counting": "Get person counting specific data",
             "GET /api/gender-classification": "Get gender classification data",
+            "GET /api/cameras": "List cameras with count summaries, frame sequence and viewers",
+            "GET /api/cameras/<camera_id>": "One camera's counts, gender and settings",
+            "GET|POST /api/cameras/<camera_id>/...": "Per-camera person-counting, settings, reset, stream, frame, metadata, viewers, heatmap, heatmap/history",
             "POST /api/person-counting/settings": "Update counting settings",
             "POST /api/person-counting/update": "Update count from detection script",
             "POST /api/person-counting/reset": "Reset counts and occupancy tracking",
             "GET /api/staff/attendance": "Get staff attendance summary",
             "POST /api/gender-classification/update": "Update gender classification data",
-            "POST /api/internal/update-count": "Internal count update endpoint"
+            "POST /api/internal/update-count": "Internal count update endpoint",
+            "POST /api/internal/ingest": "Batched counts/detections ingest, returns current settings",
+            "POST /api/internal/metrics": "Producer metrics push (exposed at /metrics)"
         }
     })
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_seconds.labels(endpoint).observe(time.perf_counter() - started)
+        requests_total.labels(endpoint, response.status_code).inc()
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus text exposition of the server's metrics and every producer's
+    last push (labelled with its source and camera; pushes older than
+    config.METRICS_PUSH_TTL are left out).
+    """
+    collect_server_gauges()
+    sources = [({}, metrics.snapshot())]
+    cutoff = time.time() - config.METRICS_PUSH_TTL
+    with pushed_metrics_lock:
+        for key, (received_at, snapshot) in list(pushed_metrics.items()):
+            if received_at < cutoff:
+                del pushed_metrics[key]
+            else:
+                sources.append(({"source": key[0], "camera": key[1]}, snapshot))
+    return Response(render_exposition(sources), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def collect_server_gauges():
+    """Refresh gauges that are read from server state rather than counted as they happen"""
+    snapshot = state.get()
+    metrics.gauge("api_state_version", "Aggregate state version").set(snapshot.version)
+    metrics.gauge("api_cameras", "Cameras known to the server").set(len(cameras))
+    metrics.gauge("api_detections_buffered", "Detections held in the ring buffer").set(len(detections))
+    viewers = metrics.gauge("api_stream_viewers", "Active stream viewers", ("camera", "tier"))
+    for camera_id, camera in cameras.items():
+        for tier, count in camera["frames"].viewer_state().items():
+            if tier != "total":
+                viewers.labels(camera_id, tier).set(count)
+    history_stats = history.get_stats()
+    metrics.gauge("api_history_pending", "History events waiting for the writer").set(history_stats["pending"])
+    metrics.gauge("api_history_dropped", "History events dropped because the writer fell behind").set(
+        history_stats["dropped"])
+
+
+@app.route('/api/internal/metrics', methods=['POST'])
+def internal_push_metrics():
+    """
+    Producers push their MetricsRegistry snapshot here (replacing their last one).
+    
+    Body: {"source": "people_counter", "camera": "default", "metrics": {...}}
+    """
+    data = request.get_json(silent=True) or {}
+    source, snapshot = data.get('source'), data.get('metrics')
+    if not isinstance(source, str) or not isinstance(snapshot, dict) or not is_valid_snapshot(snapshot):
+        return jsonify({"success": False, "error": "source and a metrics snapshot are required"}), 400
+    store_producer_metrics(source, data.get('camera') or DEFAULT_CAMERA, snapshot)
+    return jsonify({"success": True})
+
+
+@app.route('/api/latency', methods=['GET'])
+def latency_report():
+    """
+    End-to-end latency percentiles per traced hop, over the latest samples.
+
+    count: capture -> detected -> queued -> sent -> received -> committed -> pushed (/api/events)
+    frame: capture -> detected -> encoded -> sent -> received -> streamed (MJPEG)
+    Every stage also has a cumulative capture->stage entry. "slo" checks the p99
+    of a count reaching a dashboard against config.COUNT_LATENCY_SLO.
+    """
+    p99 = latency.percentile("count", "capture->pushed", 99)
+    return jsonify({
+        "window": latency.window,
+        "paths": latency.summary(),
+        "slo": {
+            "hop": "count capture->pushed",
+            "target_ms": config.COUNT_LATENCY_SLO * 1000,
+            "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+            "met": p99 <= config.COUNT_LATENCY_SLO if p99 is not None else None
+        },
+        "timestamp": datetime.now().isoformat()
+    })
+
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get camera and system status"""
-    return jsonify({
+    return conditional_json(build_status_view)
+
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """
+    Everything the dashboard shows in one response: status, analytics, person
+    counting, gender classification, recent detections and heatmap.
+    
+    The body is serialized (and gzipped, for clients that accept it) once per
+    state version and cached as bytes, so repeat reads are a memory copy no
+    matter how many dashboards poll.
+    """
+    snapshot = state.get()
+    etag = f"v{snapshot.version}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        response = Response(get_dashboard_body(snapshot, use_gzip), mimetype='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def get_dashboard_body(snapshot, use_gzip=False):
+    """Return the cached dashboard JSON bytes for a snapshot's version, building them on first use"""
+    version = snapshot.version
+    with dashboard_lock:
+        if dashboard_cache["version"] != version:
+            payload = {
+                "version": version,
+                "generated_at": datetime.now().isoformat(),
+                "status": build_status_view(snapshot),
+                "analytics": build_analytics_view(snapshot),
+                "person_counting": build_person_counting_view(snapshot),
+                "gender_classification": build_gender_view(snapshot),
+                "detections": build_detections_view(snapshot),
+                "heatmap": {"zones": snapshot["heatmap"]}
+            }
+            dashboard_cache.update(version=version, body=json.dumps(payload).encode(), gzip=None)
+        if not use_gzip:
+            return dashboard_cache["body"]
+        if dashboard_cache["gzip"] is None:
+            dashboard_cache["gzip"] = gzip.compress(dashboard_cache["body"], compresslevel=6)
+        return dashboard_cache["gzip"]
+
+
+def build_status_view(snapshot):
+    """Camera and system status payload"""
+    camera_status = snapshot["camera_status"]
+    return {
         "status": "online",
         "timestamp": datetime.now().isoformat(),
         "cameras": camera_status["cameras"],
         "system_status": camera_status["system_status"],
-        "detection_running": camera_status["detection_running"]
-    })
+        "detection_running": camera_status["detection_running"],
+        # Cameras whose detection service is shedding load (level > 0)
+        "degraded_cameras": {
+            camera_id: summary["degradation"]
+            for camera_id, summary in snapshot["cameras"].items()
+            if (summary.get("degradation") or {}).get("level")
+        }
+    }
 
 
 @app.route('/api/analytics', methods=['GET'])
 def get_analytics():
-    """Get current analytics data including person counting and gender classification"""
-    return jsonify({
+    """
+    Get current analytics data including person counting and gender classification.
+    
+    With ?since=<version> only the fields changed after that version are returned
+    ("delta": true, same format as /api/events changes), or the full view
+    ("delta": false) if the change log no longer reaches back that far.
+    """
+    since = request.args.get('since', type=int)
+    
+    def build(snapshot):
+        with events_cond:
+            if since is not None and can_resume_from(since):
+                changed, removed = collect_changes_since(since, snapshot.version)
+                return {"delta": True, "since": since, "changes": changed, "removed": removed}
+        view = build_analytics_view(snapshot)
+        view["delta"] = False
+        view["timestamp"] = datetime.now().isoformat()
+        return view
+    
+    return conditional_json(build)
+
+
+def conditional_json(build_payload, store=None, tag='v'):
+    """
+    Serve build_payload(snapshot) as JSON tagged with the snapshot's version.
+    
+    store defaults to the aggregate state; camera views pass the camera's store
+    and a camera-specific tag so their ETags never collide. Clients that send
+    If-None-Match with the current version get a bare 304 and the payload is
+    never built or serialized.
+    """
+    snapshot = (store or state).get()
+    etag = f"{tag}{snapshot.version}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        payload = build_payload(snapshot)
+        payload["version"] = snapshot.version
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # always revalidate, 304 is cheap
+    return response
+
+
+@app.route('/api/events', methods=['GET'])
+def analytics_events():
+    """
+    Server-sent analytics updates (replaces polling /api/analytics).
+    
+    Sends a "snapshot" event with the full analytics view, then "changes" events
+    carrying only the fields that changed, flattened to dotted paths. Changes are
+    coalesced to at most one event per ?interval= seconds per client. Reconnecting
+    clients resume from the Last-Event-ID header (or ?since=) and get only what
+    they missed, or a fresh snapshot if it has fallen out of the change log.
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = int(since) if since and since.isdigit() else None
+    interval = max(config.EVENTS_MIN_INTERVAL, request.args.get('interval', 1.0, type=float))
+    
+    def generate():
+        yield b': connected\n\n'
+        with events_cond:
+            last_seq = since if can_resume_from(since) else None
+            if last_seq is None:
+                last_seq = state.version
+                snapshot = build_analytics_view(state.get())
+        if since is None or last_seq != since:
+            yield format_event("snapshot", last_seq, {"seq": last_seq, "snapshot": snapshot})
+        delivered_seq = last_seq
+        
+        last_sent = time.time()
+        while True:
+            with events_cond:
+                if state.version == last_seq:
+                    events_cond.wait(timeout=15)
+                event = None
+                if state.version != last_seq:
+                    if can_resume_from(last_seq):
+                        changed, removed = collect_changes_since(last_seq)
+                        last_seq = state.version
+                        if changed or removed:  # other state (e.g. detections) may have moved the version
+                            event = format_event("changes", last_seq,
+                                                 {"seq": last_seq, "changes": changed, "removed": removed})
+                    else:
+                        # This client fell further behind than the change log reaches
+                        last_seq = state.version
+                        event = format_event("snapshot", last_seq,
+                                             {"seq": last_seq, "snapshot": build_analytics_view(state.get())})
+            if event is None:
+                if time.time() - last_sent < 15:
+                    continue
+                event = b': keep-alive\n\n'
+            yield event
+            last_sent = time.time()
+            if last_seq != delivered_seq:
+                record_count_delivery(delivered_seq, last_seq)
+                delivered_seq = last_seq
+            time.sleep(interval)  # per-client throttle; changes meanwhile go out in one event
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def record_count_delivery(after, upto):
+    """Record the "pushed" stage of traced counts folded in versions after..upto (just sent to a client)"""
+    now = time.time()
+    delivered = []
+    with count_traces_lock:
+        for version, trace in reversed(count_traces):
+            if version <= after:
+                break
+            if version <= upto:
+                delivered.append(trace)
+    for trace in delivered:
+        latency.record_stage("count", trace, "pushed", now)
+
+
+def build_analytics_view(snapshot):
+    """Build the analytics payload shared by /api/analytics and /api/events"""
+    analytics_data = snapshot["analytics"]
+    person_counting_data = snapshot["person_counting"]
+    gender_classification_data = snapshot["gender_classification"]
+    return {
         "total_visitors": analytics_data["total_visitors"],
         "male_count": gender_classification_data["male_count"],  # Use gender classification data
         "female_count": gender_classification_data["female_count"],  # Use gender classification data
         "current_occupancy": analytics_data["current_occupancy"],
         "hourly_data": analytics_data["hourly_data"],
-        "age_distribution": analytics_data["age_distribution"],
-        "person_counting": person_counting_data,
-        "gender_classification": gender_classification_data,
-        "timestamp": datetime.now().isoformat()
-    })
+        "age_distribution": dict(analytics_data["age_distribution"]),
+        "person_counting": {k: v for k, v in person_counting_data.items() if not k.startswith('_')},
+        "gender_classification": dict(gender_classification_data),
+        "cameras": snapshot["cameras"]
+    }
+
+
+def flatten_fields(data, prefix=''):
+    """Flatten nested dicts to {"a.b": value}; lists and scalars are leaves"""
+    fields = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            fields.update(flatten_fields(value, path + '.'))
+        else:
+            fields[path] = value
+    return fields
+
+
+def publish_analytics_change(old, new, touched):
+    """
+    State commit hook: diff the analytics view against the last published one,
+    log any changes and wake event streams (runs under the write lock, events_cond).
+    """
+    global analytics_fields, analytics_log_floor
+    if touched & ANALYTICS_SECTIONS:
+        fields = flatten_fields(build_analytics_view(new))
+        changed = {k: v for k, v in fields.items() if k not in analytics_fields or analytics_fields[k] != v}
+        removed = [k for k in analytics_fields if k not in fields]
+        if changed or removed:
+            analytics_fields = fields
+            if len(analytics_changes) == analytics_changes.maxlen:
+                analytics_log_floor = analytics_changes[0][0]
+            analytics_changes.append((new.version, changed, removed))
+    events_cond.notify_all()
+
+
+def can_resume_from(seq):
+    """Whether the change log still covers everything after version seq (events_cond held)"""
+    return seq is not None and analytics_log_floor <= seq <= state.version
+
+
+def collect_changes_since(seq, until=None):
+    """Merge logged changes after seq (up to version until) into one (changed, removed) pair (events_cond held)"""
+    changed, removed = {}, set()
+    for entry_seq, entry_changed, entry_removed in analytics_changes:
+        if entry_seq <= seq:
+            continue
+        if until is not None and entry_seq > until:
+            break
+        for key in entry_removed:
+            changed.pop(key, None)
+            removed.add(key)
+        for key, value in entry_changed.items():
+            changed[key] = value
+            removed.discard(key)
+    return changed, sorted(removed)
+
+
+def format_event(event_type, seq, payload):
+    """Serialize one server-sent event"""
+    return f"id: {seq}\nevent: {event_type}\ndata: {json.dumps(payload)}\n\n".encode()
+
+
+# Baseline for the change feed, so the first change only carries what changed
+analytics_fields = flatten_fields(build_analytics_view(state.get()))
+state.on_commit = publish_analytics_change
 
 
 @app.route('/api/detections', methods=['GET'])
 def get_detections():
-    """Get recent detections"""
-    return jsonify({
-        "detections": detections[-50:],  # Last 50 detections
+    """
+    Get recent detections, oldest first.
+    
+    Query parameters (all optional, combinable):
+        since:  state version; only detections added after it
+        camera: camera name
+        type:   detection type (e.g. "person")
+        start / end: time range, ISO 8601 or epoch seconds
+        limit:  max results, newest kept (default 50 without since)
+    """
+    try:
+        start = parse_time_param(request.args.get('start'))
+        end = parse_time_param(request.args.get('end'))
+    except ValueError:
+        return jsonify({"error": "start/end must be ISO 8601 or epoch seconds"}), 400
+    since = request.args.get('since', type=int)
+    filters = {
+        "camera": request.args.get('camera'),
+        "detection_type": request.args.get('type'),
+        "start": start,
+        "end": end,
+        "limit": request.args.get('limit', type=int)
+    }
+    return conditional_json(lambda snapshot: {
+        "detections": build_detections_view(snapshot, since, **filters),
         "timestamp": datetime.now().isoformat()
     })
 
 
+def build_detections_view(snapshot, since=None, camera=None, detection_type=None,
+                          start=None, end=None, limit=None):
+    """Detections in the snapshot matching the filters (last 50 when nothing narrows it down)"""
+    if limit is None:
+        limit = 50 if since is None and start is None else config.DETECTIONS_MAX_DELTA
+    return detections.query(
+        snapshot["detection_count"],
+        camera=camera,
+        detection_type=detection_type,
+        start=start,
+        end=end,
+        since_version=since,
+        limit=max(1, min(limit, config.DETECTIONS_MAX_DELTA))
+    )
+
+
+def parse_time_param(value):
+    """Parse an ISO 8601 or epoch-seconds query parameter to epoch seconds (None if absent)"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
 @app.route('/api/heatmap', methods=['GET'])
-def get_heatmap():
-    """Get heatmap data"""
+@app.route('/api/cameras/<camera_id>/heatmap', methods=['GET'])
+def get_heatmap(camera_id=None):
+    """
+    Get heatmap data.
+    
+    Without parameters: zone data plus the cameras that have an occupancy heatmap.
+    With ?camera= and/or ?format=grid|png: that camera's decayed occupancy grid,
+    either as JSON (uint8 cells, row-major, base64) or as a grayscale PNG. Renders
+    are cached per camera until the next position arrives; ETag is the heatmap version.
+    """
+    camera = requested_camera_id()
+    fmt = request.args.get('format')
+    if camera is None and fmt is None:
+        return conditional_json(lambda snapshot: {
+            "zones": snapshot["heatmap"],
+            "cameras": heatmaps.cameras(),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    camera = camera or DEFAULT_CAMERA
+    if heatmaps.version(camera) is None:
+        return jsonify({"error": f"No heatmap for camera '{camera}'"}), 404
+    etag = f"h{heatmaps.version(camera)}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        render = heatmaps.render(camera, with_png=(fmt == 'png'))
+        etag = f"h{render['version']}"
+        if fmt == 'png':
+            response = Response(render["png"], mimetype='image/png')
+        else:
+            height, width = render["array"].shape
+            response = jsonify({
+                "camera": camera,
+                "width": width,
+                "height": height,
+                "encoding": "uint8-base64",  # row-major, 255 = hottest cell
+                "data": render["data"],
+                "peak": render["peak"],
+                "half_life": heatmaps.half_life,
+                "updated_at": render["updated_at"],
+                "version": render["version"]
+            })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/heatmap/history', methods=['GET'])
+@app.route('/api/cameras/<camera_id>/heatmap/history', methods=['GET'])
+def get_heatmap_history(camera_id=None):
+    """
+    Summed occupancy heatmap from the hourly tile archive.
+    
+    Query parameters:
+        camera:      camera ID, or /api/cameras/<id>/heatmap/history (default: DEFAULT_CAMERA)
+        start / end: ISO 8601 or epoch seconds (default: the last 7 days)
+        hours:       local hour range, e.g. 14-16 for 14:00-16:00, 22-2 overnight (or 14 for 14:00-15:00)
+        weekdays:    e.g. sat,sun or 5,6 (0 = Monday)
+        level:       pyramid level, 0 = full grid, each level halves the resolution
+        format:      grid (JSON, same layout as /api/heatmap) | png
+    
+    Example - the last four Saturdays 14:00-16:00:
+        /api/heatmap/history?start=<4 weeks ago>&weekdays=sat&hours=14-16
+    """
+    try:
+        end = parse_time_param(request.args.get('end')) or time.time()
+        start = parse_time_param(request.args.get('start')) or end - 7 * 86400
+        hours = parse_hour_range(request.args.get('hours'))
+        weekdays = parse_weekdays(request.args.get('weekdays'))
+    except ValueError as e:
+        return jsonify({"error": str(e) or "start/end must be ISO 8601 or epoch seconds"}), 400
+    level = min(max(request.args.get('level', 0, type=int), 0), config.HEATMAP_PYRAMID_LEVELS - 1)
+    camera = requested_camera_id() or DEFAULT_CAMERA
+    
+    grid, tiles = heatmap_archive.query(camera, start, end, hours=hours, weekdays=weekdays, level=level)
+    if grid is None:
+        return jsonify({"error": f"No archived heatmap for camera '{camera}' in that range"}), 404
+    array = quantize(grid)
+    if request.args.get('format') == 'png':
+        _, buffer = cv2.imencode('.png', array)
+        return Response(buffer.tobytes(), mimetype='image/png')
+    height, width = array.shape
     return jsonify({
-        "zones": heatmap_data,
+        "camera": camera,
+        "width": width,
+        "height": height,
+        "level": level,
+        "encoding": "uint8-base64",  # row-major, 255 = hottest cell
+        "data": base64.b64encode(array.tobytes()).decode('ascii'),
+        "peak": float(grid.max()),   # positions in the hottest cell
+        "total": float(grid.sum()),  # positions in the range
+        "tiles": tiles,
+        "start": start,
+        "end": end,
         "timestamp": datetime.now().isoformat()
     })
 
 
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def parse_hour_range(value):
+    """
+    Parse "14-16" (14:00-16:00), "22-2" (overnight, 22:00-02:00) or "14" into
+    the set of local hours of day it covers
+    """
+    if not value:
+        return None
+    try:
+        if '-' in value:
+            first, end = (int(part) for part in value.split('-', 1))
+        else:
+            first = int(value)
+            end = first + 1
+    except ValueError:
+        raise ValueError("hours must look like 14-16, 22-2 or 14")
+    if not 0 <= first <= 23 or not 0 <= end <= 24:
+        raise ValueError("hours must be within 0-24")
+    if end == first:
+        raise ValueError(f"hours range {value} is empty (use e.g. {first}-{(first + 1) % 24} for one hour)")
+    if end > first:
+        return set(range(first, end))
+    return set(range(first, 24)) | set(range(end))  # wraps past midnight
+
+
+def parse_weekdays(value):
+    """Parse "sat,sun" or "5,6" into a set of weekday numbers (0 = Monday)"""
+    if not value:
+        return None
+    days = set()
+    for part in value.lower().split(','):
+        part = part.strip()[:3]
+        if part.isdigit() and int(part) < 7:
+            days.add(int(part))
+        elif part in WEEKDAY_NAMES:
+            days.add(WEEKDAY_NAMES.index(part))
+        else:
+            raise ValueError("weekdays must be names (mon-sun) or numbers 0-6")
+    return days
+
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """
+    Historical counts from the persisted minute/hour/day rollups.
+    
+    Query parameters:
+        metric:      entries | exits | male | female | detections | occupancy (default entries)
+        start / end: ISO 8601 or epoch seconds (default: the last 24 hours)
+        granularity: minute | hour | day (default: picked from the range)
+        step:        buckets merged per point, e.g. granularity=minute&step=15
+        camera:      only this camera
+        breakdown:   gender (male/female series) | camera (one series per camera)
+    
+    Returns bucket start times (epoch seconds) and one zero-filled value array per
+    series. Occupancy series are bucket averages, with per-bucket "peak" arrays.
+    """
+    try:
+        end = parse_time_param(request.args.get('end')) or time.time()
+        start = parse_time_param(request.args.get('start')) or end - 86400
+    except ValueError:
+        return jsonify({"error": "start/end must be ISO 8601 or epoch seconds"}), 400
+    metric = request.args.get('metric', 'entries')
+    granularity = request.args.get('granularity')
+    breakdown = request.args.get('breakdown')
+    if metric not in HISTORY_METRICS:
+        return jsonify({"error": f"metric must be one of {', '.join(HISTORY_METRICS)}"}), 400
+    if granularity is not None and granularity not in ("minute", "hour", "day"):
+        return jsonify({"error": "granularity must be minute, hour or day"}), 400
+    if breakdown not in (None, "gender", "camera"):
+        return jsonify({"error": "breakdown must be gender or camera"}), 400
+    if start >= end:
+        return jsonify({"error": "start must be before end"}), 400
+    
+    result = history.series(
+        metric, start, end,
+        granularity=granularity,
+        step=request.args.get('step', 1, type=int),
+        camera=request.args.get('camera'),
+        breakdown=breakdown
+    )
+    result["timestamp"] = datetime.now().isoformat()
+    return jsonify(result)
+
+
 @app.route('/api/person-counting', methods=['GET'])
-def get_person_counting():
-    """Get person counting specific data"""
-    return jsonify({
+@app.route('/api/cameras/<camera_id>/person-counting', methods=['GET'])
+def get_person_counting(camera_id=None):
+    """Get person counting data for ?camera= (or the aggregate over all cameras)"""
+    camera_id = requested_camera_id()
+    if camera_id is None:
+        return conditional_json(build_person_counting_view)
+    camera = get_camera(camera_id)
+    if camera is None:
+        return camera_not_found(camera_id)
+    return conditional_json(build_person_counting_view, camera["state"], f"{camera_id}-v")
+
+
+def build_person_counting_view(snapshot):
+    """Person counting payload (a camera snapshot, or the aggregate with the default camera's settings)"""
+    person_counting_data = snapshot["person_counting"]
+    return {
         "enabled": person_counting_data["enabled"],
         "sensitivity": person_counting_data["sensitivity"],
         "total_count": person_counting_data["total_count"],
@@ -186,33 +900,41 @@ def get_person_counting():
         "roi_config": person_counting_data["roi_config"],
         "reset_token": person_counting_data["reset_token"],
         "timestamp": datetime.now().isoformat()
-    })
+    }
 
 
 @app.route('/api/person-counting/settings', methods=['POST'])
-def update_person_counting_settings():
-    """Update person counting settings from dashboard"""
-    global person_counting_data
+@app.route('/api/cameras/<camera_id>/settings', methods=['POST'])
+def update_person_counting_settings(camera_id=None):
+    """Update a camera's person counting settings from dashboard (default camera if none given)"""
     data = request.get_json()
+    camera_id = requested_camera_id(data) or DEFAULT_CAMERA
+    camera = get_camera(camera_id, create=True)
+    if camera is None:
+        return invalid_camera(camera_id)
     
-    if 'enabled' in data:
-        person_counting_data['enabled'] = data['enabled']
-    if 'sensitivity' in data:
-        person_counting_data['sensitivity'] = data['sensitivity']
-        # Convert sensitivity (0-100) to confidence threshold (0.5-0.95)
-        person_counting_data['confidence_threshold'] = 0.5 + (data['sensitivity'] / 100) * 0.45
-    if 'roi_config' in data:
-        # If ROI config is provided, update it (can be None or a dict)
-        if data['roi_config'] is None:
-            person_counting_data['roi_config'] = None
-        elif isinstance(data['roi_config'], dict):
-            if person_counting_data['roi_config'] is None:
-                person_counting_data['roi_config'] = {}
-            person_counting_data['roi_config'].update(data['roi_config'])
+    with write_camera(camera_id) as draft:
+        person_counting_data = draft["person_counting"]
+        if 'enabled' in data:
+            person_counting_data['enabled'] = data['enabled']
+        if 'sensitivity' in data:
+            person_counting_data['sensitivity'] = data['sensitivity']
+            # Convert sensitivity (0-100) to confidence threshold (0.5-0.95)
+            person_counting_data['confidence_threshold'] = 0.5 + (data['sensitivity'] / 100) * 0.45
+        if 'roi_config' in data:
+            # If ROI config is provided, update it (can be None or a dict)
+            if data['roi_config'] is None:
+                person_counting_data['roi_config'] = None
+            elif isinstance(data['roi_config'], dict):
+                if person_counting_data['roi_config'] is None:
+                    person_counting_data['roi_config'] = {}
+                person_counting_data['roi_config'].update(data['roi_config'])
     
+    person_counting_data = camera["state"].get()["person_counting"]
     return jsonify({
         "success": True,
         "message": "Settings updated successfully",
+        "camera": camera_id,
         "current_settings": {
             "enabled": person_counting_data["enabled"],
             "sensitivity": person_counting_data["sensitivity"],
@@ -224,55 +946,60 @@ def update_person_counting_settings():
 
 @app.route('/api/person-counting/update', methods=['POST'])
 def update_person_counting():
-    """Update person counting data from detection script"""
-    global person_counting_data
+    """Update person counting data from detection script (body may name a "camera")"""
     data = request.get_json()
+    camera_id = requested_camera_id(data) or DEFAULT_CAMERA
+    camera = get_camera(camera_id, create=True)
+    if camera is None:
+        return invalid_camera(camera_id)
     
-    total_count = data.get('total_count', person_counting_data['total_count'])
-    current_in_roi = data.get('current_in_roi', person_counting_data['current_in_roi'])
-    
-    update_person_count(total_count, current_in_roi)
+    with write_camera(camera_id) as draft:
+        apply_person_count(draft, data.get('total_count'), data.get('current_in_roi'), camera_id)
     
+    person_counting_data = camera["state"].get()["person_counting"]
     return jsonify({
         "success": True,
         "message": "Person count updated successfully",
+        "camera": camera_id,
         "total_count": person_counting_data["total_count"],
         "current_in_roi": person_counting_data["current_in_roi"]
     })
 
 
 @app.route('/api/person-counting/reset', methods=['POST'])
-def reset_person_counting():
-    """Reset person counting totals, occupancy, and gender counts"""
-    global person_counting_data, analytics_data, gender_classification_data
+@app.route('/api/cameras/<camera_id>/reset', methods=['POST'])
+def reset_person_counting(camera_id=None):
+    """
+    Reset person counting totals, occupancy, and gender counts of ?camera=
+    (or of every camera, including the aggregate peak, if none is given).
+    """
+    camera_id = requested_camera_id(request.get_json(silent=True))
+    if camera_id is None:
+        reset_ids = list(cameras)
+    elif get_camera(camera_id) is None:
+        return camera_not_found(camera_id)
+    else:
+        reset_ids = [camera_id]
     
-    person_counting_data.update({
-        "total_count": 0,
-        "current_in_roi": 0,
-        "entries_today": 0,
-        "exits_today": 0,
-        "peak_occupancy": 0,
-        "peak_time": None,
-        "hourly_foot_traffic": {},
-        "_last_count": 0,
-        "reset_token": person_counting_data.get("reset_token", 0) + 1,
-    })
-    gender_classification_data.update({
-        "male_count": 0,
-        "female_count": 0,
-        "total_count": 0,
-        "last_update": datetime.now().isoformat()
-    })
-    analytics_data.update({
-        "total_visitors": 0,
-        "male_count": 0,
-        "female_count": 0,
-        "current_occupancy": 0
-    })
+    for reset_id in reset_ids:
+        # One commit per camera, so no reader ever sees a camera half reset
+        with write_camera(reset_id) as draft:
+            apply_reset(draft)
+    # The response reports the aggregate, so fold the resets in before reading it
+    fold_camera_changes(wait=True)
+    if camera_id is None:
+        with state.write() as draft:
+            draft["person_counting"].update({"peak_occupancy": 0, "peak_time": None})
+        snapshot = state.get()
+    else:
+        snapshot = cameras[camera_id]["state"].get()
     
+    person_counting_data = snapshot["person_counting"]
+    gender_classification_data = snapshot["gender_classification"]
     return jsonify({
         "success": True,
         "message": "Person counting data reset successfully",
+        "cameras": reset_ids,
         "total_count": person_counting_data["total_count"],
         "current_in_roi": person_counting_data["current_in_roi"],
         "male_count": gender_classification_data["male_count"],
@@ -280,6 +1007,41 @@ def reset_person_counting():
     })
 
 
+@app.route('/api/cameras', methods=['GET'])
+def list_cameras():
+    """List cameras with their count summaries, state version, frame sequence and stream viewers"""
+    summaries = state.get()["cameras"]
+    return jsonify({
+        "cameras": [
+            {
+                "id": camera_id,
+                "version": camera["state"].version,
+                "frame_seq": camera["frames"].seq,
+                "viewers": camera["frames"].viewer_state(),
+                **summaries.get(camera_id, {})
+            }
+            for camera_id, camera in cameras.items()
+        ],
+        "timestamp": datetime.now().isoformat()
+    })
+
+
+@app.route('/api/cameras/<camera_id>', methods=['GET'])
+def get_camera_view(camera_id):
+    """One camera's analytics, person counting (with settings) and gender data"""
+    camera = get_camera(camera_id)
+    if camera is None:
+        return camera_not_found(camera_id)
+    return conditional_json(lambda snapshot: {
+        "camera": camera_id,
+        "analytics": dict(snapshot["analytics"]),
+        "person_counting": build_person_counting_view(snapshot),
+        "gender_classification": build_gender_view(snapshot),
+        "degradation": snapshot.get("degradation"),
+        "timestamp": datetime.now().isoformat()
+    }, camera["state"], f"{camera_id}-v")
+
+
 @app.route('/api/staff/attendance', methods=['GET'])
 def get_staff_attendance():
     """
@@ -294,15 +1056,17 @@ def get_staff_attendance():
 
 @app.route('/api/internal/update-count', methods=['POST'])
 def internal_update_count():
-    """Internal endpoint for updating count from detection script"""
-    global person_counting_data
+    """Internal endpoint for updating count from detection script (body may name a "camera")"""
     data = request.get_json()
+    camera_id = requested_camera_id(data) or DEFAULT_CAMERA
+    camera = get_camera(camera_id, create=True)
+    if camera is None:
+        return invalid_camera(camera_id)
     
-    total_count = data.get('total_count', person_counting_data['total_count'])
-    current_in_roi = data.get('current_in_roi', person_counting_data['current_in_roi'])
-    
-    update_person_count(total_count, current_in_roi)
+    with write_camera(camera_id) as draft:
+        apply_person_count(draft, data.get('total_count'), data.get('current_in_roi'), camera_id)
     
+    person_counting_data = camera["state"].get()["person_counting"]
     return jsonify({
         "success": True,
         "total_count": person_counting_data["total_count"],
@@ -312,33 +1076,18 @@ def internal_update_count():
 
 @app.route('/api/gender-classification/update', methods=['POST'])
 def update_gender_classification():
-    """Update gender classification data from service"""
-    global gender_classification_data, analytics_data
+    """Update gender classification data from service (body may name a "camera")"""
     data = request.get_json()
+    camera_id = requested_camera_id(data) or DEFAULT_CAMERA
+    camera = get_camera(camera_id, create=True)
+    if camera is None:
+        return invalid_camera(camera_id)
     
-    male_count = data.get('male_count', gender_classification_data['male_count'])
-    female_count = data.get('female_count', gender_classification_data['female_count'])
-    total_count_from_data = data.get('total_count', 0)
-    
-    # Ensure consistency: total_count = male_count + female_count
-    calculated_total = male_count + female_count
-    
-    # Use calculated total to ensure consistency
-    gender_classification_data['male_count'] = male_count
-    gender_classification_data['female_count'] = female_count
-    gender_classification_data['total_count'] = calculated_total  # Always use calculated total
-    gender_classification_data['last_update'] = datetime.now().isoformat()
-    
-    # Also update analytics data (use calculated total for consistency)
-    analytics_data['male_count'] = male_count
-    analytics_data['female_count'] = female_count
-    analytics_data['total_visitors'] = calculated_total  # Use calculated total
-    
-    # Log if there's a mismatch (for debugging)
-    if total_count_from_data != calculated_total:
-        print(f"[WARNING] Total count mismatch: received {total_count_from_data}, calculated {calculated_total}")
-        print(f"[INFO] Using calculated total: {calculated_total} = {male_count} (male) + {female_count} (female)")
+    with write_camera(camera_id) as draft:
+        apply_gender_counts(draft, data.get('male_count'), data.get('female_count'), data.get('total_count', 0),
+                            camera_id)
     
+    gender_classification_data = camera["state"].get()["gender_classification"]
     return jsonify({
         "success": True,
         "message": "Gender classification data updated successfully",
@@ -348,127 +1097,427 @@ def update_gender_classification():
     })
 
 
-@app.route('/api/gender-classification', methods=['GET'])
-def get_gender_classification():
-    """Get gender classification data"""
+@app.route('/api/internal/ingest', methods=['POST'])
+def internal_ingest():
+    """
+    Batched telemetry ingest for detection services.
+    
+    Accepts any mix of person count updates, gender count updates and detection
+    events in one request, and answers with the camera's current settings, reset
+    token and stream viewers so producers don't need separate update/settings
+    round trips. Counts only lock the sending camera's state.
+    
+    Body:
+        camera:      camera ID the batch belongs to (default "default")
+        counts:      [{"total_count": int, "current_in_roi": int}, ...]  (applied in order)
+        gender:      [{"male_count": int, "female_count": int, "total_count": int}, ...]
+        detections:  [{"type": str, "confidence": float, "camera": str, "metadata": dict}, ...]
+        positions:   [{"x": float, "y": float, "camera": str, "ts": float}, ...]  (confirmed
+                     track positions, normalized 0-1 frame coordinates; feed the heatmap)
+        reset_token: reset token the producer's counts are based on (optional)
+        trace:       latency trace of the frame the counts come from (optional, see /api/latency)
+        degradation: producer's load shedding state {"level", "name", "frame_ms", "budget_ms",
+                     "since"} (optional)
+    """
+    received = time.time()
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid ingest", "message": "body must be a JSON object"}), 400
+    camera_id = requested_camera_id(data) or DEFAULT_CAMERA
+    camera = get_camera(camera_id, create=True)
+    if camera is None:
+        return invalid_camera(camera_id)
+    # Checked up front, so a bad item can't leave half of the batch applied
+    field = invalid_ingest_field(data)
+    if field is not None:
+        return jsonify({"error": "Invalid ingest", "message": f"{field} must be a list of objects",
+                        "field": field}), 400
+    trace = parse_trace(data.get('trace'))
+    if trace is not None:
+        trace["received_ts"] = received
+    
+    applied = ingest_updates(
+        camera_id,
+        counts=data.get('counts'),
+        gender=data.get('gender'),
+        detections=data.get('detections'),
+        positions=data.get('positions'),
+        reset_token=data.get('reset_token'),
+        trace=trace,
+        degradation=data.get('degradation')
+    )
     return jsonify({
+        "success": True,
+        "camera": camera_id,
+        "applied": applied,
+        "viewers": camera["frames"].viewer_state(),
+        "settings": get_detection_settings(camera_id)
+    })
+
+
+@app.route('/api/gender-classification', methods=['GET'])
+@app.route('/api/cameras/<camera_id>/gender-classification', methods=['GET'])
+def get_gender_classification(camera_id=None):
+    """Get gender classification data for ?camera= (or the aggregate over all cameras)"""
+    camera_id = requested_camera_id()
+    if camera_id is None:
+        return conditional_json(build_gender_view)
+    camera = get_camera(camera_id)
+    if camera is None:
+        return camera_not_found(camera_id)
+    return conditional_json(build_gender_view, camera["state"], f"{camera_id}-v")
+
+
+def build_gender_view(snapshot):
+    """Gender classification payload"""
+    gender_classification_data = snapshot["gender_classification"]
+    return {
         "enabled": gender_classification_data["enabled"],
         "male_count": gender_classification_data["male_count"],
         "female_count": gender_classification_data["female_count"],
         "total_count": gender_classification_data["total_count"],
         "last_update": gender_classification_data["last_update"],
         "timestamp": datetime.now().isoformat()
-    })
+    }
 
 
 @app.route('/api/video/stream', methods=['GET'])
-def video_stream():
-    """Stream video frames as MJPEG"""
+@app.route('/api/cameras/<camera_id>/stream', methods=['GET'])
+def video_stream(camera_id=None):
+    """Stream a camera's video frames as MJPEG (?camera=, ?tier=thumbnail|preview|full, default full)"""
+    tier = get_requested_tier()
+    camera_id = requested_camera_id() or DEFAULT_CAMERA
+    camera = get_camera(camera_id)
+    if camera is None:
+        return camera_not_found(camera_id)
+    frames = camera["frames"]
+    
     def generate():
-        global current_frame, frame_lock
-        # Create a placeholder frame when no camera is active
+        # Create a placeholder frame when no camera is active (encoded once per client)
         placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
         cv2.putText(placeholder, 'Camera Not Active', (150, 200), 
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
         cv2.putText(placeholder, 'Run: python people_counter_api.py', (80, 250), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (200, 200, 200), 2)
+        _, placeholder_buffer = cv2.imencode('.jpg', placeholder, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        placeholder_bytes = placeholder_buffer.tobytes()
         
-        while True:
-            with frame_lock:
-                if current_frame is not None:
-                    # Encode frame as JPEG
-                    ret, buffer = cv2.imencode('.jpg', current_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    if ret:
-                        frame_bytes = buffer.tobytes()
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                else:
+        quality_step = 0     # raised while this client's socket writes are backing up
+        fast_writes = 0
+        last_seq = None
+        last_sent = 0.0
+        
+        frames.add_viewer(tier)
+        try:
+            while True:
+                # Sleep until the producer delivers a new frame (or 1 s for the keep-alive resend)
+                with frames.cond:
+                    if frames.seq == last_seq:
+                        frames.cond.wait(timeout=1.0)
+                loop_start = time.time()
+                seq, frame_bytes = frames.get_tier_jpeg(tier, quality_step)
+                if frame_bytes is None:
                     # Send placeholder frame when camera is not active
-                    ret, buffer = cv2.imencode('.jpg', placeholder, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    if ret:
-                        frame_bytes = buffer.tobytes()
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(0.033)  # ~30 FPS
+                    frame_bytes = placeholder_bytes
+                
+                # Only send new frames (plus a periodic resend to keep the connection alive)
+                if seq != last_seq or loop_start - last_sent > 1.0:
+                    # X-Frame-Seq matches the "seq" of events on /api/video/metadata
+                    part = (b'--frame\r\n'
+                            b'Content-Type: image/jpeg\r\n'
+                            b'X-Frame-Seq: ' + str(seq).encode() + b'\r\n\r\n' + frame_bytes + b'\r\n')
+                    # The server writes the chunk before resuming us, so this is the socket write time
+                    # alone (the tier render above is shared by all clients and must not count)
+                    write_start = time.time()
+                    yield part
+                    write_time = time.time() - write_start
+                    if seq != last_seq:
+                        trace = frames.get_trace(seq)
+                        if trace is not None:
+                            latency.record_stage("frame", trace, "streamed", time.time())
+                    last_seq, last_sent = seq, time.time()
+                    
+                    if write_time > config.STREAM_BACKPRESSURE_SECONDS:
+                        fast_writes = 0
+                        if quality_step < config.STREAM_MAX_QUALITY_STEPS:
+                            quality_step += 1
+                    elif quality_step > 0:
+                        fast_writes += 1
+                        if fast_writes >= config.STREAM_RECOVERY_FRAMES:
+                            quality_step -= 1
+                            fast_writes = 0
+                
+                time.sleep(max(0.0, 0.033 - (time.time() - loop_start)))  # cap at ~30 FPS
+        finally:
+            # Runs when the client disconnects and the server closes the generator
+            frames.add_viewer(tier, -1)
     
     return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
 @app.route('/api/video/frame', methods=['GET'])
-def video_frame():
-    """Get single video frame as base64 encoded image"""
-    global current_frame, frame_lock
-    with frame_lock:
-        if current_frame is not None:
-            ret, buffer = cv2.imencode('.jpg', current_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            if ret:
-                frame_base64 = base64.b64encode(buffer).decode('utf-8')
-                return jsonify({
-                    "success": True,
-                    "frame": f"data:image/jpeg;base64,{frame_base64}",
-                    "timestamp": datetime.now().isoformat()
-                })
+@app.route('/api/cameras/<camera_id>/frame', methods=['GET'])
+def video_frame(camera_id=None):
+    """Get a camera's current video frame as base64 encoded image (?camera=, ?tier=thumbnail|preview|full)"""
+    tier = get_requested_tier()
+    camera_id = requested_camera_id() or DEFAULT_CAMERA
+    camera = get_camera(camera_id)
+    if camera is None:
+        return camera_not_found(camera_id)
+    camera["frames"].record_poll(tier)
+    _, frame_bytes = camera["frames"].get_tier_jpeg(tier)
+    if frame_bytes is not None:
+        frame_base64 = base64.b64encode(frame_bytes).decode('utf-8')
+        return jsonify({
+            "success": True,
+            "frame": f"data:image/jpeg;base64,{frame_base64}",
+            "camera": camera_id,
+            "tier": tier,
+            "timestamp": datetime.now().isoformat()
+        })
     return jsonify({
         "success": False,
         "message": "No video frame available"
     }), 404
 
 
+@app.route('/api/video/metadata', methods=['GET'])
+@app.route('/api/cameras/<camera_id>/metadata', methods=['GET'])
+def video_metadata(camera_id=None):
+    """
+    Server-sent events with per-frame detection metadata of ?camera=.
+    
+    Each event's id/seq matches the X-Frame-Seq header of the MJPEG part for the
+    same frame. Data carries boxes, track IDs, labels and ROI geometry in the
+    producer's frame coordinates (frame_width x frame_height).
+    """
+    camera_id = requested_camera_id() or DEFAULT_CAMERA
+    camera = get_camera(camera_id)
+    if camera is None:
+        return camera_not_found(camera_id)
+    frames = camera["frames"]
+    
+    def generate():
+        last_seq = None
+        last_sent = time.time()
+        # Counted as a viewer, so producers keep sending every frame's metadata
+        frames.add_viewer("metadata")
+        try:
+            # Flush headers right away so EventSource reports the connection as open
+            yield b': connected\n\n'
+            while True:
+                with frames.cond:
+                    if frames.seq == last_seq or frames.meta_event is None:
+                        frames.cond.wait(timeout=1.0)
+                    seq, event = frames.seq, frames.meta_event
+                if event is not None and seq != last_seq:
+                    last_seq = seq
+                    last_sent = time.time()
+                    yield event
+                elif time.time() - last_sent > 15:
+                    # Comment line keeps proxies from closing an idle connection
+                    last_sent = time.time()
+                    yield b': keep-alive\n\n'
+        finally:
+            # Runs when the client disconnects and the server closes the generator
+            frames.add_viewer("metadata", -1)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/video/viewers', methods=['GET'])
+@app.route('/api/cameras/<camera_id>/viewers', methods=['GET'])
+def video_viewers(camera_id=None):
+    """Get a camera's active stream subscribers (used by producers to decide what to render)"""
+    camera_id = requested_camera_id() or DEFAULT_CAMERA
+    camera = get_camera(camera_id)
+    if camera is None:
+        return camera_not_found(camera_id)
+    return jsonify(camera["frames"].viewer_state())
+
+
+def get_requested_tier():
+    """Read the ?tier= query parameter, defaulting to the full stream"""
+    tier = request.args.get('tier', 'full')
+    return tier if tier in STREAM_TIERS else 'full'
+
+
+def requested_camera_id(data=None):
+    """Camera named by the URL (/api/cameras/<id>/...), ?camera= or the body's "camera"; None if not given"""
+    return ((request.view_args or {}).get('camera_id') or request.args.get('camera')
+            or (data or {}).get('camera') or None)
+
+
+def camera_not_found(camera_id):
+    """404 response for a camera that has never reported or been configured"""
+    return jsonify({"error": "Unknown camera", "camera": camera_id}), 404
+
+
+def invalid_camera(camera_id):
+    """400 response for a camera ID that can't be added"""
+    return jsonify({
+        "error": "Invalid camera",
+        "message": f"Camera IDs are 1-64 letters, digits, '_', '.' or '-' "
+                   f"(at most {config.MAX_CAMERAS} cameras)",
+        "camera": camera_id
+    }), 400
+
+
+def invalid_ingest_field(data):
+    """Name of the first ingest list (counts, gender, detections, positions) that isn't a list of objects, or None"""
+    for field in INGEST_LISTS:
+        items = data.get(field)
+        if items is not None and (not isinstance(items, list) or not all(isinstance(item, dict) for item in items)):
+            return field
+    return None
+
+
+def parse_trace(raw):
+    """A producer's latency trace (dict or JSON string) reduced to seq and numeric "*_ts" stamps; None if unusable"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return None
+    if not isinstance(raw, dict):
+        return None
+    trace = {key: value for key, value in raw.items()
+             if key.endswith('_ts') and isinstance(value, (int, float)) and not isinstance(value, bool)}
+    if "capture_ts" not in trace:
+        return None
+    trace["seq"] = raw.get('seq')
+    return trace
+
+
 @app.route('/api/internal/update-frame', methods=['POST'])
 def internal_update_frame():
-    """Internal endpoint for updating video frame from detection script"""
-    global current_frame, frame_lock
+    """Internal endpoint for updating a camera's video frame from detection script (form field "camera")"""
+    # Optional detection metadata sent alongside the frame (multipart field, a JSON object)
+    meta = request.form.get('meta')
+    if meta:
+        try:
+            meta = json.loads(meta)
+            if not isinstance(meta, dict):
+                raise ValueError("not a JSON object")
+        except ValueError as e:
+            print(f"[WARNING] Rejected frame with invalid meta field: {e}")
+            return jsonify({"success": False, "error": "meta must be a JSON object", "field": "meta"}), 400
+    else:
+        meta = None
     try:
         if 'frame' in request.files:
             frame_data = request.files['frame'].read()
-            nparr = np.frombuffer(frame_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            if frame is not None:
-                with frame_lock:
-                    current_frame = frame.copy()
-                return jsonify({"success": True}), 200
         elif request.content_type and 'image' in request.content_type:
             # Handle raw image data
             frame_data = request.data
-            nparr = np.frombuffer(frame_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            if frame is not None:
-                with frame_lock:
-                    current_frame = frame.copy()
-                return jsonify({"success": True}), 200
-    except Exception as e:
-        # Only log actual errors, not every request
-        pass  # Silent fail for performance
+        else:
+            frame_data = None
+        
+        # Optional latency trace sent alongside the frame (multipart field)
+        trace = parse_trace(request.form.get('trace'))
+        if trace is not None:
+            trace["received_ts"] = time.time()
+            latency.record_stages("frame", trace, ("detected", "encoded", "sent", "received"))
+        
+        camera_id = requested_camera_id(request.form) or DEFAULT_CAMERA
+        camera = get_camera(camera_id, create=True)
+        if camera is None:
+            return invalid_camera(camera_id)
+        frames = camera["frames"]
+        if frame_data and frames.store_encoded(frame_data, meta, trace):
+            frames_received_total.labels(camera_id).inc()
+            return jsonify({"success": True, "camera": camera_id, "seq": frames.seq,
+                            "viewers": frames.viewer_state()}), 200
+    except (cv2.error, OSError):
+        # Undecodable image or broken upload: not logged per request (performance)
+        pass
     return jsonify({"success": False}), 400
 
 
-def update_video_frame(frame):
-    """Update the current video frame (called from detection script)"""
-    global current_frame, frame_lock
-    with frame_lock:
-        current_frame = frame.copy()
-
-
 # ============================================
 # HELPER FUNCTIONS - Call these from your algorithm
 # ============================================
 
-def update_analytics(total, male, female, hourly, age_dist, current_occupancy=0):
-    """Update analytics data from your algorithm"""
-    global analytics_data
-    analytics_data = {
-        "total_visitors": total,
-        "male_count": male,
-        "female_count": female,
-        "current_occupancy": current_occupancy,
-        "hourly_data": hourly,
-        "age_distribution": age_dist
-    }
+def update_analytics(total, male, female, hourly, age_dist, current_occupancy=0, camera_id=DEFAULT_CAMERA):
+    """Update analytics data from your algorithm (totals are the camera's; hourly/age data are shared)"""
+    with write_camera(camera_id) as draft:
+        draft["analytics"] = {
+            "total_visitors": total,
+            "male_count": male,
+            "female_count": female,
+            "current_occupancy": current_occupancy
+        }
+    with state.write() as draft:
+        draft["analytics"]["hourly_data"] = list(hourly)
+        draft["analytics"]["age_distribution"] = dict(age_dist)
 
 
-def update_person_count(count, current_in_roi=0):
+def ingest_updates(camera_id, counts=None, gender=None, detections=None, positions=None, reset_token=None,
+                   trace=None, degradation=None):
+    """
+    Apply one batch of producer updates (see /api/internal/ingest for the fields);
+    returns how many of each kind were applied. The counts are one commit to the
+    camera: one new snapshot, one aggregate fold.
+    """
+    field = invalid_ingest_field({"counts": counts, "gender": gender, "detections": detections, "positions": positions})
+    if field is not None:
+        raise ValueError(f"{field} must be a list of objects")
+    if trace is not None:
+        latency.record_stages("count", trace, ("detected", "queued", "sent", "received"))
+    with write_camera(camera_id, trace) as draft:
+        # Counts computed before a dashboard reset would resurrect the old totals;
+        # drop them and let the producer pick up the new token from the settings.
+        stale = reset_token is not None and reset_token != draft.get("person_counting")['reset_token']
+        
+        applied = {"counts": 0, "gender": 0, "detections": 0, "positions": 0, "stale": stale}
+        if isinstance(degradation, dict) and isinstance(degradation.get('level'), int):
+            draft["degradation"] = degradation
+        if not stale:
+            for update in counts or []:
+                apply_person_count(draft, update.get('total_count'), update.get('current_in_roi'), camera_id)
+                applied["counts"] += 1
+            for update in gender or []:
+                apply_gender_counts(draft, update.get('male_count'), update.get('female_count'),
+                                    update.get('total_count'), camera_id)
+                applied["gender"] += 1
+    # Detections share one ring ordered across cameras, so they commit to the shared state
+    if detections:
+        with state.write() as draft:
+            for event in detections:
+                append_detection(
+                    draft,
+                    event.get('type', 'person'),
+                    event.get('confidence', 0.0),
+                    event.get('camera', camera_id),
+                    event.get('metadata')
+                )
+                applied["detections"] += 1
+    for position in positions or []:
+        if position.get('x') is None or position.get('y') is None:
+            continue
+        add_track_position(position.get('camera', camera_id), position['x'], position['y'], position.get('ts'))
+        applied["positions"] += 1
+    for kind in ("counts", "gender", "detections", "positions"):
+        if applied[kind]:
+            ingest_items_total.labels(camera_id, kind).inc(applied[kind])
+    return applied
+
+
+def update_person_count(count, current_in_roi=0, camera_id=DEFAULT_CAMERA):
     """Update person counting data from YOLOv8 algorithm"""
-    global person_counting_data, analytics_data
+    with write_camera(camera_id) as draft:
+        apply_person_count(draft, count, current_in_roi, camera_id)
+
+
+def apply_person_count(draft, count=None, current_in_roi=None, camera_id=DEFAULT_CAMERA):
+    """Apply a person count update to a camera state draft (None keeps the current value)"""
+    person_counting_data = draft["person_counting"]
+    analytics_data = draft["analytics"]
+    if count is None:
+        count = person_counting_data["total_count"]
+    if current_in_roi is None:
+        current_in_roi = person_counting_data["current_in_roi"]
     
     person_counting_data["total_count"] = count
     person_counting_data["current_in_roi"] = current_in_roi
@@ -491,9 +1540,12 @@ def update_person_count(count, current_in_roi=0):
     old_count = person_counting_data.get("_last_count", 0)
     if count > old_count:
         person_counting_data["entries_today"] += (count - old_count)
+        history.record("entries", count - old_count, camera_id)
     elif count < old_count:
         person_counting_data["exits_today"] += (old_count - count)
+        history.record("exits", old_count - count, camera_id)
     person_counting_data["_last_count"] = count
+    history.record("occupancy", current_in_roi, camera_id)
     
     # Update entries/exits tracking
     if count > person_counting_data["total_count"]:
@@ -502,41 +1554,321 @@ def update_person_count(count, current_in_roi=0):
         person_counting_data["exits_today"] += (person_counting_data["total_count"] - count)
 
 
+def update_gender_counts(male_count, female_count, total_count_from_data=None, camera_id=DEFAULT_CAMERA):
+    """Update gender classification counts (total is always male + female)"""
+    with write_camera(camera_id) as draft:
+        apply_gender_counts(draft, male_count, female_count, total_count_from_data, camera_id)
+
+
+def apply_gender_counts(draft, male_count=None, female_count=None, total_count_from_data=None,
+                        camera_id=DEFAULT_CAMERA):
+    """Apply a gender count update to a camera state draft (None keeps the current value)"""
+    gender_classification_data = draft["gender_classification"]
+    analytics_data = draft["analytics"]
+    if male_count is None:
+        male_count = gender_classification_data['male_count']
+    if female_count is None:
+        female_count = gender_classification_data['female_count']
+    
+    # History gets the increments; drops (resets) are not visits
+    if male_count > gender_classification_data['male_count']:
+        history.record("male", male_count - gender_classification_data['male_count'], camera_id)
+    if female_count > gender_classification_data['female_count']:
+        history.record("female", female_count - gender_classification_data['female_count'], camera_id)
+    
+    # Ensure consistency: total_count = male_count + female_count
+    calculated_total = male_count + female_count
+    
+    # Use calculated total to ensure consistency
+    gender_classification_data['male_count'] = male_count
+    gender_classification_data['female_count'] = female_count
+    gender_classification_data['total_count'] = calculated_total  # Always use calculated total
+    gender_classification_data['last_update'] = datetime.now().isoformat()
+    
+    # Also update analytics data (use calculated total for consistency)
+    analytics_data['male_count'] = male_count
+    analytics_data['female_count'] = female_count
+    analytics_data['total_visitors'] = calculated_total  # Use calculated total
+    
+    # Log if there's a mismatch (for debugging)
+    if total_count_from_data is not None and total_count_from_data != calculated_total:
+        print(f"[WARNING] Total count mismatch: received {total_count_from_data}, calculated {calculated_total}")
+        print(f"[INFO] Using calculated total: {calculated_total} = {male_count} (male) + {female_count} (female)")
+
+
+def apply_reset(draft):
+    """Zero a camera state draft's counts and occupancy and bump its reset token"""
+    person_counting_data = draft["person_counting"]
+    person_counting_data.update({
+        "total_count": 0,
+        "current_in_roi": 0,
+        "entries_today": 0,
+        "exits_today": 0,
+        "peak_occupancy": 0,
+        "peak_time": None,
+        "hourly_foot_traffic": {},
+        "_last_count": 0,
+        "reset_token": person_counting_data.get("reset_token", 0) + 1,
+    })
+    draft["gender_classification"].update({
+        "male_count": 0,
+        "female_count": 0,
+        "total_count": 0,
+        "last_update": datetime.now().isoformat()
+    })
+    draft["analytics"] = dict(camera_analytics_data)
+
+
 def add_detection(detection_type, confidence, camera_name, metadata=None):
     """Add a new detection from your algorithm"""
-    global detections
+    with state.write() as draft:
+        append_detection(draft, detection_type, confidence, camera_name, metadata)
+
+
+def append_detection(draft, detection_type, confidence, camera_name, metadata=None):
+    """Append a detection as part of a state draft; snapshots before it don't include it"""
+    # Readers only look below their snapshot's detection_count, so appending is invisible until commit
+    count = draft.get("detection_count")
+    detections.truncate(count)  # entries from a draft that was never committed
     detections.append({
-        "id": f"det_{len(detections) + 1}",
+        "id": f"det_{count + 1}",
         "type": detection_type,
         "confidence": confidence,
         "camera": camera_name,
         "timestamp": datetime.now().isoformat(),
-        "metadata": metadata or {}
+        "metadata": metadata or {},
+        "version": draft.version
     })
+    draft["detection_count"] = count + 1
+    history.record("detections", 1, camera_name)
+
+
+def add_track_position(camera_name, x, y, ts=None):
+    """Add a confirmed track position (normalized 0-1 frame coordinates) to the camera's heatmap"""
+    heatmaps.add(camera_name, float(x), float(y), ts=ts)
 
 
 def update_heatmap(zones_data):
     """Update heatmap zones from your algorithm"""
-    global heatmap_data
-    heatmap_data = zones_data
+    with state.write() as draft:
+        draft["heatmap"] = list(zones_data)
 
 
 def update_camera_status(cameras, detection_running=False):
     """Update camera status from your algorithm"""
-    global camera_status
-    camera_status["cameras"] = cameras
-    camera_status["detection_running"] = detection_running
+    with state.write() as draft:
+        camera_status = draft["camera_status"]
+        camera_status["cameras"] = list(cameras)
+        camera_status["detection_running"] = detection_running
+
+
+def update_video_frame(frame, meta=None, camera_id=DEFAULT_CAMERA, trace=None):
+    """Update a camera's current video frame and optional detection metadata (called from detection script)"""
+    get_camera(camera_id, create=True)["frames"].update(frame, meta, trace)
+    frames_received_total.labels(camera_id).inc()
 
 
-def get_detection_settings():
-    """Get current detection settings for the algorithm"""
+def get_detection_settings(camera_id=DEFAULT_CAMERA):
+    """Get a camera's current detection settings for the algorithm (with the reset token its counts must match)"""
+    person_counting_data = get_camera(camera_id, create=True)["state"].get()["person_counting"]
     return {
         "enabled": person_counting_data["enabled"],
+        "sensitivity": person_counting_data["sensitivity"],
         "confidence_threshold": person_counting_data["confidence_threshold"],
-        "roi_config": person_counting_data["roi_config"]
+        "roi_config": person_counting_data["roi_config"],
+        "reset_token": person_counting_data["reset_token"]
     }
 
 
+def store_producer_metrics(source, camera_id, snapshot):
+    """Keep a producer's latest MetricsRegistry snapshot for /metrics (replacing its last one)"""
+    with pushed_metrics_lock:
+        pushed_metrics[(source, camera_id)] = (time.time(), snapshot)
+
+
+# ============================================
+# CAMERAS AND THE AGGREGATE VIEW
+# ============================================
+
+def get_camera(camera_id, create=False):
+    """
+    Return the camera's {"id", "state", "frames"} entry, or None if it is unknown.
+    
+    With create a new camera is added on first use, unless its ID is invalid or
+    config.MAX_CAMERAS are already known (then None as well).
+    """
+    global cameras
+    camera = cameras.get(camera_id)
+    if camera is not None or not create:
+        return camera
+    if not isinstance(camera_id, str) or not CAMERA_ID_PATTERN.match(camera_id):
+        return None
+    with cameras_lock:
+        camera = cameras.get(camera_id)
+        if camera is None:
+            if len(cameras) >= config.MAX_CAMERAS:
+                return None
+            camera = {
+                "id": camera_id,
+                "state": StateStore({
+                    "analytics": dict(camera_analytics_data),
+                    "person_counting": copy.deepcopy(person_counting_data),
+                    "gender_classification": dict(gender_classification_data),
+                    "degradation": None,  # producer's load shedding state, from ingest
+                }),
+                "frames": FrameChannel(camera_id),
+            }
+            # Copy-on-write, so request threads can iterate `cameras` without the lock
+            cameras = dict(cameras, **{camera_id: camera})
+    if camera_id not in aggregate_parts:
+        mark_camera_changed(camera_id)  # list it in the aggregate right away
+    return camera
+
+
+@contextmanager
+def write_camera(camera_id, trace=None):
+    """
+    Context manager yielding a draft of one camera's state (see StateStore.write).
+    
+    Only that camera's lock is held while writing; after the commit the camera
+    is folded into the aggregate view. trace is the latency trace of the update
+    being written; it gets its "committed" stage when the fold commits.
+    """
+    camera = get_camera(camera_id, create=True)
+    if camera is None:
+        raise ValueError(f"Invalid camera ID or too many cameras: {camera_id!r}")
+    with camera["state"].write() as draft:
+        yield draft
+    mark_camera_changed(camera_id, trace)
+
+
+def mark_camera_changed(camera_id, trace=None):
+    """Queue a camera for folding into the aggregate and fold now unless another thread is at it"""
+    if trace is not None:
+        dirty_traces[camera_id] = trace  # before marking dirty, so the fold that pops it sees the commit
+    dirty_cameras.add(camera_id)
+    fold_camera_changes()
+
+
+def fold_camera_changes(wait=False):
+    """
+    Fold every dirty camera into the aggregate sections of `state`.
+    
+    Without wait this never blocks: a thread that finds another one folding
+    leaves its camera in dirty_cameras, and the folding thread checks again
+    after releasing aggregate_lock. With wait the aggregate includes every
+    camera commit made before the call.
+    """
+    if wait:
+        with aggregate_lock:
+            _fold_dirty_cameras()
+    while dirty_cameras and aggregate_lock.acquire(blocking=False):
+        try:
+            _fold_dirty_cameras()
+        finally:
+            aggregate_lock.release()
+
+
+def _fold_dirty_cameras():
+    # aggregate_lock held; only the fields that changed are written to the aggregate
+    changed = set()
+    folded = {}
+    traces = []
+    while dirty_cameras:
+        camera_id = dirty_cameras.pop()
+        trace = dirty_traces.pop(camera_id, None)
+        if trace is not None:
+            traces.append(trace)
+        snapshot = cameras[camera_id]["state"].get()
+        parts = camera_contribution(snapshot)
+        old = aggregate_parts.get(camera_id, {})
+        for key in parts.keys() | old.keys():
+            delta = parts.get(key, 0) - old.get(key, 0)
+            if delta:
+                aggregate_sums[key] = aggregate_sums.get(key, 0) + delta
+                changed.add(key)
+        aggregate_parts[camera_id] = parts
+        folded[camera_id] = snapshot
+    if not folded:
+        return
+    
+    with state.write() as draft:
+        for key in changed:
+            value = aggregate_sums[key]
+            if len(key) == 3:
+                hourly = draft["person_counting"][key[1]]
+                if value:
+                    hourly[key[2]] = value
+                else:
+                    hourly.pop(key[2], None)
+                    del aggregate_sums[key]
+            else:
+                draft[key[0]][key[1]] = value
+        
+        # Peak of the summed occupancy (cameras peak at different times)
+        current = aggregate_sums.get(("person_counting", "current_in_roi"), 0)
+        if current > draft.get("person_counting")["peak_occupancy"]:
+            draft["person_counting"]["peak_occupancy"] = current
+            draft["person_counting"]["peak_time"] = datetime.now().isoformat()
+        
+        last_update = max((s["gender_classification"]["last_update"] or '' for s in folded.values()), default='')
+        if last_update > (draft.get("gender_classification")["last_update"] or ''):
+            draft["gender_classification"]["last_update"] = last_update
+        
+        if DEFAULT_CAMERA in folded:
+            settings = folded[DEFAULT_CAMERA]["person_counting"]
+            if any(draft.get("person_counting")[field] != settings[field] for field in CAMERA_SETTINGS_FIELDS):
+                draft["person_counting"].update((field, settings[field]) for field in CAMERA_SETTINGS_FIELDS)
+        
+        summaries = draft["cameras"]
+        for camera_id, snapshot in folded.items():
+            summaries[camera_id] = camera_summary(snapshot)
+    
+    if traces:
+        committed = time.time()
+        for trace in traces:
+            trace["committed_ts"] = committed
+            latency.record_stages("count", trace, ("committed",))
+        if draft.committed:
+            # /api/events clients record the "pushed" stage once they are sent this version
+            with count_traces_lock:
+                count_traces.extend((draft.version, trace) for trace in traces)
+
+
+def camera_contribution(snapshot):
+    """A camera's fields that sum into the aggregate, keyed by (section, field) or (section, field, hour)"""
+    parts = {}
+    for section, fields in AGGREGATE_FIELDS.items():
+        data = snapshot[section]
+        for field in fields:
+            parts[(section, field)] = data[field]
+    for hour, count in snapshot["person_counting"]["hourly_foot_traffic"].items():
+        parts[("person_counting", "hourly_foot_traffic", hour)] = count
+    return parts
+
+
+def camera_summary(snapshot):
+    """Per-camera counts listed in the aggregate "cameras" section"""
+    person_counting_data = snapshot["person_counting"]
+    gender_classification_data = snapshot["gender_classification"]
+    degradation = snapshot.get("degradation")
+    return {
+        "total_count": person_counting_data["total_count"],
+        "current_in_roi": person_counting_data["current_in_roi"],
+        "entries_today": person_counting_data["entries_today"],
+        "exits_today": person_counting_data["exits_today"],
+        "peak_occupancy": person_counting_data["peak_occupancy"],
+        "male_count": gender_classification_data["male_count"],
+        "female_count": gender_classification_data["female_count"],
+        "roi_configured": person_counting_data["roi_config"] is not None,
+        # Level and name only: frame times change on every ingest and would flood /api/events
+        "degradation": {key: degradation[key] for key in ("level", "name")} if degradation else None
+    }
+
+
+get_camera(DEFAULT_CAMERA, create=True)
+
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors with JSON response"""
@@ -553,78 +1885,199 @@ def not_found(error):
             "POST /api/person-counting/settings",
             "POST /api/person-counting/update",
             "POST /api/person-counting/reset",
-            "POST /api/internal/update-count"
+            "GET  /api/cameras",
+            "GET  /api/cameras/<camera_id>",
+            "GET  /api/latency",
+            "POST /api/internal/update-count",
+            "POST /api/internal/ingest"
         ],
         "frontend_url": "http://localhost:8080"
     }), 404
 
 
+# ============================================
+# WARM RESTART SNAPSHOTS
+# ============================================
+
+CAMERA_SECTIONS = ("analytics", "person_counting", "gender_classification")
+# Reset by a restart on a new day (nothing else rolls them over at midnight)
+DAILY_FIELDS = {
+    "person_counting": ("entries_today", "exits_today", "peak_occupancy", "peak_time", "hourly_foot_traffic",
+                        "_last_count"),
+}
+
+
+def build_server_snapshot():
+    """
+    State that isn't rebuilt from the history database: every camera's counts,
+    settings and ROI, plus the aggregate peak and age distribution. Built from
+    the current copy-on-write snapshots, so writers are never held up.
+    """
+    snapshot = state.get()
+    return {
+        "cameras": {
+            camera_id: {name: camera["state"].get()[name] for name in CAMERA_SECTIONS}
+            for camera_id, camera in cameras.items()
+        },
+        "peak_occupancy": snapshot["person_counting"]["peak_occupancy"],
+        "peak_time": snapshot["person_counting"]["peak_time"],
+        "age_distribution": snapshot["analytics"]["age_distribution"],
+    }
+
+
+def restore_server_snapshot():
+    """
+    Load the last saved server snapshot into the camera stores and aggregate;
+    True if there was one. A snapshot from an earlier day restores totals,
+    settings and ROI but not the per-day fields (DAILY_FIELDS, aggregate peak).
+    """
+    started = time.perf_counter()
+    data = read_snapshot(config.SERVER_SNAPSHOT_PATH)
+    if not data or not isinstance(data.get("cameras"), dict):
+        return False
+    today = saved_today(data)
+    for camera_id, sections in data["cameras"].items():
+        if get_camera(camera_id, create=True) is None:
+            continue
+        with write_camera(camera_id) as draft:
+            for name in CAMERA_SECTIONS:
+                saved = sections.get(name)
+                if not isinstance(saved, dict):
+                    continue
+                if not today:
+                    saved = {key: value for key, value in saved.items() if key not in DAILY_FIELDS.get(name, ())}
+                # Saved fields over current defaults, so fields added since are kept
+                draft[name] = dict(draft.get(name), **saved)
+    fold_camera_changes(wait=True)
+    with state.write() as draft:
+        if today and data.get("peak_occupancy", 0) > draft.get("person_counting")["peak_occupancy"]:
+            draft["person_counting"]["peak_occupancy"] = data["peak_occupancy"]
+            draft["person_counting"]["peak_time"] = data.get("peak_time")
+        if isinstance(data.get("age_distribution"), dict):
+            draft["analytics"]["age_distribution"] = data["age_distribution"]
+    saved_at = datetime.fromtimestamp(data.get("saved_at", 0)).isoformat(timespec='seconds')
+    print(f"[INFO] Restored {len(data['cameras'])} camera(s) from snapshot saved {saved_at} "
+          f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+          f"{'' if today else ' (earlier day: per-day counts start fresh)'}")
+    return True
+
+
+# Saved every config.SNAPSHOT_INTERVAL seconds once started in __main__
+server_snapshots = SnapshotWriter(config.SERVER_SNAPSHOT_PATH, source=build_server_snapshot)
+
+
 # ============================================
 # SAMPLE DATA INITIALIZATION
 # ============================================
 
 def initialize_sample_data():
-    """Initialize sample data for testing/demo purposes"""
-    global analytics_data, person_counting_data
-    
-    # Sample hourly data for today (last 8 hours)
-    current_hour = datetime.now().hour
-    for h in range(max(0, current_hour - 8), current_hour + 1):
-        hour_str = f"{h:02d}:00"
-        # Generate sample data with some variation
-        base_count = 20 + (h - 9) * 5 if h >= 9 else 10
-        person_counting_data["hourly_foot_traffic"][hour_str] = max(0, base_count + (h % 3) * 2)
-    
-    # Sample age distribution
-    analytics_data["age_distribution"] = {
-        "0-18": 15,
-        "19-30": 45,
-        "31-45": 30,
-        "46-60": 20,
-        "60+": 10
-    }
+    """Initialize sample data for testing/demo purposes (counts go to the default camera)"""
+    with write_camera(DEFAULT_CAMERA) as draft:
+        analytics_data = draft["analytics"]
+        person_counting_data = draft["person_counting"]
+        
+        # Sample hourly data for today (last 8 hours)
+        current_hour = datetime.now().hour
+        for h in range(max(0, current_hour - 8), current_hour + 1):
+            hour_str = f"{h:02d}:00"
+            # Generate sample data with some variation
+            base_count = 20 + (h - 9) * 5 if h >= 9 else 10
+            person_counting_data["hourly_foot_traffic"][hour_str] = max(0, base_count + (h % 3) * 2)
+        
+        # Sample gender counts
+        analytics_data["male_count"] = 65
+        analytics_data["female_count"] = 55
+        analytics_data["total_visitors"] = 120
+        analytics_data["current_occupancy"] = 8
+        person_counting_data["total_count"] = 120
+        person_counting_data["peak_occupancy"] = 12
     
-    # Sample gender counts
-    analytics_data["male_count"] = 65
-    analytics_data["female_count"] = 55
-    analytics_data["total_visitors"] = 120
-    analytics_data["current_occupancy"] = 8
-    person_counting_data["total_count"] = 120
-    person_counting_data["peak_occupancy"] = 12
+    with state.write() as draft:
+        # Sample age distribution
+        draft["analytics"]["age_distribution"] = {
+            "0-18": 15,
+            "19-30": 45,
+            "31-45": 30,
+            "46-60": 20,
+            "60+": 10
+        }
+        draft["person_counting"]["peak_occupancy"] = 12
 
 
 # ============================================
 # MAIN
 # ============================================
 
+def run_async_server(host, port):
+    """Serve the app with gevent; each stream/SSE client is a greenlet instead of a thread"""
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    # Connections beyond the pool size wait in the accept backlog instead of growing memory
+    pool = Pool(config.ASYNC_MAX_CONNECTIONS)
+    server = WSGIServer((host, port), app, spawn=pool, log=None)
+    print(f"[INFO] Async mode (gevent), up to {config.ASYNC_MAX_CONNECTIONS} concurrent connections")
+    server.serve_forever()
+
+
 if __name__ == '__main__':
-    # Initialize sample data for demo
-    initialize_sample_data()
+    import argparse
+    parser = argparse.ArgumentParser(description='Camera Analysis API Server')
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='Serve with gevent (many concurrent streams/SSE clients)')
+    parser.add_argument('--embedded', action='store_true',
+                        help='Also run the people counter in this process (no HTTP between them)')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on (default: 5000)')
+    args = parser.parse_args()
+    if args.embedded and args.async_mode:
+        parser.error('--embedded runs detection on threads and cannot be combined with --async')
+
+    # Pick up where the last run left off; sample data for demo on a first run
+    if not restore_server_snapshot():
+        initialize_sample_data()
     print("=" * 60)
     print("Starting Camera Analysis API Server with Person Counting...")
     print("=" * 60)
-    print("Dashboard will connect to: http://localhost:5000")
+    print(f"Dashboard will connect to: http://localhost:{args.port}")
     print("\nAvailable endpoints:")
     print("  GET  /                              - API information")
     print("  GET  /api                           - API endpoints list")
     print("  GET  /api/status                    - Camera and system status")
+    print("  GET  /metrics                       - Prometheus metrics (server + producer stage timings)")
+    print("  GET  /api/latency                   - End-to-end latency percentiles per traced hop")
+    print("  GET  /api/dashboard                 - Everything the dashboard shows, in one cached response")
     print("  GET  /api/analytics                 - Visitor analytics + person counting")
+    print("  GET  /api/events                    - Analytics changes pushed as server-sent events")
     print("  GET  /api/detections                - Recent detections")
     print("  GET  /api/heatmap                   - Heatmap data")
+    print("  GET  /api/heatmap/history           - Archived heatmap (range, hours of day, weekdays)")
+    print("  GET  /api/history                   - Historical counts (range, granularity, camera, gender)")
     print("  GET  /api/person-counting           - Person counting specific data")
     print("  GET  /api/video/stream              - Live video stream (MJPEG)")
     print("  GET  /api/video/frame               - Single video frame")
+    print("  GET  /api/video/viewers             - Active stream subscribers")
+    print("  GET  /api/video/metadata            - Per-frame detection metadata (SSE)")
     print("  POST /api/person-counting/settings   - Update counting settings")
     print("  POST /api/person-counting/update    - Update count from detection script")
     print("  POST /api/person-counting/reset     - Reset counts and occupancy tracking")
+    print("  GET  /api/cameras                   - Cameras with count summaries and viewers")
+    print("  GET  /api/cameras/<id>              - One camera's counts and settings")
+    print("  *    /api/cameras/<id>/...          - Per-camera person-counting, settings, reset, stream,")
+    print("                                        frame, metadata, viewers, heatmap(/history) (or ?camera=)")
     print("  GET  /api/staff/attendance          - Staff attendance summary (stub)")
     print("  POST /api/internal/update-count     - Internal count update endpoint")
     print("  POST /api/internal/update-frame     - Update video frame")
+    print("  POST /api/internal/ingest           - Batched counts + detections, returns settings")
+    print("  POST /api/internal/metrics          - Producer metrics push")
     print("\nNote: This is an API-only server.")
     print("      Access the web dashboard at: http://localhost:8080")
     print("\n" + "=" * 60)
-    print("To run YOLOv8 detection, run in another terminal:")
-    print("  python people_counter_api.py")
+    if args.embedded:
+        print(f"YOLOv8 detection runs in this process (embedded mode, camera {config.CAMERA_ID})")
+    else:
+        print("To run YOLOv8 detection, run in another terminal:")
+        print("  python people_counter_api.py")
+        print("  (or start the server with --embedded to run it in this process)")
     print("=" * 60)
     
     # Disable Flask request logging to reduce console spam
@@ -632,4 +2085,23 @@ if __name__ == '__main__':
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)  # Only show errors, not every request
     
-    app.run(host='0.0.0.0', port=5000, debug=False)  # Set to False to reduce logging
+    history.start()
+    heatmap_archive.start()
+    server_snapshots.start()
+    detection_worker = None
+    if args.embedded:
+        from embedded_detection import DetectionWorker
+        # This module runs as __main__; the worker calls its helper functions directly
+        detection_worker = DetectionWorker(sys.modules[__name__])
+        detection_worker.start()
+    try:
+        if args.async_mode:
+            run_async_server('0.0.0.0', args.port)
+        else:
+            app.run(host='0.0.0.0', port=args.port, debug=False)  # Set to False to reduce logging
+    finally:
+        if detection_worker is not None:
+            detection_worker.stop()  # final counts reach the state before it is saved
+        server_snapshots.stop()  # save the final counts
+        heatmap_archive.stop()  # archive the partial current hour
+        history.stop()  # flush buffered history events
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark for process-pool inference (config.INFERENCE_MODE = 'process').
+
+Runs the same inference on 1..N threads in one process (the GIL-bound
+'thread' mode) and on an InferencePool with 1..N worker processes (frames
+passed through shared memory), and compares throughput and per-call latency.
+Use it on the target machine to choose config.INFERENCE_WORKERS.
+
+Usage:
+    python benchmark_inference.py                       # YOLO detector, 1..cores workers
+    python benchmark_inference.py --kind gender --max-workers 4
+    python benchmark_inference.py --kind synthetic      # no models needed
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+import config
+from inference_pool import InferencePool, load_detector, detect_people, load_gender_model, classify_genders
+
+
+def load_synthetic(weights, threads):
+    """Stand-in model for machines without the weights"""
+    return None
+
+
+def synthetic_inference(model, frame, work, size=0, tier=0):
+    """CPU-bound, GIL-holding stand-in for a model: repeated pure-Python passes over a sample of the frame"""
+    sample = frame[::16, ::16, 0].tolist()
+    total = 0
+    for _ in range(max(1, int(work))):
+        for row in sample:
+            total += sum(row)
+    return np.array([[0, 0, 10, 10, total % 1000 / 1000]], dtype=np.float32)
+
+
+KINDS = {
+    # kind: (load, run, weights, input builder, parameter)
+    "detect": (load_detector, detect_people, config.YOLO_WEIGHTS,
+               lambda w, h: np.random.randint(0, 255, (h, w, 3), dtype=np.uint8), 0.5),
+    "gender": (load_gender_model, classify_genders, config.MODEL_PATH,
+               lambda w, h: np.random.randint(0, 255, (1, *config.IMAGE_SIZE, 3), dtype=np.uint8), 0.0),
+    "synthetic": (load_synthetic, synthetic_inference, None,
+                  lambda w, h: np.random.randint(0, 255, (h, w, 3), dtype=np.uint8), 400),
+}
+
+
+def summarize(label, workers, frames, elapsed, latencies):
+    latencies = sorted(latencies)
+    return {
+        "label": label,
+        "workers": workers,
+        "fps": frames / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def run_threads(kind, workers, frames, frame):
+    """In-process baseline: one model shared by `workers` threads (what 'thread' mode does)"""
+    load, run, weights, _, param = KINDS[kind]
+    model = load(weights, os.cpu_count() or 1)
+    run(model, frame, param)  # warm-up
+    latencies = []
+    remaining = [frames]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            run(model, frame, param)
+            latency = time.perf_counter() - started
+            with lock:
+                latencies.append(latency)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize("threads", workers, frames, time.perf_counter() - started, latencies)
+
+
+def run_processes(kind, workers, frames, frame):
+    """InferencePool with `workers` processes, kept full (two frames in flight per worker)"""
+    load, run, weights, _, param = KINDS[kind]
+    pool = InferencePool(load, run, weights, workers=workers, slot_bytes=max(frame.nbytes, 1), name=kind)
+    try:
+        pool.infer(frame, param)  # warm-up
+        in_flight = []  # (task id, submitted at)
+        latencies = []
+        submitted = 0
+        started = time.perf_counter()
+        while len(latencies) < frames:
+            while submitted < frames and len(in_flight) < pool.slots:
+                in_flight.append((pool.submit(frame, param), time.perf_counter()))
+                submitted += 1
+            task_id, submitted_at = in_flight.pop(0)
+            pool.result(task_id)
+            latencies.append(time.perf_counter() - submitted_at)
+        return summarize("processes", workers, frames, time.perf_counter() - started, latencies)
+    finally:
+        pool.close()
+
+
+def worker_counts(max_workers):
+    """1, 2, 4, ... up to max_workers (always included)"""
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Thread vs process-pool inference scaling benchmark')
+    parser.add_argument('--kind', choices=sorted(KINDS), default='detect', help='Model to run')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1, help='Largest worker count')
+    parser.add_argument('--frames', type=int, default=100, help='Inferences per measurement')
+    parser.add_argument('--width', type=int, default=1280, help='Frame width (detect/synthetic)')
+    parser.add_argument('--height', type=int, default=720, help='Frame height (detect/synthetic)')
+    parser.add_argument('--only', choices=['threads', 'processes'], help='Measure a single mode')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Inference Scaling Benchmark")
+    print("=" * 60)
+    print(f"[INFO] {args.kind}: {args.frames} inferences per run, {os.cpu_count()} CPU(s)")
+    frame = KINDS[args.kind][3](args.width, args.height)
+
+    results = []
+    for workers in worker_counts(max(1, args.max_workers)):
+        for label, runner in (("threads", run_threads), ("processes", run_processes)):
+            if args.only and args.only != label:
+                continue
+            print(f"[INFO] {label} x {workers}...")
+            try:
+                results.append(runner(args.kind, workers, args.frames, frame))
+            except Exception as e:
+                print(f"[ERROR] {label} x {workers}: {e}")
+
+    print("\n" + "=" * 60)
+    print(f"{'mode':<10} {'workers':>7} {'fps':>8} {'speedup':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for label in ("threads", "processes"):
+        rows = [r for r in results if r["label"] == label]
+        for r in rows:
+            speedup = r["fps"] / rows[0]["fps"]
+            print(f"{label:<10} {r['workers']:>7} {r['fps']:>8.1f} {speedup:>7.2f}x {r['p50']:>8.1f} {r['p95']:>8.1f}")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
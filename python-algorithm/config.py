@@ -58,9 +58,120 @@ MIN_NEIGHBORS = 3  # Reduced from 5 for faster detection
 TRACKING_THRESHOLD = 50  # Distance threshold for same person
 TRACKING_FRAMES = 10  # Frames to remember face positions
 
-# Performance optimization
-MAX_FPS = 60  # Maximum FPS to maintain stability
-FRAME_SKIP_THRESHOLD = 45  # Start skipping frames above this FPS
+# Frame pacing (detection services): each camera frame is admitted or skipped by its capture
+# timestamp, closed-loop on the measured stage times and capture -> done latency
+PACING_TARGET_FPS = 30  # Most frames per second processed; extra camera frames are skipped
+PACING_LATENCY_SLO = 0.5  # Seconds from capture to done; admission slows while queueing exceeds it (0 = rate only)
+PACING_SMOOTHING = 0.2  # EWMA weight of the newest stage time / latency sample
+PACING_MAX_INTERVAL = 1.0  # Slowest admission interval (seconds) the controller backs off to
+
+# Load shedding (people_counter_api): while the slowest stage takes longer than the frame budget,
+# work is shed one level at a time and restored, newest level first, as headroom returns:
+#   1 stream overlays, 2 stream rate, 3 gender re-classification, 4 detector resolution, 5 detector model tier
+SHED_FRAME_BUDGET = 0.2  # Seconds the slowest stage may take per frame (0.2 = at least 5 FPS)
+SHED_RESTORE_RATIO = 0.7  # Restore a level once frame time plus that level's measured cost fits in this share of the budget
+SHED_HOLD_SECONDS = 3.0  # Seconds between level changes, so stage times settle first
+SHED_STREAM_EVERY = 10  # Publish every Nth frame from level 2 (normally every 3rd)
+SHED_DETECT_SIZE = 320  # Detector input resolution from level 4 (YOLO's default is 640)
+
+# Embedded mode (python api_server.py --embedded): the people counter runs inside the API server
+EMBEDDED_RESTART_DELAY = 5.0  # Seconds before restarting detection that stopped on its own (camera lost, error)
+
+# Inference execution (people_counter_api)
+INFERENCE_MODE = 'thread'  # 'thread': models run in-process; 'process': worker processes, frames via shared memory
+INFERENCE_WORKERS = 2  # YOLO worker processes in 'process' mode (frames in flight at once)
+GENDER_WORKERS = 1  # Gender classifier worker processes in 'process' mode
+INFERENCE_THREADS = 0  # CPU threads per worker process; 0 = cores / workers
+INFERENCE_SLOT_BYTES = 1920 * 1080 * 3  # Largest input (frame or face batch) a shared-memory slot holds
+YOLO_WEIGHTS = 'yolov8x.pt'
+YOLO_LIGHT_WEIGHTS = 'yolov8n.pt'  # Lighter detector tier, used when load shedding reaches it
+
+# Detection pipeline (people_counter_api): capture -> detect -> track -> classify -> render,
+# each stage on its own thread behind a bounded queue
+PIPELINE_QUEUE_SIZE = 2  # Frames waiting in front of a stage
+PIPELINE_QUEUE_POLICIES = {  # What a full queue does with a new frame: block | drop_oldest | drop_newest
+    "detect": "drop_oldest",  # detect the freshest frame; never stall the camera
+    "track": "block",  # tracking and counting see every detected frame, in order
+    "classify": "block",
+    "render": "drop_oldest",  # the stream only needs the newest frame
+}
+
+# Video streaming (API server)
+FRAME_PASSTHROUGH = True  # Keep producer-encoded JPEG bytes as-is instead of decode + re-encode
+STREAM_VIEWER_POLL_TTL = 5.0  # Seconds a /api/video/frame poll keeps counting as an active viewer
+
+# Cameras (the API server keeps state, settings, ROI, frames and streams per camera ID)
+CAMERA_ID = 'default'  # Camera ID the detection services on this machine report as
+MAX_CAMERAS = 64  # Distinct camera IDs the API server accepts
+
+# Analytics push events (/api/events)
+EVENTS_MIN_INTERVAL = 0.25  # Fastest per-client event rate (seconds); clients may ask for slower via ?interval=
+EVENTS_CHANGE_LOG_SIZE = 1000  # Change entries kept for resuming clients
+
+# Versioned reads
+DETECTIONS_BUFFER_SIZE = 10000  # Detections kept in memory (oldest are overwritten)
+DETECTIONS_MAX_DELTA = 500  # Max detections returned by one /api/detections query
+
+# Stream ladder tiers (?tier=thumbnail|preview|full); full is the native resolution
+STREAM_JPEG_QUALITY = 85  # Full-size stream frames
+STREAM_PREVIEW_WIDTH = 640
+STREAM_PREVIEW_QUALITY = 75
+STREAM_THUMBNAIL_WIDTH = 320
+STREAM_THUMBNAIL_QUALITY = 60
+
+# Adaptive stream quality per client
+STREAM_BACKPRESSURE_SECONDS = 0.1  # A frame write slower than this means the client's socket is backing up
+STREAM_QUALITY_STEP = 15  # JPEG quality dropped per step for a backed-up client
+STREAM_MAX_QUALITY_STEPS = 3
+STREAM_MIN_QUALITY = 30
+STREAM_RECOVERY_FRAMES = 30  # Fast writes in a row before stepping quality back up
+
+# Stream production (detection services)
+STREAM_DRAW_OVERLAYS = True  # Burn boxes/labels into frames; False sends clean video and relies on /api/video/metadata
+STREAM_THUMBNAIL_FPS = 5  # Frame rate when only thumbnail views are open
+STREAM_IDLE_INTERVAL = 2.0  # Seconds between keep-alive frames when nobody is watching
+
+# Async serving mode (python api_server.py --async)
+ASYNC_MAX_CONNECTIONS = 1000  # Concurrent connections (streams, SSE, polls) served at once; the rest queue
+
+# Occupancy heatmaps (API server)
+HEATMAP_GRID_WIDTH = 64  # Cells across the camera frame
+HEATMAP_GRID_HEIGHT = 36
+HEATMAP_HALF_LIFE = 1800  # Seconds for a position's weight to halve
+HEATMAP_PYRAMID_LEVELS = 3  # Archived tile resolutions: full grid, 1/2, 1/4
+HEATMAP_ARCHIVE_INTERVAL = 60  # Seconds between archiving completed hours (stored in HISTORY_DB_PATH)
+
+# History store (API server; SQLite in WAL mode)
+HISTORY_DB_PATH = os.path.join(OUTPUT_DIR, 'history.db')
+HISTORY_FLUSH_INTERVAL = 5.0  # Seconds between batched writes
+HISTORY_BATCH_SIZE = 500  # Flush early once this many events are waiting
+HISTORY_MAX_PENDING = 50000  # Events buffered before the oldest are dropped
+HISTORY_RAW_RETENTION_DAYS = 7  # Raw events; rollups answer longer ranges
+HISTORY_MINUTE_RETENTION_DAYS = 30  # Minute rollups; hour/day rollups are kept indefinitely
+HISTORY_MAX_POINTS = 5000  # Points per /api/history series; longer ranges merge buckets
+
+# Warm restart snapshots (compact JSON in OUTPUT_DIR, atomically replaced; restored on startup)
+SNAPSHOT_INTERVAL = 5.0  # Seconds between snapshots of counter/tracker and server state
+SERVER_SNAPSHOT_PATH = os.path.join(OUTPUT_DIR, 'server_state.json')
+COUNTER_SNAPSHOT_PATH = os.path.join(OUTPUT_DIR, f'counter_state_{CAMERA_ID}.json')
+TRACKER_RESTORE_MAX_AGE = 10.0  # Seconds; older track positions are dropped on restore (counts are kept)
+
+# Metrics (Prometheus text format at the API server's /metrics; producers push theirs)
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)  # Seconds
+METRICS_PUSH_INTERVAL = 10.0  # Seconds between producer pushes to /api/internal/metrics
+METRICS_PUSH_TTL = 60.0  # Pushed metrics older than this are left out of /metrics (producer gone)
+
+# End-to-end latency tracing (frames and counts carry stage timestamps; see /api/latency)
+LATENCY_WINDOW = 2000  # Latest samples per traced hop used for /api/latency percentiles
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds, trace_latency_seconds
+COUNT_LATENCY_SLO = 2.0  # Seconds from camera capture to a count reaching a dashboard (checked at p99)
+
+# Telemetry client (detection services -> API server)
+TELEMETRY_TIMEOUT = 2.0  # Seconds; requests run on background threads so this never stalls the loop
+TELEMETRY_POOL_SIZE = 4  # Keep-alive connections kept open to the API server
+TELEMETRY_SENDER_THREADS = 2  # Lets counts go out while a frame upload is in flight
+TELEMETRY_MAX_PENDING = 32  # Distinct pending keys before the oldest is dropped
+TELEMETRY_MAX_BATCH = 200  # Max updates/events per field carried by one merged ingest batch
 
 # Create necessary directories
 os.makedirs(MODELS_DIR, exist_ok=True)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Detection Ring Buffer for the API Server
+Fixed-capacity store for detection events with indexes by camera and type,
+so recent-history queries never scan (or keep) the whole detection history.
+"""
+
+from datetime import datetime
+
+
+class DetectionBuffer:
+    """
+    Bounded, append-only ring of detections.
+
+    Every detection gets a sequence number (0, 1, 2, ...); once more than
+    `capacity` have been added the oldest are overwritten. Secondary indexes
+    keep the sequence numbers per camera, per type and per (camera, type) in
+    order, so a filtered query only touches matching entries:
+    O(log n + result) for any mix of camera, type and time range.
+
+    One writer at a time (the API server's state write lock). Readers don't
+    lock: they pass the sequence bound of their snapshot (`upto`) and skip
+    slots that were overwritten while they were reading.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.next_seq = 0  # sequence number of the next detection added
+        self._slots = [None] * capacity  # (seq, epoch seconds, detection)
+        # key -> (sorted seqs, index of the oldest live entry); replaced as a whole on change
+        self._by_camera = {}
+        self._by_type = {}
+        self._by_camera_type = {}
+
+    def __len__(self):
+        return min(self.next_seq, self.capacity)
+
+    # ============================================
+    # Writing (caller serializes writers)
+    # ============================================
+
+    def append(self, detection):
+        """Add a detection dict (needs "camera", "type" and an ISO "timestamp"); returns its seq"""
+        seq = self.next_seq
+        slot = seq % self.capacity
+        evicted = self._slots[slot]
+        if evicted is not None:
+            self._evict(evicted[2])
+        self._slots[slot] = (seq, datetime.fromisoformat(detection["timestamp"]).timestamp(), detection)
+        camera, detection_type = detection["camera"], detection["type"]
+        for index, key in ((self._by_camera, camera), (self._by_type, detection_type),
+                           (self._by_camera_type, (camera, detection_type))):
+            entry = index.get(key)
+            if entry is None:
+                index[key] = ([seq], 0)
+            else:
+                entry[0].append(seq)
+        self.next_seq = seq + 1
+        return seq
+
+    def truncate(self, next_seq):
+        """Drop the newest detections so next_seq is the next one added (undoes uncommitted appends)"""
+        while self.next_seq > next_seq:
+            seq = self.next_seq - 1
+            slot = seq % self.capacity
+            detection = self._slots[slot][2]
+            self._slots[slot] = None
+            camera, detection_type = detection["camera"], detection["type"]
+            for index, key in ((self._by_camera, camera), (self._by_type, detection_type),
+                               (self._by_camera_type, (camera, detection_type))):
+                seqs, head = index[key]
+                seqs.pop()
+                if head >= len(seqs):
+                    del index[key]
+            self.next_seq = seq
+
+    def _evict(self, detection):
+        # The evicted detection is the oldest live entry of each index it is in
+        camera, detection_type = detection["camera"], detection["type"]
+        for index, key in ((self._by_camera, camera), (self._by_type, detection_type),
+                           (self._by_camera_type, (camera, detection_type))):
+            seqs, head = index[key]
+            head += 1
+            if head >= len(seqs):
+                del index[key]  # cameras/types that went quiet don't keep an entry
+            elif head > 1024 and head * 2 > len(seqs):
+                index[key] = (seqs[head:], 0)  # compact; readers keep the old list
+            else:
+                index[key] = (seqs, head)
+
+    # ============================================
+    # Queries (lock-free)
+    # ============================================
+
+    def query(self, upto, camera=None, detection_type=None, start=None, end=None,
+              since_version=None, limit=None):
+        """
+        Return detections with seq < upto matching every given filter, oldest first.
+
+        Args:
+            upto: Exclusive sequence bound (the reader's snapshot detection count)
+            camera / detection_type: Exact match filters
+            start / end: Inclusive time range as epoch seconds
+            since_version: Only detections whose "version" is greater than this
+            limit: Return at most this many, keeping the newest
+        """
+        if camera is not None and detection_type is not None:
+            entry = self._by_camera_type.get((camera, detection_type))
+        elif camera is not None:
+            entry = self._by_camera.get(camera)
+        elif detection_type is not None:
+            entry = self._by_type.get(detection_type)
+        else:
+            entry = (range(max(0, self.next_seq - self.capacity), self.next_seq), 0)
+        if entry is None:
+            return []
+        seqs, lo = entry
+        hi = self._lower_bound(seqs, lo, len(seqs), lambda seq: seq < upto)
+        if end is not None:
+            hi = self._lower_bound(seqs, lo, hi, lambda seq: self._time_of(seq, end) <= end)
+
+        # Walk back from the newest match; every stop condition is monotonic
+        results = []
+        for i in range(hi - 1, lo - 1, -1):
+            seq = seqs[i]
+            item = self._slots[seq % self.capacity]
+            if item is None or item[0] != seq:
+                break  # overwritten while we were reading; everything older is gone too
+            _, timestamp, detection = item
+            if start is not None and timestamp < start:
+                break
+            if since_version is not None and detection["version"] <= since_version:
+                break
+            results.append(detection)
+            if limit is not None and len(results) >= limit:
+                break
+        results.reverse()
+        return results
+
+    def _time_of(self, seq, default):
+        item = self._slots[seq % self.capacity]
+        return item[1] if item is not None and item[0] == seq else default
+
+    @staticmethod
+    def _lower_bound(seqs, lo, hi, before):
+        """First index in [lo, hi) where before(seqs[i]) is False (before must be monotonic)"""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if before(seqs[mid]):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
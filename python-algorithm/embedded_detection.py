@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Embedded Detection for Single-Process Deployments
+Runs the people counter (people_counter_api.run_detection) as a background
+worker inside the API server (python api_server.py --embedded). Counts,
+settings, frames and metrics go through the server's helper functions instead
+of localhost HTTP: no JSON or JPEG round trip per update, and the server
+encodes frames only for the stream tiers someone is watching.
+"""
+
+import threading
+import time
+
+import config
+from telemetry_client import StreamPublisher
+
+
+class LocalTelemetry:
+    """
+    TelemetryClient stand-in backed by the API server's helper functions.
+
+    Implements the calls the detection service makes (settings read, batched
+    ingest, metrics push, stats); updates are applied synchronously on the
+    caller's thread, which for an in-process commit is cheaper than queueing.
+    """
+
+    def __init__(self, server, camera=None):
+        self.server = server  # the api_server module
+        self.camera = camera or config.CAMERA_ID
+        self.stats = {"sent": 0, "coalesced": 0, "dropped": 0, "failed": 0, "avg_latency_ms": 0.0,
+                      "pending": 0, "in_flight": 0}
+        self._lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def stop(self, flush_timeout=1.0):
+        pass
+
+    def get_json(self, endpoint, timeout=None):
+        """Only the camera settings read (/api/person-counting) is served in-process"""
+        if endpoint.split('?', 1)[0] != '/api/person-counting':
+            raise ValueError(f"{endpoint} is not available in embedded mode")
+        return self.server.get_detection_settings(self.camera)
+
+    def post_ingest(self, counts=None, gender=None, detections=None, positions=None,
+                    reset_token=None, callback=None, endpoint=None, trace=None, degradation=None):
+        """Apply a batch of updates; callback gets the same response fields as /api/internal/ingest"""
+        started = time.perf_counter()
+        try:
+            applied = self.server.ingest_updates(
+                self.camera, counts=counts, gender=gender, detections=detections, positions=positions,
+                reset_token=reset_token, trace=trace, degradation=degradation
+            )
+        except Exception as e:
+            self._record(time.perf_counter() - started, failed=True)
+            print(f"[ERROR] Embedded ingest failed: {e}")
+            return
+        self._record(time.perf_counter() - started)
+        if callback is not None:
+            callback({
+                "success": True,
+                "camera": self.camera,
+                "applied": applied,
+                "viewers": self.server.get_camera(self.camera, create=True)["frames"].viewer_state(),
+                "settings": self.server.get_detection_settings(self.camera),
+            })
+
+    def post_metrics(self, metrics, source):
+        self.server.store_producer_metrics(source, self.camera, metrics.snapshot())
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _record(self, seconds, failed=False):
+        with self._lock:
+            if failed:
+                self.stats["failed"] += 1
+                return
+            self.stats["sent"] += 1
+            # Running average, like TelemetryClient's
+            self.stats["avg_latency_ms"] += (seconds * 1000 - self.stats["avg_latency_ms"]) / self.stats["sent"]
+
+
+class LocalStream(StreamPublisher):
+    """
+    StreamPublisher that hands frames to the camera's frame channel as pixels.
+
+    Nothing is resized or JPEG-encoded here; the server encodes a frame once per
+    tier, and only when a viewer reads it. Frames are still held back to the
+    keep-alive interval while nobody is watching.
+    """
+
+    def __init__(self, server, camera=None, metrics=None):
+        super().__init__(None, metrics=metrics)
+        self.server = server
+        self.camera = camera or config.CAMERA_ID
+
+    def publish(self, frame, meta=None, trace=None):
+        now = time.time()
+        if self.mode == "off" and now - self._last_sent < config.STREAM_IDLE_INTERVAL:
+            return False
+        if meta is not None:
+            height, width = frame.shape[:2]
+            meta = dict(meta, frame_width=width, frame_height=height)
+        self._last_sent = now
+        self.server.update_video_frame(frame, meta, self.camera, trace)
+        self.update_viewers(self.server.get_camera(self.camera, create=True)["frames"].viewer_state())
+        return True
+
+
+class DetectionWorker:
+    """
+    The people counter as a managed background thread of the API server.
+
+    start() launches it (the detection models load on the worker thread, so
+    the server answers right away); if detection ends on its own (camera lost,
+    error) it is restarted after config.EMBEDDED_RESTART_DELAY seconds;
+    stop() ends it and waits for the final counts and snapshot to be written.
+    The camera's status shows whether detection is running.
+    """
+
+    def __init__(self, server, camera=None):
+        self.server = server
+        self.camera = camera or config.CAMERA_ID
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="embedded-detection", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=15.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print("[WARNING] Embedded detection did not stop in time")
+            self._thread = None
+
+    def _run(self):
+        # Imported here: loads TensorFlow/YOLO, which only embedded mode needs
+        import people_counter_api as counter
+        counter.use_transport(LocalTelemetry(self.server, self.camera),
+                              LocalStream(self.server, self.camera, metrics=counter.metrics))
+        while not self._stop.is_set():
+            self._set_status("running")
+            try:
+                counter.run_detection(stop_event=self._stop)
+            except Exception as e:
+                print(f"[ERROR] Embedded detection failed: {e}")
+            self._set_status("stopped")
+            if self._stop.wait(config.EMBEDDED_RESTART_DELAY):
+                break
+            print(f"[INFO] Restarting embedded detection for camera {self.camera}...")
+
+    def _set_status(self, status):
+        self.server.update_camera_status(
+            [{"id": self.camera, "status": status, "mode": "embedded"}],
+            detection_running=status == "running"
+        )
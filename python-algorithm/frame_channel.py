@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Per-Camera Video Frame Channel for the API Server
+Holds one camera's current frame, its detection metadata, the stream ladder
+renders and the stream viewer counts. Each camera has its own locks, so
+frames from different cameras never wait on each other.
+"""
+
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+
+JPEG_QUALITY = config.STREAM_JPEG_QUALITY
+
+# Stream ladder: every tier is rendered at most once per frame (per quality step)
+# and shared by all clients of that tier. The full tier at step 0 is the
+# producer's JPEG itself. Clients whose socket writes back up are moved down
+# quality steps (config.STREAM_QUALITY_STEP each) until they keep up again.
+STREAM_TIERS = {
+    "thumbnail": {"width": config.STREAM_THUMBNAIL_WIDTH, "quality": config.STREAM_THUMBNAIL_QUALITY},
+    "preview": {"width": config.STREAM_PREVIEW_WIDTH, "quality": config.STREAM_PREVIEW_QUALITY},
+    "full": {"width": None, "quality": JPEG_QUALITY},
+}
+
+
+class FrameChannel:
+    """
+    One camera's live video state.
+
+    `jpeg` holds the producer-encoded JPEG exactly as received and is what the
+    stream endpoints serve; `frame` (decoded BGR pixels) is only built on demand
+    for server-side features that need it. `seq` increments on every new frame
+    and is shared by MJPEG part headers and metadata events; `cond` is notified
+    whenever a new frame is stored.
+    """
+
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.frame = None
+        self.jpeg = None
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        # Detection metadata for the current frame (boxes, track IDs, labels, ROI),
+        # serialized once per frame as an SSE event
+        self.meta = None
+        self.meta_event = None
+        self.trace = None  # latency trace of the current frame (see latency_tracker.py)
+        self._tier_cache = {}  # (tier, quality_step) -> JPEG bytes for the current seq
+        self._ladder_lock = threading.Lock()
+        # Open MJPEG connections per tier ("metadata": open /api/video/metadata
+        # connections, which need every frame's metadata but no tier); single-frame
+        # polls count as a viewer for config.STREAM_VIEWER_POLL_TTL seconds
+        self._viewers = dict({tier: 0 for tier in STREAM_TIERS}, metadata=0)
+        self._poll_times = {tier: 0.0 for tier in STREAM_TIERS}
+        self._viewers_lock = threading.Lock()
+
+    # ============================================
+    # Producer side
+    # ============================================
+
+    def store_encoded(self, frame_data, meta=None, trace=None):
+        """
+        Store a producer-encoded JPEG as the current frame.
+
+        With config.FRAME_PASSTHROUGH enabled the bytes are kept as-is and only
+        decoded if something later asks for pixels; otherwise the frame is decoded
+        up front (validating it) and re-encoded once on the next read.
+        Returns True if the frame was accepted.
+        """
+        if config.FRAME_PASSTHROUGH:
+            # Cheap sanity check instead of a full decode: JPEG SOI marker
+            if not frame_data.startswith(b'\xff\xd8'):
+                return False
+            with self.lock:
+                self.jpeg = frame_data
+                self.frame = None
+                self._advance(meta, trace)
+            return True
+
+        frame = cv2.imdecode(np.frombuffer(frame_data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return False
+        with self.lock:
+            self.frame = frame
+            self.jpeg = None
+            self._advance(meta, trace)
+        return True
+
+    def update(self, frame, meta=None, trace=None):
+        """Store BGR pixels as the current frame (in-process producers)"""
+        with self.lock:
+            self.frame = frame.copy()
+            self.jpeg = None
+            self._advance(meta, trace)
+
+    def _advance(self, meta=None, trace=None):
+        """Bump the sequence, drop ladder renders of the old frame and publish its metadata (lock held)"""
+        self.seq += 1
+        self._tier_cache = {}
+        self.meta = meta
+        self.trace = trace
+        if meta is not None:
+            event = dict(meta, seq=self.seq, camera=self.camera_id)
+            self.meta_event = f"id: {self.seq}\nevent: frame\ndata: {json.dumps(event)}\n\n".encode()
+        else:
+            self.meta_event = None
+        self.cond.notify_all()
+
+    # ============================================
+    # Reader side
+    # ============================================
+
+    def get_frame(self):
+        """Return the current frame as BGR pixels, decoding the stored JPEG lazily"""
+        with self.lock:
+            return self._current(pixels=True)[2]
+
+    def get_jpeg(self):
+        """Return the current frame as JPEG bytes, encoding pixels at most once per frame"""
+        with self.lock:
+            return self._current(jpeg=True)[1]
+
+    def _current(self, jpeg=False, pixels=False):
+        """
+        (seq, JPEG bytes, BGR pixels) of the current frame, building the requested
+        form if missing (lock held, so the seq always belongs to the data)
+        """
+        if jpeg and self.jpeg is None and self.frame is not None:
+            ret, buffer = cv2.imencode('.jpg', self.frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if ret:
+                self.jpeg = buffer.tobytes()
+        if pixels and self.frame is None and self.jpeg is not None:
+            self.frame = cv2.imdecode(np.frombuffer(self.jpeg, np.uint8), cv2.IMREAD_COLOR)
+        return self.seq, self.jpeg, self.frame
+
+    def get_trace(self, seq):
+        """Latency trace of frame seq if it is still the current frame, else None"""
+        with self.lock:
+            return self.trace if self.seq == seq else None
+
+    def get_tier_jpeg(self, tier, quality_step=0):
+        """
+        Return (seq, JPEG bytes) for a stream ladder tier.
+
+        Renders are cached per frame, so each tier/quality is resized and encoded
+        once no matter how many clients read it. Frames are never upscaled.
+        """
+        spec = STREAM_TIERS[tier]
+        if tier == "full" and quality_step == 0:
+            with self.lock:
+                seq, frame_bytes, _ = self._current(jpeg=True)
+            return seq, frame_bytes
+
+        key = (tier, quality_step)
+        with self.lock:
+            seq, cached = self.seq, self._tier_cache.get(key)
+        if cached is not None:
+            return seq, cached
+
+        with self._ladder_lock:
+            # Another client may have rendered it while we waited
+            with self.lock:
+                cached = self._tier_cache.get(key)
+                if cached is not None:
+                    return self.seq, cached
+                # Pixels and seq read together, so the render is tagged with its own frame's seq
+                seq, _, frame = self._current(pixels=True)
+            if frame is None:
+                return seq, None
+            height, width = frame.shape[:2]
+            if spec["width"] and width > spec["width"]:
+                scale = spec["width"] / width
+                frame = cv2.resize(frame, (spec["width"], int(height * scale)), interpolation=cv2.INTER_AREA)
+            quality = max(config.STREAM_MIN_QUALITY, spec["quality"] - quality_step * config.STREAM_QUALITY_STEP)
+            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ret:
+                return seq, None
+
+            frame_bytes = buffer.tobytes()
+            with self.lock:
+                if self.seq == seq:
+                    self._tier_cache[key] = frame_bytes
+            return seq, frame_bytes
+
+    # ============================================
+    # Viewers
+    # ============================================
+
+    def add_viewer(self, tier, count=1):
+        """Register (count=1) or unregister (count=-1) an open stream (tier) or "metadata" connection"""
+        with self._viewers_lock:
+            self._viewers[tier] += count
+
+    def record_poll(self, tier):
+        """Count a single-frame poll as a viewer for a while"""
+        with self._viewers_lock:
+            self._poll_times[tier] = time.time()
+
+    def viewer_state(self):
+        """Active viewers per tier (open streams plus recent single-frame polls), metadata subscribers and total"""
+        now = time.time()
+        with self._viewers_lock:
+            state = {
+                tier: self._viewers[tier] + (1 if now - self._poll_times[tier] < config.STREAM_VIEWER_POLL_TTL else 0)
+                for tier in STREAM_TIERS
+            }
+            state["metadata"] = self._viewers["metadata"]
+        state["total"] = sum(state.values())
+        return state
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Closed-Loop Frame Pacing for Detection Services
+Decides per camera frame, from its capture timestamp, whether to process it.
+Frames are admitted at most once per interval; the interval follows the
+measured per-frame stage times (never admit faster than the slowest stage can
+finish) and backs off while frames wait in queues longer than the latency SLO
+allows. Skipped frames cost one camera read and nothing else.
+"""
+
+import threading
+import time
+
+import config
+
+
+class FramePacer:
+    """
+    Admission controller for a camera loop.
+
+    Call admit(capture_ts) right after each read and process the frame only if
+    it returns True; call done(capture_ts, stage_times) when the frame leaves
+    the last stage. stage_times is {stage: seconds per frame}; serial loops can
+    leave it out, and the frame's whole processing time is used instead.
+    """
+
+    def __init__(self, target_fps=None, latency_slo=None, metrics=None):
+        self.target_fps = target_fps or config.PACING_TARGET_FPS
+        self.latency_slo = config.PACING_LATENCY_SLO if latency_slo is None else latency_slo
+        self.smoothing = config.PACING_SMOOTHING
+        self.min_interval = 1.0 / self.target_fps
+        self.interval = self.min_interval  # seconds between admitted capture timestamps
+        self.service = 0.0  # EWMA of the slowest stage's time per frame (throughput floor)
+        self.processing = 0.0  # EWMA of the frame's total stage time (latency floor)
+        self.latency = 0.0  # EWMA of capture -> done
+        self.stats = {"admitted": 0, "skipped": 0}
+        self._frame_period = 0.0  # EWMA of the camera's frame interval
+        self._last_capture = None
+        self._last_admitted = None
+        self._lock = threading.Lock()
+        self._interval_gauge = self._skipped_counter = None
+        if metrics is not None:
+            self._interval_gauge = metrics.gauge(
+                "pacing_interval_seconds", "Seconds between frames admitted for processing")
+            self._skipped_counter = metrics.counter(
+                "pacing_frames_skipped_total", "Camera frames skipped by the frame pacer")
+
+    def admit(self, capture_ts):
+        """True if the frame captured at capture_ts should be processed"""
+        with self._lock:
+            if self._last_capture is not None and capture_ts > self._last_capture:
+                self._frame_period = self._ewma(self._frame_period, capture_ts - self._last_capture)
+            self._last_capture = capture_ts
+            # Half a camera period of slack, so a 30 FPS camera paced to 15 FPS admits
+            # every second frame despite timestamp jitter
+            if (self._last_admitted is not None
+                    and capture_ts - self._last_admitted < self.interval - self._frame_period / 2):
+                self.stats["skipped"] += 1
+                if self._skipped_counter is not None:
+                    self._skipped_counter.inc()
+                return False
+            self._last_admitted = capture_ts
+            self.stats["admitted"] += 1
+            return True
+
+    def done(self, capture_ts, stage_times=None):
+        """Feed back a processed frame's end-to-end latency and the current stage times"""
+        now = time.time()
+        latency = now - capture_ts
+        with self._lock:
+            if stage_times:
+                service, processing = max(stage_times.values()), sum(stage_times.values())
+            else:
+                service = processing = latency
+            self.service = self._ewma(self.service, service)
+            self.processing = self._ewma(self.processing, processing)
+            self.latency = self._ewma(self.latency, latency)
+            floor = max(self.min_interval, self.service)
+            # Time frames spent waiting in queues; the only part pacing can remove
+            waiting = self.latency - self.processing
+            budget = self.latency_slo - self.processing
+            if self.latency_slo > 0 and budget > 0 and waiting > budget:
+                self.interval = min(config.PACING_MAX_INTERVAL, self.interval * 1.25)
+            else:
+                self.interval += (floor - self.interval) * self.smoothing
+            self.interval = max(self.interval, floor)
+            if self._interval_gauge is not None:
+                self._interval_gauge.set(self.interval)
+
+    def fps(self):
+        """Frame rate currently admitted"""
+        return 1.0 / self.interval
+
+    def _ewma(self, current, sample):
+        return sample if current == 0.0 else current + (sample - current) * self.smoothing
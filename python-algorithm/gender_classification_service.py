@@ -8,12 +8,14 @@ import os
 import time
 import numpy as np
 import cv2
-import requests
 from datetime import datetime
 from tensorflow.keras.models import load_model
 from tensorflow.keras.applications.resnet50 import preprocess_input
 
 import config
+from frame_pacer import FramePacer
+from metrics import MetricsRegistry, stage_histogram
+from telemetry_client import TelemetryClient, StreamPublisher
 
 # API Configuration
 API_BASE_URL = "http://localhost:5000"
@@ -27,6 +29,18 @@ class GenderClassificationService:
         self.face_cascade = None
         self.camera = None
         self.is_running = False
+        # Per-stage timings and counters, pushed to the API server's /metrics
+        self.metrics = MetricsRegistry()
+        self.capture_seconds = stage_histogram(self.metrics, "capture")
+        self.face_detection_seconds = stage_histogram(self.metrics, "face_detection")
+        self.gender_inference_seconds = stage_histogram(self.metrics, "gender_inference")
+        self.frames_total = self.metrics.counter("pipeline_frames_total", "Frames read from the camera")
+        self.people_counted_total = self.metrics.counter("pipeline_people_counted_total",
+                                                         "People counted (gender classified once)")
+        self.fps_gauge = self.metrics.gauge("pipeline_fps", "Average processed frames per second since start")
+        self.telemetry = TelemetryClient(API_BASE_URL, metrics=self.metrics)
+        self.stream = StreamPublisher(self.telemetry, metrics=self.metrics)
+        self.pacer = FramePacer(metrics=self.metrics)
         
         # Person tracking variables
         self.tracked_people = []
@@ -73,23 +87,20 @@ class GenderClassificationService:
             self.face_cascade = None
     
     def send_to_api(self, endpoint, data):
-        """Send data to the Flask API"""
-        try:
-            response = requests.post(f"{API_BASE_URL}{endpoint}", json=data, timeout=1)
-            return response.json()
-        except Exception as e:
-            print(f"[API] Failed to send to {endpoint}: {e}")
-            return None
+        """Queue data for the Flask API (non-blocking, latest payload per endpoint wins)"""
+        self.telemetry.post_json(endpoint, data)
     
-    def update_gender_counts(self):
-        """Send gender count updates to API"""
+    def update_gender_counts(self, trace=None):
+        """Send gender count updates to API (trace: latency trace of the frame they come from)"""
         try:
-            self.send_to_api("/api/gender-classification/update", {
+            if trace is not None:
+                trace = dict(trace, queued_ts=time.time())
+            self.telemetry.post_ingest(gender=[{
                 "male_count": self.male_count,
                 "female_count": self.female_count,
                 "total_count": self.total_people_counted,
                 "timestamp": datetime.now().isoformat()
-            })
+            }], trace=trace, callback=lambda data: self.stream.update_viewers(data.get("viewers")))
         except Exception as e:
             print(f"[ERROR] Failed to update gender counts: {e}")
     
@@ -157,34 +168,41 @@ class GenderClassificationService:
             print("[INFO] Press Ctrl+C to stop")
             
             self.is_running = True
+            self.telemetry.start()
             frame_count = 0
             processed_frame_count = 0
             start_time = time.time()
             last_api_update = 0
+            last_metrics_push = 0
 
             while self.is_running:
-                ret, frame = self.camera.read()
+                with self.capture_seconds.time():
+                    ret, frame = self.camera.read()
                 if not ret:
                     print("[WARNING] Failed to grab frame")
                     break
 
                 frame_count += 1
-
-                # Frame skipping for high FPS to maintain stability
-                current_time = time.time()
-                if processed_frame_count > 10:  # Wait for stable FPS measurement
-                    fps = processed_frame_count / (current_time - start_time)
-                    if fps > config.FRAME_SKIP_THRESHOLD:
-                        # Skip frames to maintain stability
-                        skip_frames = int(fps / config.MAX_FPS)
-                        if frame_count % (skip_frames + 1) != 0:
-                            continue
+                self.frames_total.inc()
+                # Latency trace: stage timestamps carried with this frame to the API server
+                trace = {"seq": frame_count, "capture_ts": time.time()}
+                
+                if time.time() - last_metrics_push > config.METRICS_PUSH_INTERVAL:
+                    if processed_frame_count > 0:
+                        self.fps_gauge.set(processed_frame_count / (time.time() - start_time))
+                    self.telemetry.post_metrics(self.metrics, "gender_classification")
+                    last_metrics_push = time.time()
+
+                # Skip frames that arrive faster than they can be (or need to be) processed
+                if not self.pacer.admit(trace["capture_ts"]):
+                    continue
                 
                 # Flip frame horizontally for mirror effect
                 frame = cv2.flip(frame, 1)
                 
                 # Detect faces
-                faces = self.detect_faces(frame)
+                with self.face_detection_seconds.time():
+                    faces = self.detect_faces(frame)
                 
                 # Update tracking buffer
                 if len(self.face_tracking_buffer) > self.tracking_frames:
@@ -218,8 +236,9 @@ class GenderClassificationService:
 
                         # Batch prediction
                         if face_arrays:
-                            batch_array = np.array(face_arrays)
-                            predictions = self.model.predict(batch_array, verbose=0)
+                            with self.gender_inference_seconds.time():
+                                batch_array = np.array(face_arrays)
+                                predictions = self.model.predict(batch_array, verbose=0)
 
                             # Process each prediction
                             for i, (x, y, w, h) in enumerate(face_info):
@@ -245,6 +264,7 @@ class GenderClassificationService:
                                 # If new person, count them
                                 if is_new:
                                     self.total_people_counted += 1
+                                    self.people_counted_total.inc()
 
                                     if gender_idx == 1:  # MALE (index 1 from alphabetical order)
                                         self.male_count += 1
@@ -286,6 +306,7 @@ class GenderClassificationService:
 
                                 if is_new:
                                     self.total_people_counted += 1
+                                    self.people_counted_total.inc()
                                     if gender_idx == 1:
                                         self.male_count += 1
                                     elif gender_idx == 0:
@@ -308,28 +329,37 @@ class GenderClassificationService:
                 
                 # Update tracking buffer
                 self.face_tracking_buffer.extend(current_frame_faces)
+                trace["detected_ts"] = time.time()
                 
-                # Send updates to API every 10 frames
-                if frame_count % 10 == 0:
-                    self.update_gender_counts()
+                # Send updates to API every 10 processed frames
+                if processed_frame_count % 10 == 0:
+                    self.update_gender_counts(trace)
                     last_api_update = time.time()
                 
-                # Send frame to API for streaming
-                try:
-                    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    requests.post(f"{API_BASE_URL}/api/internal/update-frame", 
-                                files={'frame': buffer.tobytes()},
-                                timeout=0.1)
-                except:
-                    pass
+                # Send frame to API for streaming (skipped/downscaled when nobody is watching)
+                frame_objects = []
+                for face in current_frame_faces:
+                    x, y, w, h = face['bbox']
+                    frame_objects.append({
+                        "box": [int(x), int(y), int(x + w), int(y + h)],
+                        "gender": face['gender'],
+                        "gender_confidence": float(face['confidence'])
+                    })
+                self.stream.publish(frame, {"status": "ok", "objects": frame_objects, "roi": None}, trace)
 
                 processed_frame_count += 1
+                self.pacer.done(trace["capture_ts"])
 
                 # Calculate and display FPS every 30 frames
                 if processed_frame_count % 30 == 0 and processed_frame_count > 0:
                     current_time = time.time()
                     fps = processed_frame_count / (current_time - start_time)
-                    print(f"[INFO] Current FPS: {fps:.1f}")
+                    print(f"[INFO] Current FPS: {fps:.1f} (paced at {self.pacer.fps():.1f}, "
+                          f"{self.pacer.stats['skipped']} camera frames skipped)")
+                    stats = self.telemetry.get_stats()
+                    print(f"[API] Telemetry - sent: {stats['sent']}, coalesced: {stats['coalesced']}, "
+                          f"dropped: {stats['dropped']}, failed: {stats['failed']}, "
+                          f"avg latency: {stats['avg_latency_ms']:.1f} ms")
                 
         except KeyboardInterrupt:
             print("\n[INFO] Stopping gender classification service...")
@@ -346,6 +376,7 @@ class GenderClassificationService:
         if self.camera:
             self.camera.release()
             print("[INFO] Camera released")
+        self.telemetry.stop()
         print(f"[INFO] Service stopped. Final counts - Male: {self.male_count}, Female: {self.female_count}, Total: {self.total_people_counted}")
 
 
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Occupancy Heatmap Engine for the API Server
+Accumulates confirmed track positions into per-camera numpy grids with
+exponential time decay, and serves them as quantized arrays or PNGs.
+Completed hours are archived as sparse, compressed tiles (with coarser
+pyramid levels and per-day sums) for historical range queries.
+"""
+
+import base64
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import config
+from history_store import bucket_start
+
+
+def quantize(grid):
+    """Scale a grid to uint8 with the hottest cell at 255"""
+    peak = float(grid.max())
+    if peak <= 0:
+        return np.zeros(grid.shape, dtype=np.uint8)
+    return np.round(grid * (255.0 / peak)).astype(np.uint8)
+
+
+class DecayingHeatmap:
+    """
+    2D histogram of positions whose weight halves every `half_life` seconds.
+
+    Decay is never applied cell by cell. Instead new samples are added with
+    weight exp((t - t0) / tau), which grows over time, and readers scale the
+    whole grid by exp(-(now - t0) / tau). Adding a sample is therefore O(1);
+    when the weights get large the grid is rescaled once and t0 moved up,
+    which amortizes to O(1) as well.
+    """
+
+    RENORMALIZE_AT = 1e12  # rescale before float64 precision becomes a concern
+
+    def __init__(self, width, height, half_life):
+        self.width = width
+        self.height = height
+        self.tau = half_life / math.log(2)
+        self.grid = np.zeros((height, width), dtype=np.float64)
+        self.t0 = time.time()
+        self.version = 0  # increments on every add; render caches are keyed by it
+        self.updated_at = None
+
+    def add(self, x, y, weight=1.0, ts=None):
+        """Add a sample at normalized coordinates (0..1, 0..1); returns its (row, col) cell"""
+        ts = ts or time.time()
+        scale = math.exp((ts - self.t0) / self.tau)
+        if scale > self.RENORMALIZE_AT:
+            self.grid *= 1.0 / scale
+            self.t0 = ts
+            scale = 1.0
+        col = min(self.width - 1, max(0, int(x * self.width)))
+        row = min(self.height - 1, max(0, int(y * self.height)))
+        self.grid[row, col] += weight * scale
+        self.version += 1
+        self.updated_at = ts
+        return row, col
+
+    def decay_factor(self, now=None):
+        """Multiplier that turns stored grid values into decayed weights at time now"""
+        return math.exp(-((now or time.time()) - self.t0) / self.tau)
+
+
+class HeatmapEngine:
+    """
+    Per-camera DecayingHeatmaps plus render caches.
+
+    Renders are normalized to the grid's own maximum, and decay scales every
+    cell equally, so a render only changes when a sample is added: the uint8
+    array and PNG are built once per camera version and reused until then.
+    """
+
+    def __init__(self, width=None, height=None, half_life=None):
+        self.width = width or config.HEATMAP_GRID_WIDTH
+        self.height = height or config.HEATMAP_GRID_HEIGHT
+        self.half_life = half_life or config.HEATMAP_HALF_LIFE
+        self._maps = {}  # camera -> DecayingHeatmap
+        self._cache = {}  # camera -> {"version", "array", "data", "png", "raw_peak", "updated_at"}
+        # Undecayed counts for the current local hour, for the archive
+        self._hours = {}  # camera -> [hour start, hour end, float32 grid]
+        self._finished = []  # (camera, hour start, grid) waiting to be archived
+        self._lock = threading.Lock()
+
+    def add(self, camera, x, y, weight=1.0, ts=None):
+        """Add one confirmed track position (normalized frame coordinates)"""
+        ts = ts or time.time()
+        with self._lock:
+            heatmap = self._maps.get(camera)
+            if heatmap is None:
+                heatmap = self._maps[camera] = DecayingHeatmap(self.width, self.height, self.half_life)
+            row, col = heatmap.add(x, y, weight, ts)
+            
+            hour = self._hours.get(camera)
+            if hour is None or ts >= hour[1]:
+                if hour is not None:
+                    self._finished.append((camera, hour[0], hour[2]))
+                start = bucket_start(ts, "hour")
+                hour = self._hours[camera] = [start, start + 3600, np.zeros((self.height, self.width), np.float32)]
+            # A sample arriving late for an already closed hour counts toward the current one
+            hour[2][row, col] += weight
+
+    def take_finished_hours(self, now=None, include_current=False):
+        """
+        Hand over completed hour grids as [(camera, hour start, grid)].
+
+        Hours that ended without a later sample are closed here too; with
+        include_current the partial current hours are handed over as well (at
+        shutdown - the archive merges tiles, so a restart can continue the hour).
+        """
+        now = now or time.time()
+        with self._lock:
+            finished, self._finished = self._finished, []
+            for camera, hour in list(self._hours.items()):
+                if include_current or now >= hour[1]:
+                    finished.append((camera, hour[0], hour[2]))
+                    del self._hours[camera]
+        return finished
+
+    def cameras(self):
+        """Cameras that have a heatmap, with their current versions"""
+        with self._lock:
+            return {camera: heatmap.version for camera, heatmap in self._maps.items()}
+
+    def version(self, camera):
+        with self._lock:
+            heatmap = self._maps.get(camera)
+            return heatmap.version if heatmap else None
+
+    def render(self, camera, with_png=False):
+        """
+        Return the cached render for camera (building it if a sample arrived since):
+        {"version", "array" (uint8 HxW, 0-255), "data" (array bytes, base64), "png",
+        "peak", "updated_at"}, or None. "png" is only encoded when with_png is set;
+        "peak" is the current decayed weight of the hottest cell.
+        """
+        with self._lock:
+            heatmap = self._maps.get(camera)
+            if heatmap is None:
+                return None
+            cached = self._cache.get(camera)
+            if cached is None or cached["version"] != heatmap.version:
+                peak = float(heatmap.grid.max())
+                array = quantize(heatmap.grid)
+                cached = self._cache[camera] = {
+                    "version": heatmap.version,
+                    "array": array,
+                    "data": base64.b64encode(array.tobytes()).decode('ascii'),
+                    "png": None,  # encoded on first PNG request
+                    "raw_peak": peak,
+                    "updated_at": heatmap.updated_at,
+                }
+            if with_png and cached["png"] is None:
+                ret, buffer = cv2.imencode('.png', cached["array"])
+                cached["png"] = buffer.tobytes() if ret else b''
+            factor = heatmap.decay_factor()
+        return dict(cached, peak=cached["raw_peak"] * factor)
+
+
+# ============================================
+# Hourly tile archive
+# ============================================
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS heatmap_tiles (
+    camera TEXT NOT NULL,
+    period TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    total REAL NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (camera, period, level, bucket)
+) WITHOUT ROWID;
+"""
+
+
+def encode_tile(grid):
+    """Sparse, compressed tile: zlib(nonzero flat indices as uint32 + their float32 values)"""
+    flat = grid.ravel()
+    index = np.flatnonzero(flat).astype(np.uint32)
+    values = flat[index].astype(np.float32)
+    return zlib.compress(index.tobytes() + values.tobytes())
+
+
+def decode_tile_into(dense, data):
+    """Add an encoded tile onto dense (same shape) in place"""
+    raw = zlib.decompress(data)
+    count = len(raw) // 8
+    index = np.frombuffer(raw, dtype=np.uint32, count=count)
+    values = np.frombuffer(raw, dtype=np.float32, offset=count * 4)
+    dense.ravel()[index] += values  # indices within a tile are unique
+
+
+def pyramid(grid, levels):
+    """[grid, 2x2 sums, 4x4 sums, ...] - odd edges are zero-padded before pooling"""
+    result = [grid]
+    for _ in range(levels - 1):
+        height, width = grid.shape
+        if height < 2 or width < 2:
+            break
+        grid = np.pad(grid, ((0, height % 2), (0, width % 2)))
+        grid = grid.reshape(grid.shape[0] // 2, 2, grid.shape[1] // 2, 2).sum(axis=(1, 3))
+        result.append(grid)
+    return result
+
+
+class HeatmapArchive:
+    """
+    Per-camera, per-hour heatmap tiles in SQLite.
+
+    A background thread periodically takes completed hours from the engine and
+    stores each as sparse compressed tiles at config.HEATMAP_PYRAMID_LEVELS
+    resolutions (full grid, then 2x2-pooled, ...), and adds them into the
+    tile of their local day. A range query then decodes and sums a handful of
+    small tiles: whole days come from day tiles, partial days and hour-of-day /
+    weekday filters from hour tiles. Raw tracks are never revisited.
+    """
+
+    def __init__(self, engine, path, interval=None):
+        self.engine = engine
+        self.path = path
+        self.interval = interval or config.HEATMAP_ARCHIVE_INTERVAL
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Create the table and start the archiver thread"""
+        self._connect().close()
+        self._thread = threading.Thread(target=self._archive_loop, name="heatmap-archiver", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the archiver, storing the partial current hours"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(ARCHIVE_SCHEMA)
+        return conn
+
+    def _archive_loop(self):
+        conn = self._connect()
+        try:
+            while not self._stop.wait(self.interval):
+                self.archive(conn, self.engine.take_finished_hours())
+            self.archive(conn, self.engine.take_finished_hours(include_current=True))
+        finally:
+            conn.close()
+
+    def archive(self, conn, hours):
+        """Store [(camera, hour start, grid)] as hour tiles and fold them into day tiles"""
+        if not hours:
+            return
+        try:
+            with conn:
+                for camera, hour, grid in hours:
+                    day = bucket_start(hour, "day")
+                    for level, tile in enumerate(pyramid(grid, config.HEATMAP_PYRAMID_LEVELS)):
+                        self._merge_tile(conn, camera, "hour", level, hour, tile)
+                        self._merge_tile(conn, camera, "day", level, day, tile)
+        except sqlite3.Error as e:
+            print(f"[ERROR] Heatmap archive failed ({len(hours)} hour tiles lost): {e}")
+
+    @staticmethod
+    def _merge_tile(conn, camera, period, level, bucket, tile):
+        row = conn.execute("SELECT data FROM heatmap_tiles WHERE camera = ? AND period = ? AND level = ? AND bucket = ?",
+                           (camera, period, level, bucket)).fetchone()
+        tile = tile.astype(np.float32)
+        if row is not None:
+            decode_tile_into(tile, row[0])
+        conn.execute("INSERT OR REPLACE INTO heatmap_tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (camera, period, level, bucket, tile.shape[0], tile.shape[1],
+                      float(tile.sum()), encode_tile(tile)))
+
+    def query(self, camera, start, end, hours=None, weekdays=None, level=0):
+        """
+        Sum archived tiles for camera between epoch seconds start and end (the
+        hour containing start counts in full).
+
+        Args:
+            hours: Set of local hours of day to include, e.g. {14, 15} for
+                   14:00-16:00
+            weekdays: Set of weekdays to include (0 = Monday ... 6 = Sunday)
+            level: Pyramid level (0 = full grid, each level halves the resolution)
+
+        Returns (grid, tile count); grid is None if nothing was archived.
+        """
+        # Whole local days inside the range come from day tiles unless hours are filtered
+        ranges = []
+        if hours is None:
+            full_start = bucket_start(start, "day")
+            if full_start < start:
+                full_start = bucket_start(full_start + 86400 + 7200, "day")  # next midnight (DST-safe)
+            full_end = bucket_start(end, "day")
+            if full_start < full_end:
+                ranges = [("day", full_start, full_end), ("hour", start, full_start), ("hour", full_end, end)]
+        if not ranges:
+            ranges = [("hour", start, end)]
+
+        if not os.path.exists(self.path):
+            return None, 0
+        # Read-only: no schema script or WAL switch (DDL, write lock) on the request path
+        conn = sqlite3.connect(Path(self.path).resolve().as_uri() + "?mode=ro", uri=True, timeout=10)
+        try:
+            rows = []
+            for period, range_start, range_end in ranges:
+                if period == "hour":
+                    # A range starting mid-hour still includes that hour's tile
+                    range_start = bucket_start(range_start, "hour")
+                rows += conn.execute(
+                    "SELECT bucket, height, width, data FROM heatmap_tiles "
+                    "WHERE camera = ? AND period = ? AND level = ? AND bucket >= ? AND bucket < ?",
+                    (camera, period, level, range_start, range_end)).fetchall()
+        except sqlite3.OperationalError:
+            rows = []  # table not created yet (archiver never started on this database)
+        finally:
+            conn.close()
+
+        grid, tiles = None, 0
+        for bucket, height, width, data in rows:
+            when = datetime.fromtimestamp(bucket)
+            if hours is not None and when.hour not in hours:
+                continue
+            if weekdays is not None and when.weekday() not in weekdays:
+                continue
+            if grid is None:
+                grid = np.zeros((height, width), np.float32)
+            decode_tile_into(grid, data)
+            tiles += 1
+        return grid, tiles
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+History Store for the API Server
+Persists count events to SQLite (WAL mode) from a background writer thread and
+keeps minute/hour/day rollups, so history survives restarts and range reads
+never scan raw events.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+import config
+
+GRANULARITIES = ("minute", "hour", "day")
+GRANULARITY_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+METRICS = ("entries", "exits", "male", "female", "detections", "occupancy")
+GAUGE_METRICS = {"occupancy"}  # reported as bucket average + peak instead of a sum
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ts REAL NOT NULL,
+    camera TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    granularity TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    total REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    peak REAL NOT NULL,
+    PRIMARY KEY (granularity, metric, bucket, camera)
+) WITHOUT ROWID;
+"""
+
+UPSERT_ROLLUP = """
+INSERT INTO rollups (granularity, metric, bucket, camera, total, samples, peak)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (granularity, metric, bucket, camera) DO UPDATE SET
+    total = total + excluded.total,
+    samples = samples + excluded.samples,
+    peak = MAX(peak, excluded.peak)
+"""
+
+
+def bucket_start(ts, granularity):
+    """Start of the local-time minute/hour/day containing epoch seconds ts"""
+    if granularity == "minute":
+        return int(ts // 60 * 60)
+    dt = datetime.fromtimestamp(ts).replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        dt = dt.replace(hour=0)
+    return int(dt.timestamp())
+
+
+def bucket_timeline(start, end, granularity):
+    """Every bucket start from the one containing start up to end, as an int64 array"""
+    first = bucket_start(start, granularity)
+    if granularity != "day":
+        return np.arange(first, int(end) + 1, GRANULARITY_SECONDS[granularity], dtype=np.int64)
+    # Local days aren't always 86400 s long (DST), so step by calendar date
+    days = []
+    day = datetime.fromtimestamp(first)
+    while day.timestamp() <= end:
+        days.append(int(day.timestamp()))
+        day = (day + timedelta(days=1, hours=3)).replace(hour=0)
+    return np.array(days, dtype=np.int64)
+
+
+class HistoryStore:
+    """
+    Batched time-series writer plus rollup queries.
+
+    record() only appends to an in-memory batch; a background thread writes the
+    batch in one transaction every config.HISTORY_FLUSH_INTERVAL seconds (or
+    sooner once config.HISTORY_BATCH_SIZE events are waiting). Each flush stores
+    the raw events and folds them into the minute, hour and day rollups with
+    upserts. Metrics are either counters (entries, exits, ...) summed per bucket
+    or gauges (occupancy) whose samples/peak give the bucket average and maximum.
+    """
+
+    def __init__(self, path, flush_interval=None, batch_size=None, max_pending=None):
+        self.path = path
+        self.flush_interval = flush_interval or config.HISTORY_FLUSH_INTERVAL
+        self.batch_size = batch_size or config.HISTORY_BATCH_SIZE
+        self.max_pending = max_pending or config.HISTORY_MAX_PENDING
+        self._pending = []  # (ts, camera, metric, value)
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._last_prune = 0.0
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "flushes": 0, "last_flush_ms": 0.0}
+
+    # ============================================
+    # Lifecycle
+    # ============================================
+
+    def start(self):
+        """Create the schema and start the background writer"""
+        if self._running:
+            return self
+        self._connect().close()
+        self._running = True
+        self._thread = threading.Thread(target=self._writer_loop, name="history-writer", daemon=True)
+        self._thread.start()
+        print(f"[INFO] History store: {self.path}")
+        return self
+
+    def stop(self):
+        """Stop the writer after flushing everything still pending"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+
+    # ============================================
+    # Recording (never touches the database)
+    # ============================================
+
+    def record(self, metric, value=1, camera="default", ts=None):
+        """Queue one event; value is a count increment or, for gauges, the current reading"""
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                # Writer can't keep up (or was never started): keep memory bounded
+                del self._pending[0]
+                self.stats["dropped"] += 1
+            self._pending.append((ts or time.time(), camera, metric, value))
+            self.stats["recorded"] += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    # ============================================
+    # Queries
+    # ============================================
+
+    def series(self, metric, start, end, granularity=None, step=1, camera=None, breakdown=None):
+        """
+        Dense, zero-filled series for a metric between epoch seconds start and end.
+
+        Rollup rows are merged onto the bucket timeline with numpy (scatter-add
+        per series, then reduceat for step > 1), so the cost is one indexed
+        rollup read plus array work regardless of how many raw events exist.
+
+        Args:
+            granularity: 'minute', 'hour' or 'day' (default: picked from the span)
+            step: Merge this many buckets per point (raised to stay within
+                  config.HISTORY_MAX_POINTS)
+            camera: Only this camera (default: all cameras summed)
+            breakdown: None for one "total" series, 'gender' for male/female
+                       (metric is ignored) or 'camera' for one series per camera
+
+        Gauges are averaged per camera and bucket first, then summed over
+        cameras (peaks too, so the combined peak is an upper bound): cameras
+        'a' and 'b' both reading occupancy 5 give a total series of 10.
+        """
+        granularity = granularity or self.pick_granularity(start, end)
+        timeline = bucket_timeline(start, end, granularity)
+        step = max(1, step, math.ceil(len(timeline) / config.HISTORY_MAX_POINTS))
+        metrics = ["male", "female"] if breakdown == "gender" else [metric]
+        gauge = metrics[0] in GAUGE_METRICS
+
+        sql = (f"SELECT metric, {'camera' if breakdown == 'camera' or gauge else 'NULL'}, bucket, "
+               f"SUM(total), SUM(samples), MAX(peak) FROM rollups "
+               f"WHERE granularity = ? AND metric IN ({','.join('?' * len(metrics))}) "
+               f"AND bucket >= ? AND bucket <= ?")
+        params = [granularity] + metrics + [int(timeline[0]) if len(timeline) else 0, int(end)]
+        if camera is not None:
+            sql += " AND camera = ?"
+            params.append(camera)
+        sql += " GROUP BY 1, 2, 3"
+        rows = self._read(sql, params)
+
+        if breakdown == "gender":
+            names = metrics
+        elif breakdown == "camera":
+            names = sorted({row[1] for row in rows})
+        else:
+            names = ["total"]
+        size = len(timeline)
+        totals = np.zeros((len(names), size))
+        samples = np.zeros((len(names), size))
+        peaks = np.zeros((len(names), size))
+        if rows and size:
+            columns = list(zip(*rows))
+            buckets = np.asarray(columns[2], dtype=np.int64)
+            if breakdown == "gender":
+                series_index = np.asarray([names.index(name) for name in columns[0]])
+            elif breakdown == "camera":
+                series_index = np.searchsorted(names, np.asarray(columns[1]))
+            else:
+                series_index = np.zeros(len(rows), dtype=np.intp)
+            position = np.searchsorted(timeline, buckets)
+            valid = position < size
+            valid[valid] = timeline[position[valid]] == buckets[valid]
+            index = (series_index[valid], position[valid])
+            row_totals = np.asarray(columns[3], dtype=np.float64)[valid]
+            row_samples = np.asarray(columns[4], dtype=np.float64)[valid]
+            row_peaks = np.asarray(columns[5], dtype=np.float64)[valid]
+            if gauge:
+                # One row per camera and bucket: add up the cameras' averages and peaks;
+                # samples then counts buckets with readings, for merging steps below
+                np.add.at(totals, index, row_totals / np.maximum(row_samples, 1))
+                np.maximum.at(samples, index, 1.0)
+                np.add.at(peaks, index, row_peaks)
+            else:
+                np.add.at(totals, index, row_totals)
+                np.add.at(samples, index, row_samples)
+                np.maximum.at(peaks, index, row_peaks)
+
+        if step > 1 and size:
+            starts = np.arange(0, size, step)
+            totals = np.add.reduceat(totals, starts, axis=1)
+            samples = np.add.reduceat(samples, starts, axis=1)
+            peaks = np.maximum.reduceat(peaks, starts, axis=1)
+            timeline = timeline[starts]
+
+        result = {
+            "metric": "gender" if breakdown == "gender" else metric,
+            "granularity": granularity,
+            "step": step,
+            "start": start,
+            "end": end,
+            "buckets": timeline.tolist(),
+            "series": {},
+            "totals": {},
+        }
+        if gauge:
+            average = np.divide(totals, samples, out=np.zeros_like(totals), where=samples > 0)
+            result["peak"] = {}
+            for i, name in enumerate(names):
+                result["series"][name] = np.round(average[i], 2).tolist()
+                result["peak"][name] = peaks[i].tolist()
+                result["totals"][name] = float(peaks[i].max()) if size else 0.0
+        else:
+            for i, name in enumerate(names):
+                result["series"][name] = totals[i].tolist()
+                result["totals"][name] = float(totals[i].sum())
+        return result
+
+    @staticmethod
+    def pick_granularity(start, end):
+        """Coarsest rollup that still gives a useful number of points for the range"""
+        span = end - start
+        if span <= 6 * 3600:
+            return "minute"
+        if span <= 14 * 86400:
+            return "hour"
+        return "day"
+
+    def get_stats(self):
+        """Writer counters plus current batch size"""
+        with self._cond:
+            stats = dict(self.stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+    # ============================================
+    # Background writer
+    # ============================================
+
+    def _connect(self):
+        """Writer connection; creates the schema and switches the database to WAL mode"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")  # readers never block the writer (or each other)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _read(self, sql, params):
+        """Run a query on a read-only connection (no DDL or write lock); [] before the first start()"""
+        if not os.path.exists(self.path):
+            return []
+        conn = sqlite3.connect(Path(self.path).resolve().as_uri() + "?mode=ro", uri=True, timeout=10)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                with self._cond:
+                    if self._running and len(self._pending) < self.batch_size:
+                        self._cond.wait(self.flush_interval)
+                    batch, self._pending = self._pending, []
+                    running = self._running
+                if batch:
+                    try:
+                        self._flush(conn, batch)
+                    except sqlite3.Error as e:
+                        print(f"[ERROR] History flush failed ({len(batch)} events lost): {e}")
+                if not running:
+                    return
+                if time.time() - self._last_prune > 3600:
+                    self._prune(conn)
+        finally:
+            conn.close()
+
+    def _flush(self, conn, batch):
+        started = time.time()
+        # Fold the batch in memory first so each bucket costs one upsert per flush
+        rollups = {}
+        for ts, camera, metric, value in batch:
+            for granularity in GRANULARITIES:
+                key = (granularity, metric, bucket_start(ts, granularity), camera)
+                entry = rollups.get(key)
+                if entry is None:
+                    rollups[key] = [value, 1, value]
+                else:
+                    entry[0] += value
+                    entry[1] += 1
+                    entry[2] = max(entry[2], value)
+        with conn:
+            conn.executemany("INSERT INTO events (ts, camera, metric, value) VALUES (?, ?, ?, ?)", batch)
+            conn.executemany(UPSERT_ROLLUP, [key + tuple(entry) for key, entry in rollups.items()])
+        with self._cond:
+            self.stats["written"] += len(batch)
+            self.stats["flushes"] += 1
+            self.stats["last_flush_ms"] = (time.time() - started) * 1000
+
+    def _prune(self, conn):
+        """Drop raw events and minute rollups past their retention (hour/day rollups are kept)"""
+        self._last_prune = time.time()
+        try:
+            with conn:
+                conn.execute("DELETE FROM events WHERE ts < ?",
+                             (self._last_prune - config.HISTORY_RAW_RETENTION_DAYS * 86400,))
+                conn.execute("DELETE FROM rollups WHERE granularity = 'minute' AND bucket < ?",
+                             (self._last_prune - config.HISTORY_MINUTE_RETENTION_DAYS * 86400,))
+        except sqlite3.Error as e:
+            print(f"[WARNING] History prune failed: {e}")
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Process-Pool Inference with Shared-Memory Frames
+Runs model inference (YOLO person detection, gender classification) in worker
+processes, so it doesn't contend for the GIL with capture, drawing and HTTP in
+the detection service. Input arrays are copied once into a slot of a shared
+memory block and passed by handle (slot, shape, dtype); results come back as
+a small binary header plus raw float32 rows over a pipe.
+"""
+
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import config
+
+# Task:   task id, slot, dtype code, ndim, shape (up to 4 dims), scalar parameter,
+#         input size (0 = model default), model tier (0 = primary)
+TASK = struct.Struct('<IIBB4IfHB')
+# Result: task id, status (0 ok, 1 error), rows, columns; followed by rows x columns
+# float32 values (or a UTF-8 error message)
+RESULT = struct.Struct('<IBII')
+READY_ID = 0xFFFFFFFF  # task id of the message a worker sends once its model is loaded
+DTYPES = {0: np.uint8, 1: np.float32}
+DTYPE_CODES = {np.dtype(dtype): code for code, dtype in DTYPES.items()}
+
+
+# ============================================
+# Model runners (called inside the worker processes)
+# ============================================
+
+def load_detector(weights, threads):
+    """YOLO person detector tiers {0: weights}, limited to `threads` CPU threads (0 = torch's default)"""
+    import torch
+    from ultralytics import YOLO
+    if threads:
+        torch.set_num_threads(threads)
+    return {0: YOLO(weights)}
+
+
+def detect_people(models, frame, confidence, size=0, tier=0):
+    """
+    Person boxes in a BGR frame as float32 rows of x1, y1, x2, y2, confidence.
+    size is the detector input resolution (0 = the model's default); tier 1 is
+    the lighter config.YOLO_LIGHT_WEIGHTS model, loaded on first use.
+    """
+    if tier not in models:
+        from ultralytics import YOLO
+        models[tier] = YOLO(config.YOLO_LIGHT_WEIGHTS)
+    options = {"imgsz": size} if size else {}
+    y_hat = models[tier].predict(frame, conf=confidence, classes=[0], device='cpu', verbose=False, **options)
+    boxes = y_hat[0].boxes
+    return np.hstack([boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy()[:, None]]).astype(np.float32)
+
+
+def load_gender_model(weights, threads):
+    """Keras gender classifier, limited to `threads` CPU threads"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    return tf.keras.models.load_model(weights)
+
+
+def classify_genders(model, faces, _, size=0, tier=0):
+    """Class probabilities (female, male) for a batch of RGB face crops sized config.IMAGE_SIZE"""
+    from tensorflow.keras.applications.resnet50 import preprocess_input
+    return model.predict(preprocess_input(faces.astype(np.float32)), verbose=0).astype(np.float32)
+
+
+def _worker_main(load, run, weights, threads, shm_name, slot_bytes, conn):
+    """Worker process: load the model once, then answer tasks until the pipe closes"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        try:
+            model = load(weights, threads)
+        except Exception as e:
+            conn.send_bytes(RESULT.pack(READY_ID, 1, 0, 0) + str(e).encode('utf-8'))
+            return
+        conn.send_bytes(RESULT.pack(READY_ID, 0, 0, 0))
+        while True:
+            try:
+                message = conn.recv_bytes()
+            except EOFError:
+                return
+            if not message:
+                return
+            task_id, slot, dtype_code, ndim, *shape, param, size, tier = TASK.unpack(message)
+            array = np.ndarray(tuple(shape[:ndim]), DTYPES[dtype_code], buffer=shm.buf, offset=slot * slot_bytes)
+            try:
+                result = np.ascontiguousarray(run(model, array, param, size, tier), dtype=np.float32)
+                if result.ndim != 2:
+                    result = result.reshape(len(result), -1)
+                reply = RESULT.pack(task_id, 0, result.shape[0], result.shape[1]) + result.tobytes()
+            except Exception as e:
+                reply = RESULT.pack(task_id, 1, 0, 0) + str(e).encode('utf-8')
+            finally:
+                del array  # release the shared buffer before the slot is reused
+            conn.send_bytes(reply)
+    finally:
+        shm.close()
+
+
+# ============================================
+# Pool (used from the detection service)
+# ============================================
+
+class InferencePool:
+    """
+    A model replicated across worker processes.
+
+    load(weights, threads) -> model and run(model, array, param, size, tier) ->
+    2-D float32 array are module-level functions (they are imported by the spawned workers).
+    submit() copies the input into a free shared-memory slot and returns a task
+    ID at once, so several inputs can be in flight, one per worker; result()
+    waits for one. With every slot busy, submit() waits for a free one.
+    """
+
+    def __init__(self, load, run, weights, workers=None, slot_bytes=None, name="inference"):
+        self.name = name
+        self.workers = max(1, workers or config.INFERENCE_WORKERS)
+        self.slot_bytes = slot_bytes or config.INFERENCE_SLOT_BYTES
+        self.slots = self.workers * 2  # one running and one queued per worker
+        threads = config.INFERENCE_THREADS or max(1, (os.cpu_count() or 1) // self.workers)
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self._free_slots = list(range(self.slots))
+        self._cond = threading.Condition()
+        self._results = {}  # task id -> (ok, array or error message)
+        self._task_slots = {}  # task id -> slot still held by it
+        self._in_flight = [0] * self.workers
+        self._next_id = 0
+        self._closed = False
+
+        context = multiprocessing.get_context('spawn')  # torch/TF aren't fork-safe
+        self._conns = []
+        self._send_locks = []
+        self._processes = []
+        for index in range(self.workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main, name=f"{name}-worker-{index}", daemon=True,
+                args=(load, run, weights, threads, self._shm.name, self.slot_bytes, child_conn)
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._send_locks.append(threading.Lock())
+            self._processes.append(process)
+
+        # Wait for every model to load, then collect results on one thread per worker
+        try:
+            for index, conn in enumerate(self._conns):
+                try:
+                    _, status, _, _, payload = self._read(conn)
+                except EOFError:
+                    status, payload = 1, "worker process exited"
+                if status:
+                    raise RuntimeError(f"{name} worker {index} failed to load its model: {payload}")
+        except BaseException:
+            self.close()
+            raise
+        for index, conn in enumerate(self._conns):
+            threading.Thread(target=self._collect, args=(index, conn),
+                             name=f"{name}-results-{index}", daemon=True).start()
+        print(f"[INFO] {name}: {self.workers} worker process(es), {threads} thread(s) each")
+
+    def submit(self, array, param=0.0, size=0, tier=0):
+        """Queue array (copied straight into shared memory, views included) for inference; returns a task ID"""
+        array = np.asarray(array)
+        if array.nbytes > self.slot_bytes:
+            raise ValueError(f"{self.name}: input of {array.nbytes} bytes exceeds the "
+                             f"{self.slot_bytes}-byte slot (config.INFERENCE_SLOT_BYTES)")
+        if array.ndim > 4 or array.dtype not in DTYPE_CODES:
+            raise ValueError(f"{self.name}: unsupported input {array.dtype} with {array.ndim} dims")
+        with self._cond:
+            while not self._free_slots and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError(f"{self.name} pool is closed")
+            slot = self._free_slots.pop()
+            worker = min(range(self.workers), key=self._in_flight.__getitem__)
+            self._in_flight[worker] += 1
+            self._next_id = (self._next_id + 1) % READY_ID
+            task_id = self._next_id
+            self._task_slots[task_id] = (slot, worker)
+
+        view = np.ndarray(array.shape, array.dtype, buffer=self._shm.buf, offset=slot * self.slot_bytes)
+        view[...] = array
+        del view
+        shape = list(array.shape) + [0] * (4 - array.ndim)
+        message = TASK.pack(task_id, slot, DTYPE_CODES[array.dtype], array.ndim, *shape, param, size, tier)
+        with self._send_locks[worker]:
+            self._conns[worker].send_bytes(message)
+        return task_id
+
+    def result(self, task_id, timeout=None):
+        """Wait for a task's float32 result rows; raises RuntimeError if inference failed"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while task_id not in self._results:
+                if self._closed:
+                    raise RuntimeError(f"{self.name} pool is closed")
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"{self.name}: no result for task {task_id}")
+                self._cond.wait(remaining)
+            ok, value = self._results.pop(task_id)
+        if not ok:
+            raise RuntimeError(f"{self.name} inference failed: {value}")
+        return value
+
+    def infer(self, array, param=0.0, size=0, tier=0, timeout=None):
+        """submit() and wait for the result"""
+        return self.result(self.submit(array, param, size, tier), timeout)
+
+    def close(self):
+        """Stop the workers and free the shared memory"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        for lock, conn in zip(self._send_locks, self._conns):
+            try:
+                with lock:
+                    conn.send_bytes(b'')
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
+        self._shm.close()
+        self._shm.unlink()
+
+    @staticmethod
+    def _read(conn):
+        message = conn.recv_bytes()
+        task_id, status, rows, columns = RESULT.unpack_from(message)
+        payload = memoryview(message)[RESULT.size:]
+        if status:
+            return task_id, status, rows, columns, bytes(payload).decode('utf-8', 'replace')
+        return task_id, status, rows, columns, np.frombuffer(payload, np.float32).reshape(rows, columns)
+
+    def _collect(self, worker, conn):
+        while True:
+            try:
+                task_id, status, _, _, payload = self._read(conn)
+            except (EOFError, OSError):
+                with self._cond:
+                    if not self._closed:
+                        print(f"[ERROR] {self.name} worker {worker} exited")
+                        # Fail the tasks it still had so callers don't wait forever, and
+                        # stop routing new ones to it
+                        for pending, (slot, owner) in list(self._task_slots.items()):
+                            if owner == worker:
+                                self._results[pending] = (False, "worker process exited")
+                                self._free_slots.append(slot)
+                                del self._task_slots[pending]
+                        self._in_flight[worker] = float('inf')
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                slot, _ = self._task_slots.pop(task_id)
+                self._free_slots.append(slot)
+                self._in_flight[worker] -= 1
+                self._results[task_id] = (status == 0, payload)
+                self._cond.notify_all()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-End Latency Tracing for the API Server
+Frames and count updates carry a trace - their frame sequence number and an
+epoch timestamp per stage ("capture_ts", "detected_ts", ...) - from the camera
+to the dashboard. Each time a stage is reached the hops ending there are
+recorded, and percentiles are computed over a sliding window per hop.
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+import config
+
+# Stages in the order a trace passes them, per path
+TRACE_STAGES = {
+    # Count update: camera read -> detection/tracking done -> ingest queued -> POST sent ->
+    # server received -> aggregate committed -> pushed to a dashboard over /api/events
+    "count": ("capture", "detected", "queued", "sent", "received", "committed", "pushed"),
+    # Video frame: camera read -> detection done -> JPEG encoded -> POST sent ->
+    # server received -> written to an MJPEG client
+    "frame": ("capture", "detected", "encoded", "sent", "received", "streamed"),
+}
+
+
+class LatencyTracker:
+    """
+    Sliding windows of per-hop latencies with p50/p95/p99 summaries.
+
+    For every stage reached, two hops are recorded: from the previous stage
+    present in the trace ("sent->received") and from capture ("capture->received"),
+    so both per-hop regressions and the cumulative glass-to-X latency show up.
+    Timestamps come from different processes, so hops across machines include
+    their clock offset.
+    """
+
+    def __init__(self, window=None, histogram=None):
+        self.window = window or config.LATENCY_WINDOW
+        self.histogram = histogram  # optional metrics histogram labelled (path, hop)
+        self._samples = {}  # (path, hop) -> deque of seconds
+        self._lock = threading.Lock()
+
+    def record_stage(self, path, trace, stage, ts):
+        """Record the hops ending at stage, reached at epoch seconds ts (trace is not modified)"""
+        self.record_stages(path, dict(trace, **{f"{stage}_ts": ts}), (stage,))
+
+    def record_stages(self, path, trace, stages):
+        """Record the hops ending at each of stages (already stamped on trace)"""
+        order = TRACE_STAGES[path]
+        capture = trace.get("capture_ts")
+        if not isinstance(capture, (int, float)):
+            return
+        for stage in stages:
+            ts = trace.get(f"{stage}_ts")
+            if not isinstance(ts, (int, float)):
+                continue
+            index = order.index(stage)
+            previous = next((name for name in reversed(order[:index])
+                             if isinstance(trace.get(f"{name}_ts"), (int, float))), None)
+            if previous is None:
+                continue
+            self._add(path, f"{previous}->{stage}", ts - trace[f"{previous}_ts"])
+            if previous != "capture":
+                self._add(path, f"capture->{stage}", ts - capture)
+
+    def _add(self, path, hop, seconds):
+        seconds = max(0.0, seconds)  # small clock offsets between processes
+        key = (path, hop)
+        samples = self._samples.get(key)
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault(key, deque(maxlen=self.window))
+        samples.append(seconds)
+        if self.histogram is not None:
+            self.histogram.labels(path, hop).observe(seconds)
+
+    def percentile(self, path, hop, q):
+        """q-th percentile in seconds of a hop's window (None without samples)"""
+        samples = self._samples.get((path, hop))
+        if not samples:
+            return None
+        return float(np.percentile(np.fromiter(list(samples), float), q))
+
+    def summary(self):
+        """{path: [{"hop", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms"}, ...]} in pipeline order"""
+        with self._lock:
+            keys = list(self._samples)
+        result = {}
+        for path, hop in sorted(keys, key=lambda key: (key[0], self._hop_order(*key))):
+            values = np.fromiter(list(self._samples[(path, hop)]), float)
+            if not len(values):
+                continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99)) * 1000
+            result.setdefault(path, []).append({
+                "hop": hop,
+                "count": int(len(values)),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+                "max_ms": round(float(values.max()) * 1000, 2),
+            })
+        return result
+
+    @staticmethod
+    def _hop_order(path, hop):
+        # Per-hop entries in pipeline order, then the cumulative capture->X ones
+        start, end = hop.split("->")
+        order = TRACE_STAGES[path]
+        return (start == "capture" and order.index(end) > 1, order.index(end))
@@ -18,6 +18,7 @@ from tensorflow.keras.models import load_model
 from tensorflow.keras.applications.resnet50 import preprocess_input
 
 import config
+from frame_pacer import FramePacer
 
 
 class CCTVGenderAnalyzer:
@@ -287,6 +288,7 @@ class CCTVGenderAnalyzer:
         processed_frame_count = 0
         start_time = time.time()
         last_fps_check = start_time
+        pacer = FramePacer()
 
         try:
             while self.is_running and self.camera and self.camera.isOpened():
@@ -296,15 +298,10 @@ class CCTVGenderAnalyzer:
 
                 frame_count += 1
 
-                # Frame skipping for high FPS to maintain stability
-                current_time = time.time()
-                if processed_frame_count > 10:  # Wait for stable FPS measurement
-                    fps = processed_frame_count / (current_time - start_time)
-                    if fps > config.FRAME_SKIP_THRESHOLD:
-                        # Skip frames to maintain stability
-                        skip_frames = int(fps / config.MAX_FPS)
-                        if frame_count % (skip_frames + 1) != 0:
-                            continue
+                # Skip frames that arrive faster than they can be (or need to be) processed
+                capture_ts = time.time()
+                if not pacer.admit(capture_ts):
+                    continue
                 
                 # Flip frame horizontally for mirror effect
                 frame = cv2.flip(frame, 1)
@@ -481,6 +478,7 @@ class CCTVGenderAnalyzer:
                     break
                 
                 processed_frame_count += 1
+                pacer.done(capture_ts)
 
                 # Calculate and display FPS
                 current_time = time.time()
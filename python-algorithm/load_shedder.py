@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Load Shedding for Detection Services
+When the box can't keep up, every stage slows down together. The shedder
+watches the time the slowest stage needs per frame and, while it is over the
+frame budget, gives up work one level at a time in priority order (the least
+valuable first). Each level is restored once the frame time it is predicted to
+add back (measured when it was shed) fits in the budget again.
+"""
+
+import threading
+import time
+
+import config
+
+# Degradation ladder; each level also keeps every level below it
+LEVELS = (
+    "normal",
+    "no_overlays",       # stream clean frames (dashboards can draw from /api/video/metadata)
+    "reduced_stream",    # publish every config.SHED_STREAM_EVERY-th frame
+    "reduced_gender",    # classify only people not counted yet; no re-classification
+    "reduced_detector",  # detector input at config.SHED_DETECT_SIZE
+    "light_detector",    # detector model tier config.YOLO_LIGHT_WEIGHTS
+)
+
+
+class LoadShedder:
+    """
+    Degradation level controller.
+
+    Call update(frame_seconds) once per frame with the slowest stage's smoothed
+    time per frame; read the level (or sheds(name)) when deciding how much work
+    to do for a frame. The level moves by one step at most every
+    config.SHED_HOLD_SECONDS.
+    """
+
+    def __init__(self, budget=None, metrics=None):
+        self.budget = budget or config.SHED_FRAME_BUDGET
+        self.level = 0
+        self.frame_seconds = 0.0
+        self.changed_at = time.time()
+        self._remaining = {}  # level -> share of the frame time left after shedding it (measured)
+        self._before = {}  # level -> frame time just before it was shed (share not measured yet)
+        self._lock = threading.Lock()
+        self._level_gauge = self._changes_counter = None
+        if metrics is not None:
+            self._level_gauge = metrics.gauge(
+                "load_shed_level", "Current load shedding level (0 = nothing shed)")
+            self._changes_counter = metrics.counter(
+                "load_shed_changes_total", "Load shedding level changes", ("direction",))
+            self._level_gauge.set(0)
+
+    def sheds(self, name):
+        """True if the work named by a LEVELS entry is currently shed"""
+        return self.level >= LEVELS.index(name)
+
+    def update(self, frame_seconds):
+        """Feed the slowest stage's time per frame; returns the (possibly changed) level"""
+        with self._lock:
+            self.frame_seconds = frame_seconds
+            now = time.time()
+            if now - self.changed_at < config.SHED_HOLD_SECONDS:
+                return self.level
+            # Measured once the smoothed frame time settled; as a share, so it still
+            # predicts the restored frame time after the overall load changes
+            before = self._before.pop(self.level, None)
+            if before:
+                self._remaining[self.level] = min(1.0, max(0.05, frame_seconds / before))
+            if frame_seconds > self.budget and self.level < len(LEVELS) - 1:
+                self.level += 1
+                self._before[self.level] = frame_seconds
+                self._changed(now, "shed")
+            elif self.level > 0 and frame_seconds / self._remaining.get(self.level, 1.0) \
+                    <= self.budget * config.SHED_RESTORE_RATIO:
+                self.level -= 1
+                self._changed(now, "restore")
+            return self.level
+
+    def state(self):
+        """Current level for reporting to the API server"""
+        return {
+            "level": self.level,
+            "name": LEVELS[self.level],
+            "frame_ms": round(self.frame_seconds * 1000, 1),
+            "budget_ms": round(self.budget * 1000, 1),
+            "since": self.changed_at,
+        }
+
+    def _changed(self, now, direction):
+        self.changed_at = now
+        tag = "[WARNING]" if direction == "shed" else "[INFO]"
+        print(f"{tag} Load shedding level {self.level} ({LEVELS[self.level]}): "
+              f"slowest stage {self.frame_seconds * 1000:.0f} ms/frame, budget {self.budget * 1000:.0f} ms")
+        if self._level_gauge is not None:
+            self._level_gauge.set(self.level)
+            self._changes_counter.labels(direction).inc()
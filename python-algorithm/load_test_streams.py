@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for the API server's long-lived connections.
+
+Starts api_server.py in the default (threaded Werkzeug) mode and in --async
+(gevent) mode, feeds it synthetic frames, opens many MJPEG stream and SSE
+connections, and compares request latency, throughput, threads and memory.
+
+Usage:
+    python load_test_streams.py                  # 200 streams + 100 SSE clients
+    python load_test_streams.py --streams 400 --events 200
+"""
+
+import argparse
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import requests
+
+HOST = '127.0.0.1'
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_server(port, async_mode):
+    """Launch api_server.py and wait until it answers"""
+    cmd = [sys.executable, 'api_server.py', '--port', str(port)]
+    if async_mode:
+        cmd.append('--async')
+    proc = subprocess.Popen(cmd, cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://{HOST}:{port}/api/status", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("API server did not start")
+
+
+def read_proc_status(pid):
+    """VmRSS (MB) and thread count of a process, from /proc (Linux only)"""
+    rss_mb, threads = 0.0, 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss_mb = int(line.split()[1]) / 1024
+                elif line.startswith('Threads:'):
+                    threads = int(line.split()[1])
+    except OSError:
+        pass
+    return rss_mb, threads
+
+
+def feed_frames(port, stop_event, fps=15):
+    """Post synthetic JPEG frames like the detection service does"""
+    session = requests.Session()
+    frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    jpeg = buffer.tobytes()
+    while not stop_event.is_set():
+        try:
+            session.post(f"http://{HOST}:{port}/api/internal/update-frame",
+                         files={'frame': jpeg}, timeout=2)
+        except requests.RequestException:
+            pass
+        time.sleep(1.0 / fps)
+
+
+def open_clients(port, path, count):
+    """Open raw HTTP connections that stay on a streaming endpoint"""
+    sockets = []
+    for _ in range(count):
+        sock = socket.create_connection((HOST, port), timeout=5)
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\n\r\n".encode())
+        sock.setblocking(False)
+        sockets.append(sock)
+    return sockets
+
+
+def drain(sockets, stop_event, totals):
+    """Read and discard everything the server sends, counting bytes"""
+    sel = selectors.DefaultSelector()
+    for sock in sockets:
+        sel.register(sock, selectors.EVENT_READ)
+    while not stop_event.is_set():
+        for key, _ in sel.select(timeout=0.2):
+            try:
+                data = key.fileobj.recv(65536)
+            except (BlockingIOError, ConnectionError):
+                continue
+            if data:
+                totals['bytes'] += len(data)
+            else:
+                sel.unregister(key.fileobj)
+                totals['closed'] += 1
+    sel.close()
+
+
+def measure_latency(port, samples=50):
+    """p50/p95 latency (ms) of /api/status while the streams are open"""
+    latencies = []
+    failures = 0
+    for _ in range(samples):
+        started = time.time()
+        try:
+            requests.get(f"http://{HOST}:{port}/api/status", timeout=5)
+            latencies.append((time.time() - started) * 1000)
+        except requests.RequestException:
+            failures += 1
+        time.sleep(0.02)
+    if not latencies:
+        return None, None, failures
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return p50, p95, failures
+
+
+def run_mode(port, async_mode, n_streams, n_events, duration):
+    label = "async (gevent)" if async_mode else "threaded (werkzeug)"
+    print(f"\nTesting {label}: {n_streams} streams + {n_events} SSE clients...")
+    proc = start_server(port, async_mode)
+    stop_event = threading.Event()
+    totals = {'bytes': 0, 'closed': 0}
+    sockets = []
+    try:
+        feeder = threading.Thread(target=feed_frames, args=(port, stop_event), daemon=True)
+        feeder.start()
+        idle_rss, idle_threads = read_proc_status(proc.pid)
+
+        sockets += open_clients(port, '/api/video/stream?tier=thumbnail', n_streams)
+        sockets += open_clients(port, '/api/events', n_events)
+        reader = threading.Thread(target=drain, args=(sockets, stop_event, totals), daemon=True)
+        reader.start()
+
+        time.sleep(2)  # let every connection reach steady state
+        start_bytes = totals['bytes']
+        p50, p95, failures = measure_latency(port)
+        time.sleep(max(0.0, duration - 2))
+        elapsed = max(duration, 1.0)
+        rss, threads = read_proc_status(proc.pid)
+        throughput = (totals['bytes'] - start_bytes) / elapsed / 1024 / 1024
+    finally:
+        stop_event.set()
+        for sock in sockets:
+            sock.close()
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    return {
+        "label": label,
+        "p50": p50,
+        "p95": p95,
+        "failures": failures,
+        "throughput": throughput,
+        "closed": totals['closed'],
+        "idle_rss": idle_rss,
+        "rss": rss,
+        "threads": threads,
+        "idle_threads": idle_threads,
+    }
+
+
+def main():
+    """Run the load test in both modes and compare"""
+    parser = argparse.ArgumentParser(description='API server stream/SSE load test')
+    parser.add_argument('--streams', type=int, default=200, help='MJPEG stream connections')
+    parser.add_argument('--events', type=int, default=100, help='SSE /api/events connections')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to hold the connections')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--only', choices=['threaded', 'async'], help='Test a single mode')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("API Server Stream Load Test")
+    print("=" * 60)
+
+    results = []
+    for async_mode in (False, True):
+        if args.only and args.only != ('async' if async_mode else 'threaded'):
+            continue
+        try:
+            results.append(run_mode(args.port, async_mode, args.streams, args.events, args.duration))
+        except Exception as e:
+            print(f"[ERROR] {e}")
+
+    print("\n" + "=" * 60)
+    for r in results:
+        print(f"{r['label']}:")
+        if r['p50'] is None:
+            print("  /api/status latency: all requests failed")
+        else:
+            print(f"  /api/status latency: p50 {r['p50']:.1f} ms, p95 {r['p95']:.1f} ms ({r['failures']} failed)")
+        print(f"  Stream throughput:   {r['throughput']:.2f} MB/s ({r['closed']} connections dropped)")
+        print(f"  Server memory:       {r['idle_rss']:.0f} MB idle -> {r['rss']:.0f} MB loaded")
+        print(f"  Server threads:      {r['idle_threads']} idle -> {r['threads']} loaded")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight Metrics for Detection Services and the API Server
+Counters, gauges and histograms cheap enough to observe on every frame, a
+JSON snapshot that producers push to the API server, and Prometheus text
+exposition rendering for its /metrics endpoint.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+
+import config
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _sample(self):
+        return self.value
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = float(value)
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket (not cumulative); last is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        # bisect_left puts a value equal to a bound into that bound's bucket (le semantics)
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the seconds spent inside it"""
+        return _Timer(self)
+
+    def _sample(self):
+        with self._lock:
+            return [list(self.counts), self.sum]
+
+
+class _Timer:
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class Metric:
+    """
+    A metric family with optional labels.
+
+    Without labelnames the family itself has inc()/set()/observe(); with them,
+    labels(...) returns the child for one combination of label values (cache it
+    in hot loops to skip the lookup).
+    """
+
+    def __init__(self, kind, name, help, labelnames=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            default = self.labels()
+            for method in ("inc", "dec", "set", "observe", "time"):
+                if hasattr(default, method):
+                    setattr(self, method, getattr(default, method))
+
+    def labels(self, *values, **named):
+        if named:
+            values = tuple(str(named[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    if self.kind == "histogram":
+                        child = _HistogramChild(self.buckets)
+                    elif self.kind == "gauge":
+                        child = _GaugeChild()
+                    else:
+                        child = _CounterChild()
+                    self._children[values] = child
+        return child
+
+    def snapshot(self):
+        """JSON-safe dump: {"type", "help", "labelnames", "buckets", "samples": [[label values, value], ...]}"""
+        with self._lock:
+            children = list(self._children.items())
+        return {
+            "type": self.kind,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "buckets": list(self.buckets) if self.buckets is not None else None,
+            "samples": [[list(values), child._sample()] for values, child in children],
+        }
+
+
+class MetricsRegistry:
+    """Named metric families; asking for an existing name returns the same family"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._get("counter", name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get("gauge", name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=None):
+        return self._get("histogram", name, help, labelnames, buckets or config.METRICS_LATENCY_BUCKETS)
+
+    def _get(self, kind, name, help, labelnames, buckets=None):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(kind, name, help, labelnames, buckets)
+            return metric
+
+    def snapshot(self):
+        """All families as {name: Metric.snapshot()} (what producers push)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def stage_histogram(registry, stage):
+    """The pipeline_stage_seconds child for one stage (capture, detection, encoding, ...)"""
+    return registry.histogram(
+        "pipeline_stage_seconds", "Seconds spent per frame or call in each pipeline stage", ("stage",)
+    ).labels(stage)
+
+
+# ============================================
+# Text exposition format
+# ============================================
+
+def render_exposition(sources):
+    """
+    Render metric snapshots as Prometheus text exposition format.
+
+    sources is a list of (extra labels dict, snapshot dict); families with the
+    same name from different sources share one HELP/TYPE header, and each
+    source's extra labels (e.g. source, camera) are added to its samples.
+    """
+    families = {}
+    for extra_labels, snapshot in sources:
+        for name, family in snapshot.items():
+            families.setdefault(name, []).append((extra_labels, family))
+
+    lines = []
+    for name, entries in families.items():
+        kind = entries[0][1]["type"]
+        lines.append(f"# HELP {name} {_escape_help(entries[0][1]['help'])}")
+        lines.append(f"# TYPE {name} {kind}")
+        for extra_labels, family in entries:
+            if family["type"] != kind:
+                continue  # conflicting definitions; keep the first
+            labelnames = list(extra_labels) + family["labelnames"]
+            for values, sample in family["samples"]:
+                labels = list(zip(labelnames, list(extra_labels.values()) + values))
+                if kind == "histogram":
+                    counts, total = sample
+                    cumulative = 0
+                    for bound, count in zip(list(family["buckets"]) + [math.inf], counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(sample)}")
+    return "\n".join(lines) + "\n"
+
+
+def is_valid_snapshot(snapshot):
+    """Check a pushed snapshot's shape, so one bad producer can't break /metrics for everyone"""
+    try:
+        for name, family in snapshot.items():
+            kind = family["type"]
+            if kind not in ("counter", "gauge", "histogram") or not name.replace("_", "").replace(":", "").isalnum():
+                return False
+            if not all(isinstance(label, str) and label.isidentifier() for label in family["labelnames"]):
+                return False
+            width = len(family["labelnames"])
+            for values, sample in family["samples"]:
+                if len(values) != width:
+                    return False
+                if kind == "histogram":
+                    counts, total = sample
+                    if len(counts) != len(family["buckets"]) + 1:
+                        return False
+                    float(total)
+                    sum(counts)
+                else:
+                    float(sample)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return False
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
@@ -5,46 +5,99 @@ Combines YOLOv8 person detection with gender classification using one camera
 """
 
 import cv2
-from ultralytics import YOLO
 import numpy as np
 import time
-import requests
 from datetime import datetime
 import os
 from tensorflow.keras.models import load_model
 from tensorflow.keras.applications.resnet50 import preprocess_input
 
 import config
+from frame_pacer import FramePacer
+from inference_pool import InferencePool, load_detector, detect_people, load_gender_model, classify_genders
+from load_shedder import LEVELS, LoadShedder
+from metrics import MetricsRegistry, stage_histogram
+from pipeline import Pipeline
+from state_snapshot import SnapshotWriter, read_snapshot, saved_today
+from telemetry_client import TelemetryClient, StreamPublisher
 
 # ============================================
 # API Configuration
 # ============================================
 API_BASE_URL = "http://localhost:5000"
 
-def send_to_api(endpoint, data):
-    """Send data to the Flask API"""
-    try:
-        response = requests.post(f"{API_BASE_URL}{endpoint}", json=data, timeout=1)
-        return response.json()
-    except Exception as e:
-        print(f"[API] Failed to send to {endpoint}: {e}")
-        return None
+# Per-stage timings and counters, pushed to the API server's /metrics
+metrics = MetricsRegistry()
+capture_seconds = stage_histogram(metrics, "capture")
+detection_seconds = stage_histogram(metrics, "detection")
+tracking_seconds = stage_histogram(metrics, "tracking")
+face_detection_seconds = stage_histogram(metrics, "face_detection")
+gender_inference_seconds = stage_histogram(metrics, "gender_inference")
+frame_seconds = metrics.histogram("pipeline_frame_seconds", "Wall time between frames leaving the pipeline")
+frames_total = metrics.counter("pipeline_frames_total", "Frames read from the camera")
+people_counted_total = metrics.counter("pipeline_people_counted_total", "People counted (gender classified once)")
+people_in_roi = metrics.gauge("pipeline_people_in_roi", "People detected in the ROI in the latest frame")
+tracks_active = metrics.gauge("pipeline_tracks_active", "Tracks currently kept by the tracker")
+fps_gauge = metrics.gauge("pipeline_fps", "Average frames per second since start")
+
+# Pooled keep-alive client; all hot-loop traffic goes through its sender threads
+telemetry = TelemetryClient(API_BASE_URL, metrics=metrics)
+# Viewer-aware stream output: skips overlays/encoding when no dashboard is watching
+stream = StreamPublisher(telemetry, metrics=metrics)
+# Counter/tracker state saved in the background for warm restarts
+snapshots = SnapshotWriter(config.COUNTER_SNAPSHOT_PATH)
+# Load shedding levels from which each kind of work is reduced (see load_shedder.LEVELS)
+SHED_STREAM_LEVEL = LEVELS.index("reduced_stream")
+SHED_GENDER_LEVEL = LEVELS.index("reduced_gender")
+SHED_DETECTOR_SIZE_LEVEL = LEVELS.index("reduced_detector")
+SHED_DETECTOR_TIER_LEVEL = LEVELS.index("light_detector")
+
+def use_transport(client, publisher):
+    """
+    Send telemetry and frames through client/publisher instead of HTTP (same
+    interface as TelemetryClient/StreamPublisher; used when running embedded in
+    the API server, see embedded_detection.py)
+    """
+    global telemetry, stream
+    telemetry, stream = client, publisher
 
 def get_from_api(endpoint):
-    """Get data from the Flask API"""
-    try:
-        response = requests.get(f"{API_BASE_URL}{endpoint}", timeout=1)
-        return response.json()
-    except Exception as e:
-        print(f"[API] Failed to get from {endpoint}: {e}")
-        return None
+    """Get data from the Flask API (blocking - use outside the hot loop)"""
+    return telemetry.get_json(endpoint)
+
+def publish_frame(frame, meta=None, trace=None):
+    """Encode a frame and queue it for the dashboard stream (sized/rate-limited for current viewers)"""
+    stream.publish(frame, meta, trace)
 
 # ============================================
 # Detection Settings
 # ============================================
 def get_settings_from_api():
-    """Fetch current settings from dashboard"""
-    data = get_from_api("/api/person-counting")
+    """Fetch this camera's current settings from dashboard (None if the server can't be reached)"""
+    data = get_from_api(f"/api/person-counting?camera={telemetry.camera}")
+    return parse_settings(data) if data else None
+
+def send_ingest(on_settings, counts=None, gender=None, detections=None, positions=None, reset_token=None,
+                trace=None, degradation=None):
+    """
+    Queue one batched ingest request (counts, gender counts, detection events,
+    heatmap positions). The response carries current settings, so this doubles
+    as the settings poll; on_settings receives the parsed settings when it arrives.
+    trace is the latency trace of the frame the counts come from; degradation
+    the current load shedding state.
+    """
+    if trace is not None:
+        trace = dict(trace, queued_ts=time.time())
+    telemetry.post_ingest(counts=counts, gender=gender, detections=detections,
+                          positions=positions, reset_token=reset_token, trace=trace, degradation=degradation,
+                          callback=lambda data: _on_ingest_response(data, on_settings))
+
+def _on_ingest_response(data, on_settings):
+    stream.update_viewers(data.get("viewers"))
+    on_settings(parse_settings(data.get("settings")))
+
+def parse_settings(data):
+    """Convert a /api/person-counting response into detection settings"""
     if data:
         roi_config = data.get("roi_config")
         # Check if ROI is properly configured (not None and has valid values)
@@ -112,6 +165,61 @@ def calculate_distance(point1, point2):
     """Calculate Euclidean distance between two points"""
     return np.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
 
+# ============================================
+# Warm Restart
+# ============================================
+def snapshot_tracks(centers_old, frame_count):
+    """Tracks reduced to their latest position as [frames ago, x, y] (all the tracker matches against)"""
+    tracks = {}
+    for track_id, centers in centers_old.items():
+        last_frame, center = next(reversed(centers.items()))
+        tracks[track_id] = [frame_count - last_frame, center[0], center[1]]
+    return tracks
+
+def build_counter_snapshot(reset_token, count_p, male_count, female_count, counted_person_ids,
+                           lastKey, tracks, tracked_people_gender):
+    """Compact copy of the counter and tracker state for the snapshot writer (tracks from snapshot_tracks)"""
+    return {
+        "reset_token": reset_token,
+        "count_p": count_p,
+        "male_count": male_count,
+        "female_count": female_count,
+        "counted_person_ids": list(counted_person_ids),
+        "last_key": lastKey,
+        "tracks": tracks,
+        "tracked_people_gender": {k: dict(v) for k, v in tracked_people_gender.items() if k in tracks},
+    }
+
+def restore_counter_snapshot(snapshot, reset_token):
+    """
+    Counter/tracker state to resume from, or None.
+
+    Counts and counted IDs are restored only if the snapshot is from today and
+    the dashboard hasn't reset since (same reset_token); the ID sequence always continues so
+    new people never reuse a counted ID. Track positions (renumbered to
+    negative frame numbers, as the tracker's frame index restarts at 0) are restored only if
+    the snapshot is younger than config.TRACKER_RESTORE_MAX_AGE.
+    """
+    if not snapshot:
+        return None
+    restored = {"lastKey": snapshot.get("last_key") or '', "centers_old": {}, "tracked_people_gender": {}}
+    if snapshot.get("reset_token") == reset_token and saved_today(snapshot):
+        restored.update(
+            count_p=snapshot.get("count_p", 0),
+            male_count=snapshot.get("male_count", 0),
+            female_count=snapshot.get("female_count", 0),
+            counted_person_ids=set(snapshot.get("counted_person_ids") or []),
+        )
+    if time.time() - snapshot.get("saved_at", 0) <= config.TRACKER_RESTORE_MAX_AGE:
+        tracks = snapshot.get("tracks") or {}
+        restored["centers_old"] = {
+            track_id: {-frames_ago - 1: (x, y)} for track_id, (frames_ago, x, y) in tracks.items()
+        }
+        restored["tracked_people_gender"] = {
+            k: v for k, v in (snapshot.get("tracked_people_gender") or {}).items() if k in tracks
+        }
+    return restored
+
 def preprocess_face(face_roi):
     """Preprocess face ROI for gender classification"""
     face_resized = cv2.resize(face_roi, (config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]))
@@ -123,26 +231,39 @@ def preprocess_face(face_roi):
 # ============================================
 # Main Detection Loop
 # ============================================
-def run_detection():
-    print("[INFO] Loading YOLOv8 model...")
-    yolo_model = YOLO('yolov8x.pt')
-    dict_classes = yolo_model.model.names
+def run_detection(stop_event=None):
+    """Run the detection pipeline until the camera ends, Ctrl+C, or stop_event is set"""
+    # 'process' mode: YOLO and the gender model run in worker processes (frames passed
+    # through shared memory), so inference doesn't hold the GIL the pipeline threads need
+    use_processes = config.INFERENCE_MODE == 'process'
+    detector = detector_pool = None
+    print(f"[INFO] Loading YOLOv8 model ({config.INFERENCE_MODE} inference)...")
+    if use_processes:
+        detector_pool = InferencePool(load_detector, detect_people, config.YOLO_WEIGHTS, name="detector")
+    else:
+        detector = load_detector(config.YOLO_WEIGHTS, 0)
     
     # Load gender classification model
     print("[INFO] Loading gender classification model...")
-    gender_model = None
+    gender_model = gender_pool = None
     face_cascade = None
     
     try:
         if os.path.exists(config.MODEL_PATH):
-            gender_model = load_model(config.MODEL_PATH)
+            if use_processes:
+                face_bytes = config.IMAGE_SIZE[0] * config.IMAGE_SIZE[1] * 3
+                gender_pool = InferencePool(load_gender_model, classify_genders, config.MODEL_PATH,
+                                            workers=config.GENDER_WORKERS, slot_bytes=face_bytes,
+                                            name="gender")
+            else:
+                gender_model = load_model(config.MODEL_PATH)
             print("[INFO] Gender classification model loaded successfully!")
         else:
             print(f"[WARNING] Gender model not found at {config.MODEL_PATH}")
             print("[WARNING] Gender classification will be disabled. Train model: python train_model.py")
     except Exception as e:
         print(f"[ERROR] Error loading gender model: {e}")
-        gender_model = None
+        gender_model = gender_pool = None
     
     # Load face cascade
     try:
@@ -168,6 +289,9 @@ def run_detection():
     
     if not video.isOpened():
         print("[ERROR] Could not open camera!")
+        for pool in (detector_pool, gender_pool):
+            if pool is not None:
+                pool.close()
         return
     
     video.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
@@ -184,13 +308,14 @@ def run_detection():
     print("[INFO]    Go to Detection Settings and set the ROI rectangle to begin detection.")
     print("[INFO] Press Ctrl+C to stop the service")
     
-    # Detection variables
-    centers_old = {}
-    count_p = 0
+    # Detection variables (each group is owned by the one pipeline stage that uses it)
+    centers_old = {}  # track stage
     lastKey = ''
-    frame_count = 0
+    track_frame = 0  # frames seen by the tracker (its notion of time)
+    count_p = 0  # classify stage
     start_time = time.time()
     last_api_update = 0
+    last_snapshot = time.time()
     
     # Gender classification tracking
     # IMPORTANT: Tracking logic to prevent duplicate counting
@@ -200,149 +325,242 @@ def run_detection():
     # - Person IDs persist in counted_person_ids even after they leave frame to prevent re-counting
     tracked_people_gender = {}  # Track gender for each person ID: {id: {'gender': str, 'confidence': float, 'counted': bool}}
     counted_person_ids = set()  # Track which person IDs have already been counted (prevents duplicates - NEVER cleared)
-    face_tracking_buffer = []
     male_count = 0
     female_count = 0
     
     # Initialize settings and reset tracking token
+    telemetry.start()
+    counter_snapshot = read_snapshot(config.COUNTER_SNAPSHOT_PATH)
     settings = get_settings_from_api()
-    conf_level = settings["confidence_threshold"]
-    roi_cfg = settings["roi_config"]
-    roi_valid = settings["roi_valid"]
-    reset_token = settings.get("reset_token", 0)
+    if settings is None:
+        # Server not reachable yet: keep the snapshot's token so its counts are resumed
+        settings = parse_settings(None)
+        if counter_snapshot:
+            settings["reset_token"] = counter_snapshot.get("reset_token", 0)
     
-    try:
+    restored = restore_counter_snapshot(counter_snapshot, settings.get("reset_token", 0))
+    if restored:
+        lastKey = restored["lastKey"]
+        centers_old = restored["centers_old"]
+        tracked_people_gender = restored["tracked_people_gender"]
+        if "count_p" in restored:
+            count_p = restored["count_p"]
+            male_count = restored["male_count"]
+            female_count = restored["female_count"]
+            counted_person_ids = restored["counted_person_ids"]
+        print(f"[INFO] Resumed from snapshot - Total: {male_count + female_count} "
+              f"(Male: {male_count}, Female: {female_count}), {len(centers_old)} active track(s)")
+    snapshots.start()
+    settings_update = {}  # filled in by the telemetry sender when an ingest response arrives
+    track_positions = []  # heatmap positions collected since the last ingest
+    # Reset token each stateful stage last cleared its state for
+    track_reset_token = classify_reset_token = settings.get("reset_token", 0)
+    
+    def on_settings(new_settings):
+        settings_update["settings"] = new_settings
+    
+    # Each stage below runs on its own thread and hands a per-frame dict to the
+    # next through a bounded queue (config.PIPELINE_QUEUE_SIZE/POLICIES), so
+    # frame throughput is set by the slowest stage instead of the sum of all.
+    # Frames are admitted by capture timestamp at the rate the slowest stage sustains
+    # (at most config.PACING_TARGET_FPS); render_stage feeds the stage times back
+    pacer = FramePacer(metrics=metrics)
+    # Sheds overlays, stream rate, gender re-classification and detector cost, in that
+    # order, while the slowest stage is over config.SHED_FRAME_BUDGET
+    shedder = LoadShedder(metrics=metrics)
+    frames_read = 0
+    
+    def capture_frame():
+        """Source: read camera frames until the pacer admits one, and attach the settings it is processed with"""
+        nonlocal settings, frames_read
         while True:
-            ret, frame = video.read()
+            with capture_seconds.time():
+                ret, frame = video.read()
             if not ret:
                 print("[WARNING] Failed to grab frame")
+                return None
+            capture_ts = time.time()
+            frames_total.inc()
+            if pacer.admit(capture_ts):
                 break
+        # Latency trace: stage timestamps carried with this frame to the API server
+        trace = {"seq": frames_read, "capture_ts": capture_ts}
+        frames_read += 1
+        if "settings" in settings_update:
+            settings = settings_update.pop("settings")
+        return {
+            "frame": frame,
+            "trace": trace,
+            "settings": settings,
+            # Every stage degrades this frame to the same level
+            "shed_level": shedder.level,
+            # Overlays only matter if someone has the stream open
+            "draw_overlays": stream.wants_overlays() and not shedder.sheds("no_overlays"),
+        }
+    
+    def predict_gender(face_roi):
+        """Class probabilities (female, male) for one face crop, as a 1-row array"""
+        if gender_pool is not None:
+            face = cv2.resize(face_roi, (config.IMAGE_SIZE[1], config.IMAGE_SIZE[0]))
+            return gender_pool.infer(cv2.cvtColor(face, cv2.COLOR_BGR2RGB)[None])
+        return gender_model.predict(preprocess_face(face_roi), verbose=0)
+    
+    def detect_stage(item):
+        """Resize, resolve the ROI from the dashboard settings and run YOLO on it
+        (in 'process' mode only hand the ROI to a detector worker; detect_wait collects it)"""
+        frame = resize_frame(item["frame"], scale_percent)
+        item["frame"] = frame
+        current_height, current_width = frame.shape[:2]
+        roi_cfg = item["settings"]["roi_config"]
+        
+        # Only process if ROI is configured from dashboard
+        if not item["settings"]["roi_valid"] or roi_cfg is None:
+            item["status"] = "roi_not_configured"
+            return item
+        
+        # Calculate ROI from settings
+        roi_x_start = int(current_width * roi_cfg["x_start_percent"] / 100)
+        roi_x_end = int(current_width * roi_cfg["x_end_percent"] / 100)
+        roi_y_start = int(current_height * roi_cfg["y_start_percent"] / 100)
+        roi_y_end = int(current_height * roi_cfg["y_end_percent"] / 100)
+        
+        # Validate ROI bounds
+        if roi_x_start >= roi_x_end or roi_y_start >= roi_y_end:
+            item["status"] = "roi_invalid"
+            return item
+        
+        ROI = frame[roi_y_start:roi_y_end, roi_x_start:roi_x_end]
+        item["status"] = "ok"
+        item["roi"] = (roi_x_start, roi_y_start, roi_x_end, roi_y_end)
+        
+        # Load shedding: smaller detector input, then the lighter model tier
+        size = config.SHED_DETECT_SIZE if item["shed_level"] >= SHED_DETECTOR_SIZE_LEVEL else 0
+        tier = 1 if item["shed_level"] >= SHED_DETECTOR_TIER_LEVEL else 0
+        confidence = item["settings"]["confidence_threshold"]
+        
+        if detector_pool is not None:
+            item["detect_started"] = time.perf_counter()
+            item["detect_task"] = detector_pool.submit(ROI, confidence, size, tier)
+            return item
+        
+        # Run YOLO detection only when ROI is valid
+        with detection_seconds.time():
+            rows = detect_people(detector, ROI, confidence, size, tier)
+        
+        item["boxes"] = rows[:, :4]
+        item["conf"] = rows[:, 4]
+        people_in_roi.set(len(item["boxes"]))
+        return item
+    
+    def detect_wait_stage(item):
+        """Collect the detector worker's boxes ('process' mode), in frame order"""
+        if "detect_task" in item:
+            rows = detector_pool.result(item.pop("detect_task"))
+            detection_seconds.observe(time.perf_counter() - item.pop("detect_started"))
+            item["boxes"] = rows[:, :4]
+            item["conf"] = rows[:, 4]
+            people_in_roi.set(len(item["boxes"]))
+        return item
+    
+    def track_stage(item):
+        """Match detections to tracks (owns centers_old/lastKey; sees every detected frame in order)"""
+        nonlocal centers_old, lastKey, track_frame, track_reset_token, last_snapshot
+        reset_token = item["settings"].get("reset_token", 0)
+        if reset_token != track_reset_token:
+            track_reset_token = reset_token
+            centers_old.clear()
+        item["index"] = track_frame
+        track_frame += 1
+        
+        if item["status"] == "ok":
+            tracking_start = time.perf_counter()
+            roi_x_start, roi_y_start = item["roi"][:2]
+            tracks = []
+            for box in item["boxes"]:
+                xmin, ymin, xmax, ymax = box.astype('int')
+                center_x_full = int((xmax + xmin) / 2) + roi_x_start
+                center_y_full = int((ymax + ymin) / 2) + roi_y_start
+                centers_old, id_obj, is_new, lastKey = update_tracking(
+                    centers_old, (center_x_full, center_y_full),
+                    thr_centers, lastKey, item["index"], frame_max
+                )
+                tracks.append((id_obj, is_new))
             
-            # Get settings from API every 5 seconds
-            if time.time() - last_api_update > 5:
-                settings = get_settings_from_api()
-                conf_level = settings["confidence_threshold"]
-                roi_cfg = settings["roi_config"]
-                roi_valid = settings["roi_valid"]
-
-                # If dashboard reset was triggered, clear local counters/tracking
-                new_reset_token = settings.get("reset_token", reset_token)
-                if new_reset_token != reset_token:
-                    reset_token = new_reset_token
-                    male_count = 0
-                    female_count = 0
-                    count_p = 0
-                    counted_person_ids.clear()
-                    tracked_people_gender.clear()
-                    centers_old.clear()
-                    print("[INFO] Reset token detected from dashboard. Local counters cleared.")
-
-                last_api_update = time.time()
-            
-            frame = resize_frame(frame, scale_percent)
+            # Filter tracks
+            centers_old = filter_tracks(centers_old, patience)
+            tracking_seconds.observe(time.perf_counter() - tracking_start)
+            tracks_active.set(len(centers_old))
+            item["tracks"] = tracks
+            item["active_ids"] = set(centers_old.keys())
+        
+        # Snapshot of the tracker half of the state; the classify stage adds the counts
+        if time.time() - last_snapshot > config.SNAPSHOT_INTERVAL:
+            item["tracker_state"] = (lastKey, snapshot_tracks(centers_old, item["index"]))
+            last_snapshot = time.time()
+        return item
+    
+    def classify_stage(item):
+        """Face detection and gender classification per track; counts each person once and sends the counts"""
+        nonlocal count_p, male_count, female_count, classify_reset_token, last_api_update, track_positions
+        reset_token = item["settings"].get("reset_token", 0)
+        
+        # Refresh settings every 5 seconds if no ingest batch went out meanwhile
+        if time.time() - last_api_update > 5:
+            send_ingest(on_settings, reset_token=reset_token, degradation=shedder.state())
+            last_api_update = time.time()
+        
+        # If dashboard reset was triggered, clear local counters/tracking
+        if reset_token != classify_reset_token:
+            classify_reset_token = reset_token
+            male_count = 0
+            female_count = 0
+            count_p = 0
+            counted_person_ids.clear()
+            tracked_people_gender.clear()
+            print("[INFO] Reset token detected from dashboard. Local counters cleared.")
+        
+        if item["status"] == "ok":
+            frame = item["frame"]
             current_height, current_width = frame.shape[:2]
+            roi_x_start, roi_y_start = item["roi"][:2]
+            draw_overlays = item["draw_overlays"]
+            frame_index = item["index"]
+            conf = item["conf"]
             
-            # Only process if ROI is configured from dashboard
-            if not roi_valid or roi_cfg is None:
-                # Show message that ROI needs to be configured (on frame for web dashboard)
-                cv2.putText(frame, 'ROI not configured!', (30, 40), 
-                           cv2.FONT_HERSHEY_TRIPLEX, 1.2, (0, 0, 255), 2)
-                cv2.putText(frame, 'Please set ROI region in dashboard', (30, 80), 
-                           cv2.FONT_HERSHEY_TRIPLEX, 0.8, (0, 0, 255), 2)
-                cv2.putText(frame, 'Detection paused until ROI is set', (30, 120), 
-                           cv2.FONT_HERSHEY_TRIPLEX, 0.8, (255, 255, 0), 2)
-                
-                # Send frame to API for streaming even when ROI not configured
-                try:
-                    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    requests.post(f"{API_BASE_URL}/api/internal/update-frame", 
-                                files={'frame': buffer.tobytes()},
-                                timeout=0.1)
-                except:
-                    pass
-                
-                # No GUI window - just send to web dashboard
-                frame_count += 1
-                time.sleep(0.033)  # ~30 FPS
-                continue
-            
-            # Calculate ROI from settings
-            roi_x_start = int(current_width * roi_cfg["x_start_percent"] / 100)
-            roi_x_end = int(current_width * roi_cfg["x_end_percent"] / 100)
-            roi_y_start = int(current_height * roi_cfg["y_start_percent"] / 100)
-            roi_y_end = int(current_height * roi_cfg["y_end_percent"] / 100)
-            
-            # Validate ROI bounds
-            if roi_x_start >= roi_x_end or roi_y_start >= roi_y_end:
-                cv2.putText(frame, 'Invalid ROI configuration!', (30, 40), 
-                           cv2.FONT_HERSHEY_TRIPLEX, 1.0, (0, 0, 255), 2)
-                # Send frame to API for web dashboard
-                try:
-                    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    requests.post(f"{API_BASE_URL}/api/internal/update-frame", 
-                                files={'frame': buffer.tobytes()},
-                                timeout=0.1)
-                except:
-                    pass
-                frame_count += 1
-                time.sleep(0.033)  # ~30 FPS
-                continue
-            
-            area_roi = [np.array([
-                (roi_x_start, roi_y_start),
-                (roi_x_end, roi_y_start),
-                (roi_x_end, roi_y_end),
-                (roi_x_start, roi_y_end)
-            ], np.int32)]
-            
-            ROI = frame[roi_y_start:roi_y_end, roi_x_start:roi_x_end]
-            
-            # Run YOLO detection only when ROI is valid
-            y_hat = yolo_model.predict(ROI, conf=conf_level, classes=[0], device='cpu', verbose=False)
-            
-            boxes = y_hat[0].boxes.xyxy.cpu().numpy()
-            conf = y_hat[0].boxes.conf.cpu().numpy()
-            current_in_roi = len(boxes)
-            
-            # Update face tracking buffer
-            if len(face_tracking_buffer) > config.TRACKING_FRAMES:
-                face_tracking_buffer.pop(0)
-            
-            # Process detections
-            for ix, box in enumerate(boxes):
+            # Process detections (frame_objects mirrors the overlays for client-side rendering;
+            # labels are (box, text, color) drawn by the render stage)
+            frame_objects = []
+            labels = []
+            frame_ts = time.time()
+            for ix, (box, (id_obj, is_new)) in enumerate(zip(item["boxes"], item["tracks"])):
                 xmin, ymin, xmax, ymax = box.astype('int')
-                center_x = int((xmax + xmin) / 2)
-                center_y = int((ymax + ymin) / 2)
-                center_x_full = center_x + roi_x_start
-                center_y_full = center_y + roi_y_start
-                
-                centers_old, id_obj, is_new, lastKey = update_tracking(
-                    centers_old, (center_x_full, center_y_full), 
-                    thr_centers, lastKey, frame_count, frame_max
-                )
+                box_full = (int(roi_x_start + xmin), int(roi_y_start + ymin),
+                            int(roi_x_start + xmax), int(roi_y_start + ymax))
                 
                 # Gender classification for detected person
                 person_gender = None
-                gender_classified = False
                 
-                if gender_model and face_cascade and not face_cascade.empty():
+                # Load shedding: people already counted keep their gender instead of being re-classified
+                reclassify = id_obj not in counted_person_ids or item["shed_level"] < SHED_GENDER_LEVEL
+                if reclassify and (gender_model or gender_pool) and face_cascade and not face_cascade.empty():
                     # Extract person region (slightly expanded for face detection)
-                    person_x_start = max(0, roi_x_start + xmin - 20)
-                    person_x_end = min(current_width, roi_x_start + xmax + 20)
-                    person_y_start = max(0, roi_y_start + ymin - 20)
-                    person_y_end = min(current_height, roi_y_start + ymax + 20)
+                    person_x_start = max(0, box_full[0] - 20)
+                    person_x_end = min(current_width, box_full[2] + 20)
+                    person_y_start = max(0, box_full[1] - 20)
+                    person_y_end = min(current_height, box_full[3] + 20)
                     
                     person_roi = frame[person_y_start:person_y_end, person_x_start:person_x_end]
                     
                     if person_roi.size > 0:
                         # Detect faces in person region
-                        gray_person = cv2.cvtColor(person_roi, cv2.COLOR_BGR2GRAY)
-                        faces = face_cascade.detectMultiScale(
-                            gray_person,
-                            scaleFactor=config.SCALE_FACTOR,
-                            minNeighbors=config.MIN_NEIGHBORS,
-                            minSize=config.MIN_FACE_SIZE
-                        )
+                        with face_detection_seconds.time():
+                            gray_person = cv2.cvtColor(person_roi, cv2.COLOR_BGR2GRAY)
+                            faces = face_cascade.detectMultiScale(
+                                gray_person,
+                                scaleFactor=config.SCALE_FACTOR,
+                                minNeighbors=config.MIN_NEIGHBORS,
+                                minSize=config.MIN_FACE_SIZE
+                            )
                         
                         if len(faces) > 0:
                             # Use the largest face
@@ -355,8 +573,8 @@ def run_detection():
                             if face_roi.size > 0 and fw >= config.MIN_FACE_SIZE[0] and fh >= config.MIN_FACE_SIZE[1]:
                                 try:
                                     # Preprocess and predict gender
-                                    face_array = preprocess_face(face_roi)
-                                    prediction = gender_model.predict(face_array, verbose=0)
+                                    with gender_inference_seconds.time():
+                                        prediction = predict_gender(face_roi)
                                     
                                     # Get prediction probabilities
                                     female_prob = prediction[0][0]  # Index 0 = FEMALE (alphabetical)
@@ -390,14 +608,14 @@ def run_detection():
                                         # Mark this person as counted to prevent duplicates
                                         counted_person_ids.add(id_obj)
                                         count_p += 1
-                                        gender_classified = True
+                                        people_counted_total.inc()
                                         
                                         # Store gender info for this person
                                         tracked_people_gender[id_obj] = {
                                             'gender': person_gender,
                                             'confidence': float(confidence),
                                             'counted': True,
-                                            'first_seen_frame': frame_count
+                                            'first_seen_frame': frame_index
                                         }
                                         
                                         if is_new:
@@ -409,142 +627,229 @@ def run_detection():
                                         tracked_people_gender[id_obj]['gender'] = person_gender
                                         tracked_people_gender[id_obj]['confidence'] = float(confidence)
                                     
-                                    # Draw gender label on person box (for all detected people with gender)
-                                    if person_gender:
+                                    # Gender label on person box (for all detected people with gender)
+                                    if draw_overlays and person_gender:
                                         gender_label = f"{person_gender} ({confidence:.2f})"
                                         if id_obj in counted_person_ids:
                                             gender_label += " [COUNTED]"
-                                        cv2.putText(ROI, gender_label, (xmin, ymin - 25), 
-                                                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 2)
+                                        labels.append((box_full, gender_label, (255, 255, 0)))
                                 except Exception as e:
                                     print(f"[ERROR] Error in gender classification: {e}")
-                                    pass
-                            else:
-                                # Face detected but too small or invalid
-                                # Check if person was already counted and show tracked info
-                                if id_obj in tracked_people_gender:
-                                    gender_info = tracked_people_gender[id_obj]
-                                    gender_label = f"{gender_info['gender']} (tracked)"
-                                    cv2.putText(ROI, gender_label, (xmin, ymin - 25), 
-                                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 2)
-                        else:
-                            # No face detected in person region, but person is tracked
-                            if id_obj in tracked_people_gender:
-                                gender_info = tracked_people_gender[id_obj]
-                                gender_label = f"{gender_info['gender']} (tracked)"
-                                cv2.putText(ROI, gender_label, (xmin, ymin - 25), 
-                                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 2)
-                else:
-                    # Gender model not available, but check if person was already tracked
-                    if id_obj in tracked_people_gender:
-                        gender_info = tracked_people_gender[id_obj]
-                        gender_label = f"{gender_info['gender']} (tracked)"
-                        cv2.putText(ROI, gender_label, (xmin, ymin - 25), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 2)
                 
-                # Draw person bounding box
-                # Use different color if person is already counted
-                if id_obj in counted_person_ids:
-                    color = (0, 255, 0)  # Green for already counted
-                else:
-                    color = (0, 0, 255)  # Red for new detection
-                cv2.rectangle(ROI, (xmin, ymin), (xmax, ymax), color, 2)
-                cv2.putText(ROI, f"{id_obj}:{conf[ix]:.2f}", 
-                           (xmin, ymin - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-            
-            # Filter tracks
-            centers_old = filter_tracks(centers_old, patience)
+                # No fresh classification: show the gender remembered for this track
+                if draw_overlays and person_gender is None and id_obj in tracked_people_gender:
+                    gender_label = f"{tracked_people_gender[id_obj]['gender']} (tracked)"
+                    labels.append((box_full, gender_label, (200, 200, 200)))
+                
+                # Heatmap: foot point of tracks seen before (a first sighting may be noise)
+                if not is_new:
+                    track_positions.append({
+                        "x": round(((box_full[0] + box_full[2]) // 2) / current_width, 4),
+                        "y": round(box_full[3] / current_height, 4),
+                        "ts": frame_ts
+                    })
+                
+                gender_info = tracked_people_gender.get(id_obj, {})
+                frame_objects.append({
+                    "id": id_obj,
+                    "box": list(box_full),
+                    "confidence": float(conf[ix]),
+                    "gender": gender_info.get("gender", person_gender),
+                    "gender_confidence": gender_info.get("confidence"),
+                    "counted": id_obj in counted_person_ids
+                })
             
-            # Clean up tracked_people_gender for IDs that are no longer in frame
-            # Remove IDs that haven't been seen in recent frames (but keep in counted_person_ids)
-            current_tracked_ids = set(centers_old.keys())
-            ids_to_remove = []
+            # Clean up tracked_people_gender for IDs that are no longer tracked
+            # (but keep them in counted_person_ids to prevent re-counting if they return)
             for tracked_id in list(tracked_people_gender.keys()):
-                if tracked_id not in current_tracked_ids:
-                    # Person left frame - mark for removal from active tracking
-                    # BUT keep in counted_person_ids to prevent re-counting if they return
-                    ids_to_remove.append(tracked_id)
-            
-            # Remove old tracking data (but keep in counted_person_ids to prevent duplicates)
-            for tracked_id in ids_to_remove:
-                if tracked_id in tracked_people_gender:
-                    # Remove from active tracking but keep counted status
-                    # This prevents re-counting if the same person comes back
+                if tracked_id not in item["active_ids"]:
                     del tracked_people_gender[tracked_id]
-                    # Note: counted_person_ids is NOT cleared - this prevents duplicate counting
-                    if frame_count % 100 == 0:  # Only log occasionally to reduce spam
+                    if frame_index % 100 == 0:  # Only log occasionally to reduce spam
                         print(f"[INFO] Person {tracked_id} left frame - removed from active tracking (still counted)")
             
-            # Calculate total count from gender counts to ensure consistency
-            # This ensures: male_count + female_count = total_count
-            total_count_from_gender = male_count + female_count
-            
-            # Draw overlay
-            cv2.putText(frame, f'Total Count: {total_count_from_gender} (M:{male_count}+F:{female_count})', (30, 40), 
-                       cv2.FONT_HERSHEY_TRIPLEX, 1.0, (0, 255, 0), 2)
-            cv2.putText(frame, f'Current in ROI: {current_in_roi}', (30, 80), 
-                       cv2.FONT_HERSHEY_TRIPLEX, 1.0, (0, 255, 255), 2)
-            cv2.putText(frame, f'Male: {male_count} | Female: {female_count}', (30, 120), 
-                       cv2.FONT_HERSHEY_TRIPLEX, 0.8, (255, 255, 0), 2)
-            
-            elapsed = time.time() - start_time
-            if frame_count > 0:
-                fps = frame_count / elapsed
-                cv2.putText(frame, f'FPS: {fps:.1f}', (30, 160), 
+            item["objects"] = frame_objects
+            item["labels"] = labels
+        
+        # Detection, tracking and gender classification of this frame are done
+        item["trace"]["detected_ts"] = time.time()
+        
+        # Calculate total count from gender counts to ensure consistency
+        # This ensures: male_count + female_count = total_count
+        total_count_from_gender = male_count + female_count
+        item["counts"] = {
+            "total_count": total_count_from_gender,
+            "male_count": male_count,
+            "female_count": female_count,
+            "current_in_roi": len(item["boxes"]) if item["status"] == "ok" else 0
+        }
+        
+        # Send to API every 10 frames: one batched ingest carries the people count,
+        # gender counts and brings back current settings (queued; never stalls the pipeline)
+        if item["status"] == "ok" and item["index"] % 10 == 0:
+            send_ingest(
+                on_settings,
+                counts=[{
+                    "total_count": total_count_from_gender,
+                    "current_in_roi": item["counts"]["current_in_roi"]
+                }],
+                gender=[{
+                    "male_count": male_count,
+                    "female_count": female_count,
+                    "total_count": total_count_from_gender,  # Ensure consistency
+                    "timestamp": datetime.now().isoformat()
+                }],
+                positions=track_positions,
+                reset_token=reset_token,
+                trace=item["trace"],
+                degradation=shedder.state()
+            )
+            track_positions = []
+            last_api_update = time.time()
+        
+        # Hand a compact copy of the counter/tracker state to the background writer
+        if "tracker_state" in item:
+            snapshot_key, snapshot_tracks_state = item.pop("tracker_state")
+            snapshots.submit(build_counter_snapshot(
+                reset_token, count_p, male_count, female_count, counted_person_ids,
+                snapshot_key, snapshot_tracks_state, tracked_people_gender
+            ))
+        return item
+    
+    rendered_frames = 0
+    last_published = None
+    last_rendered = None
+    last_metrics_push = 0
+    
+    def render_stage(item):
+        """Draw overlays, encode and publish the frame (only the newest frame matters here)"""
+        nonlocal rendered_frames, last_published, last_rendered, last_metrics_push
+        frame = item["frame"]
+        draw_overlays = item["draw_overlays"]
+        
+        if item["status"] == "roi_not_configured":
+            # Show message that ROI needs to be configured (on frame for web dashboard)
+            if draw_overlays:
+                cv2.putText(frame, 'ROI not configured!', (30, 40), 
+                           cv2.FONT_HERSHEY_TRIPLEX, 1.2, (0, 0, 255), 2)
+                cv2.putText(frame, 'Please set ROI region in dashboard', (30, 80), 
+                           cv2.FONT_HERSHEY_TRIPLEX, 0.8, (0, 0, 255), 2)
+                cv2.putText(frame, 'Detection paused until ROI is set', (30, 120), 
                            cv2.FONT_HERSHEY_TRIPLEX, 0.8, (255, 255, 0), 2)
+            # Send frame to API for streaming even when ROI not configured
+            publish_frame(frame, {"status": "roi_not_configured", "objects": [], "roi": None}, item["trace"])
+        elif item["status"] == "roi_invalid":
+            if draw_overlays:
+                cv2.putText(frame, 'Invalid ROI configuration!', (30, 40), 
+                           cv2.FONT_HERSHEY_TRIPLEX, 1.0, (0, 0, 255), 2)
+            # Send frame to API for web dashboard
+            publish_frame(frame, {"status": "roi_invalid", "objects": [], "roi": None}, item["trace"])
+        else:
+            counts = item["counts"]
+            roi_x_start, roi_y_start, roi_x_end, roi_y_end = item["roi"]
+            # Draw overlay (skipped entirely when no dashboard is watching)
+            if draw_overlays:
+                for obj, conf in zip(item["objects"], item["conf"]):
+                    # Different color if person is already counted
+                    color = (0, 255, 0) if obj["counted"] else (0, 0, 255)
+                    x1, y1, x2, y2 = obj["box"]
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                    cv2.putText(frame, f"{obj['id']}:{conf:.2f}", 
+                               (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                for box, text, color in item["labels"]:
+                    cv2.putText(frame, text, (box[0], box[1] - 25), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                
+                cv2.putText(frame, f'Total Count: {counts["total_count"]} '
+                                   f'(M:{counts["male_count"]}+F:{counts["female_count"]})', (30, 40), 
+                           cv2.FONT_HERSHEY_TRIPLEX, 1.0, (0, 255, 0), 2)
+                cv2.putText(frame, f'Current in ROI: {counts["current_in_roi"]}', (30, 80), 
+                           cv2.FONT_HERSHEY_TRIPLEX, 1.0, (0, 255, 255), 2)
+                cv2.putText(frame, f'Male: {counts["male_count"]} | Female: {counts["female_count"]}', (30, 120), 
+                           cv2.FONT_HERSHEY_TRIPLEX, 0.8, (255, 255, 0), 2)
+                
+                if rendered_frames > 0:
+                    fps = rendered_frames / (time.time() - start_time)
+                    cv2.putText(frame, f'FPS: {fps:.1f}', (30, 160), 
+                               cv2.FONT_HERSHEY_TRIPLEX, 0.8, (255, 255, 0), 2)
+                
+                # Draw ROI
+                area_roi = [np.array([
+                    (roi_x_start, roi_y_start),
+                    (roi_x_end, roi_y_start),
+                    (roi_x_end, roi_y_end),
+                    (roi_x_start, roi_y_end)
+                ], np.int32)]
+                overlay = frame.copy()
+                cv2.polylines(overlay, pts=area_roi, isClosed=True, color=(255, 0, 0), thickness=2)
+                cv2.fillPoly(overlay, area_roi, (255, 0, 0))
+                frame = cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
             
-            # Draw ROI
-            overlay = frame.copy()
-            cv2.polylines(overlay, pts=area_roi, isClosed=True, color=(255, 0, 0), thickness=2)
-            cv2.fillPoly(overlay, area_roi, (255, 0, 0))
-            frame = cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
-            
-            # Send frame to API for streaming (throttle to every 3 frames to reduce load)
-            if frame_count % 3 == 0:  # Only send every 3rd frame (~10 FPS instead of 30)
-                try:
-                    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    requests.post(f"{API_BASE_URL}/api/internal/update-frame", 
-                                files={'frame': buffer.tobytes()},
-                                timeout=0.1)
-                except:
-                    pass
-            
-            # Send to API every 10 frames
-            if frame_count % 10 == 0:
-                try:
-                    # Calculate total count from gender counts (ensures consistency)
-                    total_count_from_gender = male_count + female_count
-                    
-                    # Send people count (use total from gender counts)
-                    requests.post(f"{API_BASE_URL}/api/internal/update-count", json={
-                        "total_count": total_count_from_gender,
-                        "current_in_roi": current_in_roi
-                    }, timeout=0.5)
-                    
-                    # Send gender counts (total_count = male_count + female_count)
-                    requests.post(f"{API_BASE_URL}/api/gender-classification/update", json={
-                        "male_count": male_count,
-                        "female_count": female_count,
-                        "total_count": total_count_from_gender,  # Ensure consistency
-                        "timestamp": datetime.now().isoformat()
-                    }, timeout=0.5)
-                except:
-                    pass
-            
-            # No GUI window - all output goes to web dashboard
-            frame_count += 1
-            
-            # Small delay to maintain ~30 FPS
-            time.sleep(0.033)
+            # Send frame to API for streaming (throttle to every 3rd tracked frame to reduce load,
+            # more under load shedding; by index, as this stage's queue may drop frames)
+            publish_every = config.SHED_STREAM_EVERY if item["shed_level"] >= SHED_STREAM_LEVEL else 3
+            if last_published is None or item["index"] - last_published >= publish_every:
+                last_published = item["index"]
+                publish_frame(frame, {
+                    "status": "ok",
+                    "objects": item["objects"],
+                    "roi": {"x1": roi_x_start, "y1": roi_y_start, "x2": roi_x_end, "y2": roi_y_end},
+                    "counts": counts
+                }, item["trace"])
+        
+        pacer.done(item["trace"]["capture_ts"], pipeline.stage_seconds())
+        shedder.update(pacer.service)
+        now = time.perf_counter()
+        if last_rendered is not None:
+            frame_seconds.observe(now - last_rendered)
+        last_rendered = now
+        rendered_frames += 1
+        
+        if time.time() - last_metrics_push > config.METRICS_PUSH_INTERVAL:
+            fps_gauge.set(rendered_frames / (time.time() - start_time))
+            telemetry.post_metrics(metrics, "people_counter")
+            last_metrics_push = time.time()
+        
+        if rendered_frames % 300 == 0:
+            stats = telemetry.get_stats()
+            print(f"[API] Telemetry - sent: {stats['sent']}, coalesced: {stats['coalesced']}, "
+                  f"dropped: {stats['dropped']}, failed: {stats['failed']}, "
+                  f"avg latency: {stats['avg_latency_ms']:.1f} ms")
+            print(f"[INFO] Pipeline queues: {pipeline.depths()}, dropped: {pipeline.dropped()}, "
+                  f"paced at {pacer.fps():.1f} FPS ({pacer.stats['skipped']} camera frames skipped), "
+                  f"load shedding level {shedder.level}")
     
+    pipeline = (Pipeline("counter", metrics)
+                .source("capture", capture_frame)
+                .stage("detect", detect_stage))
+    if detector_pool is not None:
+        # Up to one submitted frame per detector worker waits here, so all of them stay busy
+        pipeline.stage("detect_wait", detect_wait_stage, queue_size=detector_pool.workers, policy="block")
+    pipeline.stage("track", track_stage)
+    pipeline.stage("classify", classify_stage)
+    pipeline.stage("render", render_stage)
+    
+    try:
+        pipeline.start()
+        while not pipeline.wait(timeout=0.5):
+            if stop_event is not None and stop_event.is_set():
+                print("[INFO] Stopping detection service...")
+                break
     except KeyboardInterrupt:
         print("\n[INFO] Stopping detection service...")
     except Exception as e:
         print(f"\n[ERROR] Error in detection loop: {e}")
-        import traceback
-        traceback.print_exc()
     finally:
+        pipeline.stop()
+        for pool in (detector_pool, gender_pool):
+            if pool is not None:
+                pool.close()
         video.release()
+        telemetry.stop()
+        snapshots.submit(build_counter_snapshot(
+            classify_reset_token, count_p, male_count, female_count, counted_person_ids,
+            lastKey, snapshot_tracks(centers_old, track_frame), tracked_people_gender
+        ))
+        snapshots.stop()
         total_final = male_count + female_count
         print(f"[INFO] Detection stopped.")
         print(f"[INFO] Final counts - Total: {total_final} (Male: {male_count} + Female: {female_count})")
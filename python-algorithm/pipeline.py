@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Pipelined Stage Executor for Detection Services
+Runs each stage of a per-frame loop on its own worker thread, linked by
+bounded queues, so frame throughput is set by the slowest stage rather than
+the sum of all of them. Each queue has a drop policy for when its consumer
+falls behind; depths and drops are exported as metrics.
+"""
+
+import threading
+import time
+import traceback
+from collections import deque
+
+import config
+
+# What a full queue does with a new item:
+#   block        - the producer waits for space (nothing is lost; backpressure upstream)
+#   drop_oldest  - the oldest waiting item is discarded (consumer always gets the freshest)
+#   drop_newest  - the new item is discarded
+DROP_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+_END = object()  # end-of-stream marker, passed through every queue (never dropped)
+
+
+class StageQueue:
+    """Bounded FIFO feeding one stage"""
+
+    def __init__(self, name, maxsize, policy="block"):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy for {name}: {policy!r} (expected one of {DROP_POLICIES})")
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, stopped):
+        """Queue item per the drop policy; returns False if an item was dropped (or the pipeline stopped)"""
+        with self._cond:
+            accepted = True
+            if len(self._items) >= self.maxsize and item is not _END:
+                if self.policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                    accepted = False
+                elif self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                else:
+                    while len(self._items) >= self.maxsize and not stopped.is_set():
+                        self._cond.wait(0.1)
+                    if stopped.is_set():
+                        return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return accepted
+
+    def get(self, timeout):
+        """Next item, or None if nothing arrived within timeout"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+                if not self._items:
+                    return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+
+class Pipeline:
+    """
+    A source followed by stages, each on its own thread.
+
+    The source function returns the next item, or None when the input ends.
+    Each stage function receives an item and returns the item to hand to the
+    next stage (or None to drop it there). Items reach every stage in source
+    order. An exception in any stage stops the whole pipeline; wait() re-raises
+    it in the caller's thread.
+    """
+
+    def __init__(self, name, metrics=None):
+        self.name = name
+        self._source = None
+        self._stages = []  # (name, function, StageQueue)
+        self._threads = []
+        self._stage_seconds = {}  # stage -> EWMA of its time per item
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+        self._error = None
+        self._depth_gauge = self._dropped_counter = None
+        if metrics is not None:
+            self._depth_gauge = metrics.gauge(
+                "pipeline_queue_depth", "Items waiting in front of each pipeline stage", ("stage",))
+            self._dropped_counter = metrics.counter(
+                "pipeline_queue_dropped_total", "Items dropped by each stage queue's drop policy", ("stage",))
+
+    def source(self, name, function):
+        self._source = (name, function)
+        return self
+
+    def stage(self, name, function, queue_size=None, policy=None):
+        """Append a stage fed by a queue of queue_size items with the given drop policy"""
+        policies = config.PIPELINE_QUEUE_POLICIES
+        queue = StageQueue(name, queue_size or config.PIPELINE_QUEUE_SIZE, policy or policies.get(name, "block"))
+        self._stages.append((name, function, queue))
+        return self
+
+    def start(self):
+        name, function = self._source
+        self._threads = [threading.Thread(target=self._run_source, args=(function,),
+                                          name=f"{self.name}-{name}", daemon=True)]
+        for index, (stage_name, stage_function, queue) in enumerate(self._stages):
+            output = self._stages[index + 1][2] if index + 1 < len(self._stages) else None
+            self._threads.append(threading.Thread(target=self._run_stage,
+                                                  args=(stage_name, stage_function, queue, output),
+                                                  name=f"{self.name}-{stage_name}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """Stop every stage (items still queued are discarded) and wait for the threads"""
+        self._stopped.set()
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+
+    def wait(self, timeout=None):
+        """Block until the source ended and every stage drained (or a stage failed); True when finished"""
+        finished = self._done.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return finished
+
+    def depths(self):
+        """{stage: items waiting in front of it}"""
+        return {name: len(queue) for name, _, queue in self._stages}
+
+    def dropped(self):
+        """{stage: items dropped by its queue's policy}"""
+        return {name: queue.dropped for name, _, queue in self._stages}
+
+    def stage_seconds(self):
+        """{stage: smoothed seconds it spends per item} (stages that have run at least once)"""
+        return dict(self._stage_seconds)
+
+    # ============================================
+    # Workers
+    # ============================================
+
+    def _run_source(self, function):
+        first = self._stages[0][2] if self._stages else None
+        try:
+            while not self._stopped.is_set():
+                item = function()
+                if item is None:
+                    break
+                if first is not None:
+                    self._put(first, item)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if first is not None:
+                first.put(_END, self._stopped)
+            else:
+                self._done.set()
+
+    def _run_stage(self, name, function, queue, output):
+        try:
+            while not self._stopped.is_set():
+                item = queue.get(0.1)
+                if item is None:
+                    continue
+                self._observe_depth(queue)
+                if item is _END:
+                    break
+                started = time.perf_counter()
+                result = function(item)
+                elapsed = time.perf_counter() - started
+                previous = self._stage_seconds.get(name)
+                self._stage_seconds[name] = elapsed if previous is None else \
+                    previous + (elapsed - previous) * config.PACING_SMOOTHING
+                if result is not None and output is not None:
+                    self._put(output, result)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if output is not None:
+                output.put(_END, self._stopped)
+            else:
+                self._done.set()
+
+    def _put(self, queue, item):
+        if not queue.put(item, self._stopped) and self._dropped_counter is not None and not self._stopped.is_set():
+            self._dropped_counter.labels(queue.name).inc()
+        self._observe_depth(queue)
+
+    def _observe_depth(self, queue):
+        if self._depth_gauge is not None:
+            self._depth_gauge.labels(queue.name).set(len(queue))
+
+    def _fail(self, error):
+        if self._error is None:
+            print(f"[ERROR] {self.name} pipeline stage failed: {error}")
+            traceback.print_exc()
+            self._error = error
+        self._stopped.set()
+        self._done.set()
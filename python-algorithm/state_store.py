@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Copy-on-Write State Store for the API Server
+Writers build a new snapshot and swap it in with one reference assignment, so
+request threads can read a consistent view of all counts without locking.
+"""
+
+import copy
+import threading
+from contextlib import contextmanager
+
+
+class StateSnapshot:
+    """
+    One immutable version of the server state.
+
+    Sections are plain dicts/lists (or scalars) keyed by name. They are shared
+    between snapshots until a writer replaces them, so readers must treat them
+    as read-only.
+    """
+
+    __slots__ = ("version", "_sections")
+
+    def __init__(self, version, sections):
+        self.version = version
+        self._sections = sections
+
+    def __getitem__(self, name):
+        return self._sections[name]
+
+    def get(self, name, default=None):
+        return self._sections.get(name, default)
+
+
+class StateDraft:
+    """
+    Writable view handed out by StateStore.write().
+
+    A section is deep-copied the first time it is read or replaced through the
+    draft, so untouched sections are shared with the previous snapshot and
+    readers of that snapshot never see the change.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.version = base.version + 1  # version this draft becomes if committed
+        self.touched = set()
+        self.committed = False  # set once the draft has become the current snapshot
+        self._copies = {}
+
+    def __getitem__(self, name):
+        if name not in self._copies:
+            self._copies[name] = copy.deepcopy(self.base[name])
+            self.touched.add(name)
+        return self._copies[name]
+
+    def __setitem__(self, name, value):
+        self._copies[name] = value
+        self.touched.add(name)
+
+    def get(self, name, default=None):
+        """Read a section without copying it (for values the writer won't modify)"""
+        if name in self._copies:
+            return self._copies[name]
+        return self.base.get(name, default)
+
+
+class StateStore:
+    """
+    Holds the current StateSnapshot.
+
+    Readers call get() and use the returned snapshot for the whole request; it
+    never changes underneath them. Writers are serialized by a lock and commit
+    by swapping in a new snapshot; a writer that raises commits nothing.
+
+    on_commit(old, new, touched) runs under the write lock right after the swap,
+    so listeners see commits one at a time and in version order.
+    """
+
+    def __init__(self, sections, lock=None, on_commit=None):
+        self._snapshot = StateSnapshot(0, dict(sections))
+        self._lock = lock or threading.Lock()
+        self.on_commit = on_commit
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def get(self):
+        """Return the current snapshot (no lock needed: a single reference read)"""
+        return self._snapshot
+
+    @contextmanager
+    def write(self):
+        """
+        Context manager yielding a StateDraft; its changes become the next snapshot.
+
+        Example:
+            with store.write() as draft:
+                draft["counts"]["total"] += 1
+        """
+        with self._lock:
+            old = self._snapshot
+            draft = StateDraft(old)
+            yield draft
+            # Sections copied but left equal don't count as a change (no version bump)
+            touched = {name for name in draft.touched if draft._copies[name] != old.get(name)}
+            if not touched:
+                return
+            sections = dict(old._sections)
+            sections.update((name, draft._copies[name]) for name in touched)
+            new = StateSnapshot(draft.version, sections)
+            self._snapshot = new
+            draft.committed = True
+            if self.on_commit:
+                self.on_commit(old, new, touched)
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Telemetry Client for Detection Services
+Pooled keep-alive HTTP client with background sender threads, so the
+detection loops never block on the API server.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from metrics import stage_histogram
+
+
+class TelemetryClient:
+    """
+    Non-blocking sender for counts, frames and other updates to the API server.
+
+    Requests are queued under a key. If a key is still waiting to be sent when a
+    new request arrives for it, the old one is replaced (coalesced) - only the
+    latest counts/frame per key go over the wire. Sender threads share one
+    requests.Session, so connections are kept alive and reused.
+    """
+
+    def __init__(self, base_url, timeout=None, pool_size=None, sender_threads=None, max_pending=None, camera=None,
+                 metrics=None):
+        self.base_url = base_url.rstrip('/')
+        self.camera = camera or config.CAMERA_ID  # frames and ingest batches are reported for this camera
+        self.timeout = timeout or config.TELEMETRY_TIMEOUT
+        self.max_pending = max_pending or config.TELEMETRY_MAX_PENDING
+
+        pool_size = pool_size or config.TELEMETRY_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._pending = OrderedDict()  # key -> (method, endpoint, kwargs, callback, queued_at)
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+        self._sender_threads = sender_threads or config.TELEMETRY_SENDER_THREADS
+        self._connected = True
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "coalesced": 0,   # replaced by a newer request for the same key before sending
+            "dropped": 0,     # discarded because the pending queue or an ingest batch was full
+            "failed": 0,      # network errors / non-2xx responses
+            "last_latency_ms": 0.0,
+            "avg_latency_ms": 0.0,  # exponential moving average of request round trips
+            "max_latency_ms": 0.0,
+            "avg_queue_delay_ms": 0.0,  # time from submit until the request went out
+        }
+
+        # Optional MetricsRegistry: request round trips are the "publishing" pipeline stage
+        self._publish_seconds = self._requests_total = None
+        if metrics is not None:
+            self._publish_seconds = stage_histogram(metrics, "publishing")
+            self._requests_total = metrics.counter(
+                "telemetry_requests_total", "Telemetry requests by outcome (queued, sent, coalesced, dropped, failed)",
+                ("result",))
+
+    # ============================================
+    # Lifecycle
+    # ============================================
+
+    def start(self):
+        """Start the background sender threads"""
+        if self._running:
+            return self
+        self._running = True
+        for i in range(self._sender_threads):
+            thread = threading.Thread(target=self._sender_loop, name=f"telemetry-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, flush_timeout=1.0):
+        """Stop the sender threads, giving pending requests a short chance to go out"""
+        deadline = time.time() + flush_timeout
+        with self._cond:
+            while (self._pending or self._in_flight) and time.time() < deadline:
+                self._cond.wait(0.05)
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.time()) + self.timeout)
+        self._threads = []
+        self.session.close()
+
+    # ============================================
+    # Submitting requests (never blocks on the network)
+    # ============================================
+
+    def submit(self, method, endpoint, key=None, callback=None, merge=None, **kwargs):
+        """
+        Queue a request for the background senders.
+
+        Args:
+            method: HTTP method ('GET' or 'POST')
+            endpoint: API path, e.g. '/api/internal/update-count'
+            key: Coalescing key (defaults to method + endpoint)
+            callback: Optional function called with the decoded JSON response
+            merge: Optional function(old_kwargs, new_kwargs) -> kwargs used instead of
+                   replacing a pending request for the same key
+            **kwargs: Passed to requests (json=..., files=..., data=...); a trace=dict
+                  (latency trace, see latency_tracker.py) is stamped with "sent_ts"
+                  and sent as the JSON body's / form's "trace" field
+        """
+        key = key or f"{method} {endpoint}"
+        with self._cond:
+            if key in self._pending:
+                old_kwargs = self._pending.pop(key)[2]
+                if merge:
+                    kwargs = merge(old_kwargs, kwargs)
+                self._count("coalesced")
+            elif len(self._pending) >= self.max_pending:
+                # Drop the oldest pending request to bound memory
+                self._pending.popitem(last=False)
+                self._count("dropped")
+            self._pending[key] = (method, endpoint, kwargs, callback, time.time())
+            self._count("queued")
+            self._cond.notify()
+
+    def post_json(self, endpoint, data, key=None, callback=None):
+        """Queue a JSON POST; only the latest payload per key is sent"""
+        self.submit('POST', endpoint, key=key, callback=callback, json=data)
+
+    def post_frame(self, jpeg_bytes, meta=None, endpoint='/api/internal/update-frame', key='frame', callback=None,
+                   trace=None):
+        """Queue an encoded JPEG frame (plus optional detection metadata and trace); stale frames are replaced"""
+        kwargs = {'files': {'frame': jpeg_bytes}, 'data': {'camera': self.camera}}
+        if meta is not None:
+            kwargs['data']['meta'] = json.dumps(meta)
+        if trace is not None:
+            kwargs['trace'] = trace
+        self.submit('POST', endpoint, key=key, callback=callback, **kwargs)
+
+    def post_ingest(self, counts=None, gender=None, detections=None, positions=None,
+                    reset_token=None, callback=None, endpoint='/api/internal/ingest', trace=None,
+                    degradation=None):
+        """
+        Queue a batched update for /api/internal/ingest.
+
+        Batches waiting to be sent are merged rather than replaced, so detection
+        events are not lost; the callback receives the response with current settings.
+        trace is the latency trace of the frame the counts come from; degradation
+        the producer's load shedding state.
+        """
+        payload = {
+            "camera": self.camera,
+            "counts": list(counts or []),
+            "gender": list(gender or []),
+            "detections": list(detections or []),
+            "positions": list(positions or []),
+        }
+        if reset_token is not None:
+            payload["reset_token"] = reset_token
+        if degradation is not None:
+            payload["degradation"] = degradation
+        kwargs = {"json": payload}
+        if trace is not None:
+            kwargs["trace"] = trace
+        self.submit('POST', endpoint, key='ingest', callback=callback,
+                    merge=self._merge_ingest, **kwargs)
+
+    def _merge_ingest(self, old_kwargs, new_kwargs):
+        old, new = old_kwargs["json"], new_kwargs["json"]
+        if old.get("reset_token") != new.get("reset_token"):
+            # Counts from before a reset must not be replayed after it
+            old = {"counts": [], "gender": [], "detections": old["detections"], "positions": old["positions"]}
+        limit = config.TELEMETRY_MAX_BATCH
+        merged = dict(new)
+        if "degradation" not in merged and "degradation" in old_kwargs["json"]:
+            merged["degradation"] = old_kwargs["json"]["degradation"]
+        for field in ("counts", "gender", "detections", "positions"):
+            items = old[field] + new[field]
+            if len(items) > limit:
+                if field in ("detections", "positions"):
+                    self._count("dropped", len(items) - limit)
+                # Counts are cumulative, so trimming the oldest loses nothing but history
+                items = items[-limit:]
+            merged[field] = items
+        merged_kwargs = {"json": merged}
+        # The batch goes out with the newest counts, so it carries the newest frame's trace
+        trace = new_kwargs.get("trace") or old_kwargs.get("trace")
+        if trace is not None:
+            merged_kwargs["trace"] = trace
+        return merged_kwargs
+
+    def post_metrics(self, metrics, source):
+        """Queue a push of a MetricsRegistry's current values to the API server's /metrics"""
+        self.post_json('/api/internal/metrics', {
+            "source": source,
+            "camera": self.camera,
+            "metrics": metrics.snapshot(),
+        }, key='metrics')
+
+    def get_json(self, endpoint, timeout=None):
+        """Synchronous GET over the pooled session (for startup, not the hot loop)"""
+        try:
+            response = self.session.get(f"{self.base_url}{endpoint}", timeout=timeout or self.timeout)
+            return response.json()
+        except Exception as e:
+            print(f"[API] Failed to get from {endpoint}: {e}")
+            return None
+
+    def get_stats(self):
+        """Return a copy of the sender counters plus current queue depth"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        with self._cond:
+            stats["pending"] = len(self._pending)
+            stats["in_flight"] = len(self._in_flight)
+        return stats
+
+    # ============================================
+    # Background sender
+    # ============================================
+
+    def _sender_loop(self):
+        while True:
+            with self._cond:
+                item = None
+                while self._running:
+                    # Skip keys another sender is already working on so per-key order is kept
+                    for key in self._pending:
+                        if key not in self._in_flight:
+                            item = (key, self._pending.pop(key))
+                            break
+                    if item:
+                        break
+                    self._cond.wait(0.5)
+                if item is None:
+                    return
+                key = item[0]
+                self._in_flight.add(key)
+
+            try:
+                self._send(*item[1])
+            finally:
+                with self._cond:
+                    self._in_flight.discard(key)
+                    self._cond.notify_all()
+
+    def _send(self, method, endpoint, kwargs, callback, queued_at):
+        started = time.time()
+        if "trace" in kwargs:
+            kwargs = dict(kwargs)
+            trace = dict(kwargs.pop("trace"), sent_ts=started)
+            if "json" in kwargs:
+                kwargs["json"] = dict(kwargs["json"], trace=trace)
+            else:
+                kwargs["data"] = dict(kwargs.get("data") or {}, trace=json.dumps(trace))
+        try:
+            response = self.session.request(method, f"{self.base_url}{endpoint}", timeout=self.timeout, **kwargs)
+            latency_ms = (time.time() - started) * 1000
+            self._record_latency(latency_ms, (started - queued_at) * 1000)
+            if self._publish_seconds is not None:
+                self._publish_seconds.observe(latency_ms / 1000)
+            if response.status_code >= 400:
+                self._count("failed")
+                return
+            self._count("sent")
+            self._set_connected(True, endpoint)
+            if callback:
+                try:
+                    callback(response.json())
+                except ValueError:
+                    pass
+        except requests.RequestException as e:
+            self._count("failed")
+            self._set_connected(False, endpoint, e)
+
+    def _set_connected(self, connected, endpoint, error=None):
+        # Log only transitions, not every failed request
+        if connected != self._connected:
+            self._connected = connected
+            if connected:
+                print("[API] Connection to API server restored")
+            else:
+                print(f"[API] Failed to send to {endpoint}: {error}")
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+        if self._requests_total is not None:
+            self._requests_total.labels(name).inc(amount)
+
+    def _record_latency(self, latency_ms, queue_delay_ms):
+        with self._stats_lock:
+            stats = self.stats
+            stats["last_latency_ms"] = latency_ms
+            stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+            if stats["avg_latency_ms"] == 0.0:
+                stats["avg_latency_ms"] = latency_ms
+                stats["avg_queue_delay_ms"] = queue_delay_ms
+            else:
+                stats["avg_latency_ms"] = 0.9 * stats["avg_latency_ms"] + 0.1 * latency_ms
+                stats["avg_queue_delay_ms"] = 0.9 * stats["avg_queue_delay_ms"] + 0.1 * queue_delay_ms
+
+
+class StreamPublisher:
+    """
+    Viewer-aware frame publisher for the dashboard stream.
+
+    The API server reports active stream viewers per ladder tier in its
+    update-frame and ingest responses. With nobody watching, only an occasional
+    keep-alive thumbnail is sent (so a newly opened dashboard is noticed quickly)
+    and callers can skip drawing overlays. Otherwise frames are sent at the
+    largest tier anyone is watching - the server derives smaller tiers from it -
+    and thumbnail-only viewers also get a lower frame rate. Clients that only
+    read /api/video/metadata get every frame's metadata with a thumbnail frame.
+    """
+
+    def __init__(self, telemetry, metrics=None):
+        self.telemetry = telemetry
+        self.viewers = None  # Unknown until the server answers - assume someone is watching
+        self._last_sent = 0.0
+        # Optional MetricsRegistry: resize + JPEG encode time is the "encoding" pipeline stage
+        self._encode_seconds = None
+        if metrics is not None:
+            self._encode_seconds = stage_histogram(metrics, "encoding")
+
+    def update_viewers(self, viewers):
+        """Record the viewer counts from an API response"""
+        if viewers is not None:
+            self.viewers = viewers
+
+    @property
+    def mode(self):
+        """
+        Largest stream tier with viewers ('full', 'preview', 'thumbnail'),
+        'metadata' if only metadata subscribers are connected, or 'off'
+        """
+        if self.viewers is None:
+            return "full"
+        for tier in ("full", "preview", "thumbnail", "metadata"):
+            if self.viewers.get(tier, 0) > 0:
+                return tier
+        return "off"
+
+    def wants_overlays(self):
+        """Whether boxes/labels should be burned into the current frame"""
+        return config.STREAM_DRAW_OVERLAYS and self.mode not in ("off", "metadata")
+
+    def publish(self, frame, meta=None, trace=None):
+        """
+        Encode and queue a frame if the current viewers need one; returns True if sent.
+
+        meta is the frame's detection metadata (boxes, IDs, labels, ROI) in this
+        frame's pixel coordinates; the server relays it on /api/video/metadata
+        with the same sequence number as the video frame. trace is the frame's
+        latency trace; it is stamped with "encoded_ts" once the JPEG is ready.
+        """
+        mode = self.mode
+        if mode == "off":
+            min_interval = config.STREAM_IDLE_INTERVAL
+        elif mode == "thumbnail":
+            min_interval = 1.0 / config.STREAM_THUMBNAIL_FPS
+        else:
+            min_interval = 0.0  # "metadata": every frame (as a thumbnail) so its metadata is relayed
+        now = time.time()
+        if now - self._last_sent < min_interval:
+            return False
+
+        if mode == "full":
+            target_width, quality = None, config.STREAM_JPEG_QUALITY
+        elif mode == "preview":
+            target_width, quality = config.STREAM_PREVIEW_WIDTH, config.STREAM_PREVIEW_QUALITY
+        else:
+            target_width, quality = config.STREAM_THUMBNAIL_WIDTH, config.STREAM_THUMBNAIL_QUALITY
+        height, width = frame.shape[:2]
+        if meta is not None:
+            meta = dict(meta, frame_width=width, frame_height=height)
+        encode_start = time.perf_counter()
+        if target_width and width > target_width:
+            frame = cv2.resize(frame, (target_width, int(height * target_width / width)),
+                               interpolation=cv2.INTER_AREA)
+
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if self._encode_seconds is not None:
+            self._encode_seconds.observe(time.perf_counter() - encode_start)
+        if not ret:
+            return False
+        self._last_sent = now
+        if trace is not None:
+            trace = dict(trace, encoded_ts=time.time())
+        self.telemetry.post_frame(buffer.tobytes(), meta=meta, callback=self._on_frame_response, trace=trace)
+        return True
+
+    def _on_frame_response(self, data):
+        self.update_viewers(data.get("viewers"))
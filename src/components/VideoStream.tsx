@@ -5,6 +5,8 @@ import { cn } from '@/lib/utils';
 interface VideoStreamProps {
   src?: string;
   cameraId?: string;
+  /** Stream ladder tier; smaller tiers are cheaper for grid/thumbnail views */
+  tier?: 'thumbnail' | 'preview' | 'full';
   className?: string;
   showControls?: boolean;
   autoPlay?: boolean;
@@ -13,6 +15,7 @@ interface VideoStreamProps {
 const VideoStream: React.FC<VideoStreamProps> = ({
   src,
   cameraId,
+  tier = 'full',
   className,
   showControls = false,
   autoPlay = true,
@@ -23,7 +26,7 @@ const VideoStream: React.FC<VideoStreamProps> = ({
   const [retryCount, setRetryCount] = useState(0);
 
   // Default to main camera stream if no src provided
-  const streamUrl = src || 'http://localhost:5000/api/video/stream';
+  const streamUrl = src || `http://localhost:5000/api/video/stream?tier=${tier}`;
 
   useEffect(() => {
     if (!videoRef.current) return;
@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 
 // Configure your Python API endpoint here
 const API_BASE_URL = 'http://localhost:5000';
@@ -55,6 +55,42 @@ export interface APIStatus {
   system_status: string;
 }
 
+interface AnalyticsChangesEvent {
+  seq: number;
+  changes: Record<string, unknown>;
+  removed: string[];
+}
+
+// Apply a /api/events "changes" payload (dotted paths) to the current analytics
+const applyAnalyticsChanges = (
+  current: AnalyticsData,
+  { changes, removed }: AnalyticsChangesEvent
+): AnalyticsData => {
+  const next = structuredClone(current) as unknown as Record<string, unknown>;
+  const walk = (path: string[], create: boolean) => {
+    let node = next;
+    for (const key of path) {
+      if (typeof node[key] !== 'object' || node[key] === null) {
+        if (!create) return null;
+        node[key] = {};
+      }
+      node = node[key] as Record<string, unknown>;
+    }
+    return node;
+  };
+  for (const key of removed) {
+    const path = key.split('.');
+    const parent = walk(path.slice(0, -1), false);
+    if (parent) delete parent[path[path.length - 1]];
+  }
+  for (const [key, value] of Object.entries(changes)) {
+    const path = key.split('.');
+    const parent = walk(path.slice(0, -1), true);
+    if (parent) parent[path[path.length - 1]] = value;
+  }
+  return next as unknown as AnalyticsData;
+};
+
 export const usePythonAPI = (pollInterval = 5000) => {
   const [analytics, setAnalytics] = useState<AnalyticsData | null>(null);
   const [detections, setDetections] = useState<Detection[]>([]);
@@ -64,6 +100,8 @@ export const usePythonAPI = (pollInterval = 5000) => {
   const [error, setError] = useState<string | null>(null);
   const [lastUpdate, setLastUpdate] = useState<Date | null>(null);
   const [isLoading, setIsLoading] = useState(false);
+  // While the /api/events push stream is open, analytics are not polled
+  const analyticsStreamOpen = useRef(false);
 
   const fetchData = useCallback(async (endpoint: string) => {
     try {
@@ -75,59 +113,34 @@ export const usePythonAPI = (pollInterval = 5000) => {
     }
   }, []);
 
-  const fetchStatus = useCallback(async () => {
+  // One request for everything; the server caches the serialized body per state
+  // version and answers unchanged ETags with 304, which the browser cache resolves
+  const fetchDashboard = useCallback(async () => {
     try {
-      const data = await fetchData('/api/status');
-      setStatus(data);
+      const data = await fetchData('/api/dashboard');
+      setStatus(data.status);
       setIsConnected(true);
       setError(null);
+      if (!analyticsStreamOpen.current) {
+        setAnalytics(data.analytics);
+        setLastUpdate(new Date());
+      }
+      setDetections(data.detections || []);
+      setHeatmap(data.heatmap?.zones || []);
     } catch (err) {
       setIsConnected(false);
       setError('Python API not connected. Start your local server.');
     }
   }, [fetchData]);
 
-  const fetchAnalytics = useCallback(async () => {
-    try {
-      const data = await fetchData('/api/analytics');
-      setAnalytics(data);
-      setLastUpdate(new Date());
-    } catch (err) {
-      console.error('Failed to fetch analytics:', err);
-    }
-  }, [fetchData]);
-
-  const fetchDetections = useCallback(async () => {
-    try {
-      const data = await fetchData('/api/detections');
-      setDetections(data.detections || []);
-    } catch (err) {
-      console.error('Failed to fetch detections:', err);
-    }
-  }, [fetchData]);
-
-  const fetchHeatmap = useCallback(async () => {
-    try {
-      const data = await fetchData('/api/heatmap');
-      setHeatmap(data.zones || []);
-    } catch (err) {
-      console.error('Failed to fetch heatmap:', err);
-    }
-  }, [fetchData]);
-
   const refreshAll = useCallback(async () => {
     setIsLoading(true);
     try {
-      await Promise.all([
-        fetchStatus(),
-        fetchAnalytics(),
-        fetchDetections(),
-        fetchHeatmap()
-      ]);
+      await fetchDashboard();
     } finally {
       setIsLoading(false);
     }
-  }, [fetchStatus, fetchAnalytics, fetchDetections, fetchHeatmap]);
+  }, [fetchDashboard]);
 
   useEffect(() => {
     // Initial fetch
@@ -144,6 +157,38 @@ export const usePythonAPI = (pollInterval = 5000) => {
     };
   }, [refreshAll, pollInterval]);
 
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return;
+
+    // Analytics are pushed by the server; EventSource resumes from the last
+    // event id on reconnect, so only missed changes are sent
+    const source = new EventSource(`${API_BASE_URL}/api/events`);
+    source.onopen = () => {
+      analyticsStreamOpen.current = true;
+    };
+    source.onerror = () => {
+      // Fall back to polling until the stream reconnects
+      analyticsStreamOpen.current = false;
+    };
+    source.addEventListener('snapshot', (event) => {
+      const { snapshot } = JSON.parse((event as MessageEvent).data);
+      setAnalytics({ ...snapshot, timestamp: new Date().toISOString() });
+      setLastUpdate(new Date());
+    });
+    source.addEventListener('changes', (event) => {
+      const payload: AnalyticsChangesEvent = JSON.parse((event as MessageEvent).data);
+      setAnalytics(prev => prev
+        ? { ...applyAnalyticsChanges(prev, payload), timestamp: new Date().toISOString() }
+        : prev);
+      setLastUpdate(new Date());
+    });
+
+    return () => {
+      analyticsStreamOpen.current = false;
+      source.close();
+    };
+  }, []);
+
   return {
     analytics,
     detections,
@@ -156,3 +201,66 @@ export const usePythonAPI = (pollInterval = 5000) => {
     isLoading
   };
 };
+
+export interface HistoryQuery {
+  metric?: 'entries' | 'exits' | 'male' | 'female' | 'detections' | 'occupancy';
+  start?: Date;
+  end?: Date;
+  granularity?: 'minute' | 'hour' | 'day';
+  step?: number;
+  camera?: string;
+  breakdown?: 'gender' | 'camera';
+}
+
+export interface HistoryResult {
+  metric: string;
+  granularity: 'minute' | 'hour' | 'day';
+  step: number;
+  buckets: number[]; // bucket start times, epoch seconds
+  series: Record<string, number[]>;
+  totals: Record<string, number>;
+  peak?: Record<string, number[]>;
+}
+
+// Historical counts from /api/history (persisted rollups); refetched when the query changes
+export const useAnalyticsHistory = (query: HistoryQuery, refreshInterval = 60000) => {
+  const [history, setHistory] = useState<HistoryResult | null>(null);
+  const [error, setError] = useState<string | null>(null);
+  const { metric, start, end, granularity, step, camera, breakdown } = query;
+  const startTime = start?.getTime();
+  const endTime = end?.getTime();
+
+  useEffect(() => {
+    const params = new URLSearchParams();
+    if (metric) params.set('metric', metric);
+    if (startTime !== undefined) params.set('start', String(startTime / 1000));
+    if (endTime !== undefined) params.set('end', String(endTime / 1000));
+    if (granularity) params.set('granularity', granularity);
+    if (step) params.set('step', String(step));
+    if (camera) params.set('camera', camera);
+    if (breakdown) params.set('breakdown', breakdown);
+
+    let cancelled = false;
+    const load = async () => {
+      try {
+        const response = await fetch(`${API_BASE_URL}/api/history?${params}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const data: HistoryResult = await response.json();
+        if (!cancelled) {
+          setHistory(data);
+          setError(null);
+        }
+      } catch (err) {
+        if (!cancelled) setError('History not available');
+      }
+    };
+    load();
+    const intervalId = setInterval(load, refreshInterval);
+    return () => {
+      cancelled = true;
+      clearInterval(intervalId);
+    };
+  }, [metric, startTime, endTime, granularity, step, camera, breakdown, refreshInterval]);
+
+  return { history, error };
+};
@@ -270,6 +270,7 @@ const CameraManagement: React.FC = () => {
                     <>
                       <VideoStream 
                         cameraId={camera.id}
+                        tier="preview"
                         className="absolute inset-0"
                       />
                       <div className="absolute top-3 left-3 flex items-center gap-2 z-10">
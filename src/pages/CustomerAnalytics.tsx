@@ -6,7 +6,7 @@ import { Badge } from '@/components/ui/badge';
 import { Users, UserCheck, User, TrendingUp, Clock, Calendar, Download, FileText, Activity, RefreshCw, Loader2 } from 'lucide-react';
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, PieChart, Pie, Cell, LineChart, Line, Legend } from 'recharts';
 import { useAnalyticsExport } from '@/hooks/useAnalyticsExport';
-import { usePythonAPI } from '@/hooks/usePythonAPI';
+import { usePythonAPI, useAnalyticsHistory } from '@/hooks/usePythonAPI';
 import APIConnectionStatus from '@/components/APIConnectionStatus';
 import { toast } from 'sonner';
 
@@ -53,6 +53,15 @@ const CustomerAnalytics: React.FC = () => {
   const { analytics, isConnected, error, refreshAll, lastUpdate, isLoading } = usePythonAPI(5000); // 5 second refresh to reduce API load
   const { exportToCSV, exportToPDF } = useAnalyticsExport();
 
+  // Last 7 days of male/female visits from the server's persisted history
+  const weekStart = useMemo(() => {
+    const start = new Date();
+    start.setHours(0, 0, 0, 0);
+    start.setDate(start.getDate() - 6);
+    return start;
+  }, []);
+  const { history: weeklyHistory } = useAnalyticsHistory({ breakdown: 'gender', granularity: 'day', start: weekStart });
+
   // Use API data if connected, otherwise use mock data
   const visitorData = useMemo(() => {
     if (isConnected && analytics) {
@@ -152,8 +161,17 @@ const CustomerAnalytics: React.FC = () => {
     return AGE_DISTRIBUTION;
   }, [analytics, isConnected]);
 
-  // Generate weekly trend from hourly data or use mock
+  // Weekly trend from history, else scaled from today's data, else mock
   const weeklyVisitorsData = useMemo(() => {
+    if (weeklyHistory && weeklyHistory.buckets.length > 0) {
+      const { male = [], female = [] } = weeklyHistory.series;
+      return weeklyHistory.buckets.map((bucket, i) => ({
+        day: new Date(bucket * 1000).toLocaleDateString('en-US', { weekday: 'short' }),
+        visitors: (male[i] || 0) + (female[i] || 0),
+        male: male[i] || 0,
+        female: female[i] || 0,
+      }));
+    }
     if (isConnected && analytics?.person_counting?.hourly_foot_traffic) {
       // Generate weekly trend from current day's data
       // For demo purposes, we'll use mock data but could be enhanced with historical data
@@ -168,7 +186,7 @@ const CustomerAnalytics: React.FC = () => {
       }));
     }
     return WEEKLY_VISITORS;
-  }, [analytics, isConnected]);
+  }, [analytics, isConnected, weeklyHistory]);
 
   // Gender data for pie chart
   const genderData = useMemo(() => [
@@ -187,7 +205,7 @@ const CustomerAnalytics: React.FC = () => {
         peakHour: visitorData.peakHour,
       },
       hourlyVisitors: hourlyVisitorsData,
-      weeklyVisitors: WEEKLY_VISITORS,
+      weeklyVisitors: weeklyVisitorsData,
       ageDistribution: ageDistributionData,
     });
     toast.success('CSV report downloaded successfully');
@@ -204,7 +222,7 @@ const CustomerAnalytics: React.FC = () => {
         peakHour: visitorData.peakHour,
       },
       hourlyVisitors: hourlyVisitorsData,
-      weeklyVisitors: WEEKLY_VISITORS,
+      weeklyVisitors: weeklyVisitorsData,
       ageDistribution: ageDistributionData,
     });
     toast.success('PDF report downloaded successfully');